@@ -0,0 +1,210 @@
+"""Offline stand-ins for Google Sheets and the Telegram Bot API."""
+import asyncio
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+class FakeWorksheet:
+    """The gspread Worksheet calls the backends make, against rows in memory.
+
+    Every call sleeps `latency` seconds (a Sheets round trip is 100-500 ms
+    in production) and is counted in the spreadsheet's `calls`.
+    """
+
+    def __init__(self, spreadsheet, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [list(map(str, r)) for r in rows or []]
+        self.lock = threading.Lock()
+
+    def call(self, op):
+        self.spreadsheet.record(op)
+
+    @staticmethod
+    def numericise(value):
+        # gspread's get_all_records turns numeric strings into numbers
+        if re.fullmatch(r"-?\d+", value):
+            return int(value)
+        return value
+
+    def get_all_values(self):
+        self.call("get_all_values")
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def get_all_records(self):
+        self.call("get_all_records")
+        with self.lock:
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            return [{h: self.numericise(r[i]) if i < len(r) else "" for i, h in enumerate(header)} for r in self.rows[1:]]
+
+    def row_values(self, row):
+        self.call("row_values")
+        with self.lock:
+            return list(self.rows[row - 1]) if 0 < row <= len(self.rows) else []
+
+    def get(self, cells, **kwargs):
+        # "A5:F" style ranges: those rows, up to the given column
+        self.call("get")
+        start, end = cells.split(":")
+        first = int(re.match(r"[A-Z]+(\d+)$", start).group(1))
+        last = ord(end) - 64
+        with self.lock:
+            return [list(r[:last]) for r in self.rows[first - 1:]]
+
+    def batch_get(self, ranges, **kwargs):
+        # Single cells only ("A5"), which is all the write buffer asks for
+        self.call("batch_get")
+        with self.lock:
+            values = []
+            for cell in ranges:
+                letters, digits = re.match(r"([A-Z]+)(\d+)$", cell).groups()
+                col = 0
+                for ch in letters:
+                    col = col * 26 + ord(ch) - 64
+                row = self.rows[int(digits) - 1] if int(digits) <= len(self.rows) else []
+                values.append([[row[col - 1]]] if col <= len(row) and row[col - 1] != "" else [])
+            return values
+
+    def find(self, query, in_column=None):
+        self.call("find")
+        with self.lock:
+            for r, values in enumerate(self.rows, start=1):
+                for c, value in enumerate(values, start=1):
+                    if value == str(query) and (in_column is None or in_column == c):
+                        return FakeCell(r, c, value)
+        return None
+
+    def appended(self, first, count):
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:H{first + count - 1}"}}
+
+    def append_row(self, values, **kwargs):
+        self.call("append_row")
+        with self.lock:
+            self.rows.append([str(v) for v in values])
+            return self.appended(len(self.rows), 1)
+
+    def append_rows(self, rows, **kwargs):
+        self.call("append_rows")
+        with self.lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(v) for v in values] for values in rows)
+            return self.appended(first, len(rows))
+
+    def set_cell(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = str(value)
+
+    def update_cell(self, row, col, value):
+        self.call("update_cell")
+        with self.lock:
+            self.set_cell(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        self.call("batch_update")
+        with self.lock:
+            for item in data:
+                letters, digits = re.match(r"([A-Z]+)(\d+)", item["range"]).groups()
+                col = 0
+                for ch in letters:
+                    col = col * 26 + ord(ch) - 64
+                self.set_cell(int(digits), col, item["values"][0][0])
+
+class FakeSpreadsheet:
+    """Spreadsheet with the Realtors/Requests/Transactions tabs, counting API calls."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tabs = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, op):
+        with self.lock:
+            self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def worksheets(self):
+        self.record("worksheets")
+        return list(self.tabs.values())
+
+    def worksheet(self, title):
+        self.record("worksheet")
+        if title not in self.tabs:
+            raise LookupError(f"Worksheet {title} not found")
+        return self.tabs[title]
+
+    def add_worksheet(self, title, rows=1000, cols=10):
+        self.record("add_worksheet")
+        ws = self.tabs[title] = FakeWorksheet(self, title)
+        return ws
+
+class FakeTelegram:
+    """Bot API server on localhost; aiogram is pointed at it with TelegramAPIServer.from_base().
+
+    Answers the methods the bot uses with plausible results, optionally
+    after `latency` seconds, and counts calls per method.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+        # on_call(method, params) runs once a call is answered, to let drivers wait for replies
+        self.on_call = None
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.body_exists else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.on_call:
+            self.on_call(method, params)
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "sendMessage":
+            return {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
@@ -0,0 +1,513 @@
+"""Local stand-in for the Google Sheets v4 and Drive v3 endpoints gspread uses.
+
+    python benchmarks/sheets_server.py --backend sheets --latency 0.1
+    python benchmarks/sheets_server.py --backend sqlite --write-quota 60 --error-rate 0.05
+
+Unlike FakeSpreadsheet, the real gspread client runs against it: requests
+to sheets.googleapis.com and www.googleapis.com are rerouted to a
+threaded HTTP server on localhost, which keeps the spreadsheets in
+memory. Latency, per-minute read/write quotas (429 RESOURCE_EXHAUSTED)
+and random or scheduled failures (5xx) are configurable, and every API
+call is counted.
+
+Run as a script, it drives each storage operation once through
+utils/db.py and prints the Sheets API calls it cost.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOOGLE_HOSTS = ("https://sheets.googleapis.com", "https://www.googleapis.com")
+
+SPREADSHEET = re.compile(r"^/v4/spreadsheets/([^/:]+)(?::(batchUpdate))?$")
+VALUES = re.compile(r"^/v4/spreadsheets/([^/:]+)/values(?:/([^/:]+))?(?::(\w+))?$")
+CELL = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+ERRORS = {
+    400: "INVALID_ARGUMENT",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def col_letters(col):
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def col_number(letters):
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + ord(ch) - 64
+    return col
+
+def split_range(name):
+    """("Realtors", "A2:2") from "'Realtors'!A2:2"; the range part may be empty."""
+    if name.startswith("'"):
+        end = name.index("'", 1)
+        while name[end + 1:end + 2] == "'":
+            end = name.index("'", end + 2)
+        title, rest = name[1:end].replace("''", "'"), name[end + 1:]
+        return title, rest[1:] if rest.startswith("!") else ""
+    title, _, cells = name.partition("!")
+    return title, cells
+
+def parse_cells(cells):
+    """(row1, col1, row2, col2), 1-based and inclusive; None means open-ended."""
+    if not cells:
+        return 1, 1, None, None
+    start, _, end = cells.partition(":")
+    c1, r1 = CELL.match(start).groups()
+    if not end:
+        return int(r1 or 1), col_number(c1) if c1 else 1, int(r1) if r1 else None, col_number(c1) if c1 else None
+    c2, r2 = CELL.match(end).groups()
+    return (int(r1 or 1), col_number(c1) if c1 else 1,
+            int(r2) if r2 else None, col_number(c2) if c2 else None)
+
+class Sheet:
+    def __init__(self, sheet_id, title, index, rows=1000, cols=26):
+        self.id = sheet_id
+        self.title = title
+        self.index = index
+        self.rows = rows
+        self.cols = cols
+        self.values = []
+
+    def properties(self):
+        return {
+            "sheetId": self.id, "title": self.title, "index": self.index, "sheetType": "GRID",
+            "gridProperties": {"rowCount": self.rows, "columnCount": self.cols},
+        }
+
+    def a1(self, row1, col1, row2, col2):
+        return f"'{self.title}'!{col_letters(col1)}{row1}:{col_letters(col2)}{row2}"
+
+    def read(self, cells):
+        row1, col1, row2, col2 = parse_cells(cells)
+        rows = self.values[row1 - 1:row2]
+        rows = [r[col1 - 1:col2] for r in rows]
+        rows = [self.trim(r) for r in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    @staticmethod
+    def trim(row):
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        return row
+
+    def write(self, row, col, values):
+        last_col = col + max((len(r) for r in values), default=1) - 1
+        if row + len(values) - 1 > self.rows or last_col > self.cols:
+            raise APIError(400, f"Range ({self.title}!{col_letters(col)}{row}) exceeds grid limits. "
+                                f"Max rows: {self.rows}, max columns: {self.cols}")
+        for offset, values_row in enumerate(values):
+            r = row + offset
+            while len(self.values) < r:
+                self.values.append([])
+            cells = self.values[r - 1]
+            while len(cells) < col + len(values_row) - 1:
+                cells.append("")
+            for i, value in enumerate(values_row):
+                cells[col - 1 + i] = "" if value is None else str(value)
+        return self.a1(row, col, row + len(values) - 1, last_col)
+
+    def append(self, values):
+        # The table ends at the last row with anything in it; new rows go right below
+        last = len(self.values)
+        while last and not any(self.values[last - 1]):
+            last -= 1
+        self.rows = max(self.rows, last + len(values))
+        self.cols = max([self.cols] + [len(r) for r in values])
+        return self.write(last + 1, 1, values)
+
+class Spreadsheet:
+    def __init__(self, key, title):
+        self.key = key
+        self.title = title
+        self.sheets = []
+        self.sheet_ids = itertools.count(0)
+        self.created = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+    def add(self, title, rows=1000, cols=26):
+        if self.sheet(title):
+            raise APIError(400, f'A sheet with the name "{title}" already exists. Please enter another name.')
+        sheet = Sheet(next(self.sheet_ids), title, len(self.sheets), rows, cols)
+        self.sheets.append(sheet)
+        return sheet
+
+    def sheet(self, title):
+        return next((s for s in self.sheets if s.title == title), None)
+
+    def metadata(self):
+        return {
+            "spreadsheetId": self.key,
+            "properties": {"title": self.title, "locale": "en_US", "timeZone": "Asia/Tashkent"},
+            "sheets": [{"properties": s.properties()} for s in self.sheets],
+            "spreadsheetUrl": f"https://docs.google.com/spreadsheets/d/{self.key}/edit",
+        }
+
+class QuotaWindow:
+    """Calls in the last 60 seconds, like the per-user per-minute Sheets quotas."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.calls = deque()
+
+    def take(self):
+        if not self.limit:
+            return True
+        now = time.monotonic()
+        while self.calls and now - self.calls[0] > 60:
+            self.calls.popleft()
+        if len(self.calls) >= self.limit:
+            return False
+        self.calls.append(now)
+        return True
+
+class SheetsServer:
+    """Sheets v4 / Drive v3 stand-in on localhost.
+
+    `latency` (+ up to `jitter`) seconds are spent on every call,
+    `error_rate` of calls fail with 503, and reads or writes beyond
+    `read_quota` / `write_quota` per minute get 429. fail(n) makes the
+    next n calls fail regardless. `calls` counts calls by operation.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, read_quota=None, write_quota=None, seed=17):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quotas = {"read": QuotaWindow(read_quota), "write": QuotaWindow(write_quota)}
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.spreadsheets = {}
+        self.keys = itertools.count(1)
+        self.scheduled = deque()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.httpd = None
+        self.url = None
+
+    def create(self, title="Bench"):
+        with self.lock:
+            key = f"fake{next(self.keys):04d}"
+            book = self.spreadsheets[key] = Spreadsheet(key, title)
+            book.add("Sheet1")
+            return book
+
+    def fail(self, count=1, status=503):
+        with self.lock:
+            self.scheduled.extend([status] * count)
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+            def do_PUT(self):
+                server.handle(self, "PUT")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, name="sheets-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def session(self):
+        """A requests session whose Google API calls land on this server."""
+        session = requests.Session()
+        adapter = LocalAdapter(self.url)
+        for host in GOOGLE_HOSTS:
+            session.mount(host, adapter)
+        return session
+
+    def client(self):
+        import gspread
+        # No credentials: the session goes nowhere near Google
+        return gspread.Client(auth=None, session=self.session())
+
+    def open(self, key=None):
+        """gspread Spreadsheet for `key`, by default a fresh one; usable as open_sheet()."""
+        if key is None:
+            key = self.create().key
+        return self.client().open_by_url(f"https://docs.google.com/spreadsheets/d/{key}/edit")
+
+    def handle(self, request, method):
+        parts = urlsplit(request.path)
+        length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(length) or b"{}") if length else {}
+        params = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(parts.query).items()}
+        op = parts.path
+        try:
+            op, kind, action = self.route(method, parts.path)
+            with self.lock:
+                self.calls[op] += 1
+            self.admit(kind)
+            with self.lock:
+                status, payload = 200, action(body, params)
+        except APIError as e:
+            status = e.status
+            with self.lock:
+                self.errors[(op, status)] += 1
+            payload = {"error": {"code": status, "message": str(e), "status": ERRORS.get(status, "UNKNOWN")}}
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json; charset=UTF-8")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def admit(self, kind):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.random() * self.jitter)
+        with self.lock:
+            if self.scheduled:
+                raise APIError(self.scheduled.popleft(), "Injected failure")
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise APIError(503, "The service is currently unavailable.")
+            if not self.quotas[kind].take():
+                raise APIError(429, f"Quota exceeded for quota metric '{kind.title()} requests' and limit "
+                                    f"'{kind.title()} requests per minute per user'")
+
+    def route(self, method, path):
+        """(op name, "read" or "write", handler(body, params)) for a request."""
+        if path == "/drive/v3/files":
+            return "drive.files.list", "read", lambda body, params: self.drive_files()
+        if path.startswith("/drive/v3/files/"):
+            book = self.book(path.rsplit("/", 1)[1])
+            return "drive.files.get", "read", lambda body, params: self.drive_file(book)
+        m = SPREADSHEET.match(path)
+        if m:
+            book = self.book(m.group(1))
+            if m.group(2) and method == "POST":
+                return "batchUpdate", "write", lambda body, params: self.batch_update(book, body)
+            if method == "GET":
+                return "get", "read", lambda body, params: book.metadata()
+        m = VALUES.match(path)
+        if m:
+            book, name, verb = self.book(m.group(1)), unquote(m.group(2) or ""), m.group(3)
+            if not name and verb == "batchUpdate" and method == "POST":
+                return "values.batchUpdate", "write", lambda body, params: self.values_batch_update(book, body)
+            if not name and verb == "batchGet" and method == "GET":
+                return "values.batchGet", "read", lambda body, params: self.values_batch_get(book, params)
+            if name and verb == "append" and method == "POST":
+                return "values.append", "write", lambda body, params: self.values_append(book, name, body)
+            if name and verb == "clear" and method == "POST":
+                return "values.clear", "write", lambda body, params: self.values_clear(book, name)
+            if name and not verb and method == "PUT":
+                return "values.update", "write", lambda body, params: self.values_update(book, name, body)
+            if name and not verb and method == "GET":
+                return "values.get", "read", lambda body, params: self.values_get(book, name)
+        raise APIError(404, f"Unsupported {method} {path}")
+
+    def book(self, key):
+        book = self.spreadsheets.get(key)
+        if not book:
+            raise APIError(404, "Requested entity was not found.")
+        return book
+
+    def sheet(self, book, name):
+        title, cells = split_range(name)
+        sheet = book.sheet(title)
+        if not sheet:
+            raise APIError(400, f"Unable to parse range: {name}")
+        return sheet, cells
+
+    def drive_file(self, book):
+        return {"kind": "drive#file", "id": book.key, "name": book.title,
+                "mimeType": "application/vnd.google-apps.spreadsheet",
+                "createdTime": book.created, "modifiedTime": book.created}
+
+    def drive_files(self):
+        return {"kind": "drive#fileList", "files": [self.drive_file(b) for b in self.spreadsheets.values()]}
+
+    def batch_update(self, book, body):
+        replies = []
+        for req in body.get("requests", []):
+            if "addSheet" in req:
+                props = req["addSheet"].get("properties", {})
+                grid = props.get("gridProperties", {})
+                sheet = book.add(props.get("title", f"Sheet{len(book.sheets) + 1}"),
+                                 grid.get("rowCount", 1000), grid.get("columnCount", 26))
+                replies.append({"addSheet": {"properties": sheet.properties()}})
+            else:
+                raise APIError(400, f"Unsupported request: {', '.join(req)}")
+        return {"spreadsheetId": book.key, "replies": replies}
+
+    def values_get(self, book, name):
+        sheet, cells = self.sheet(book, name)
+        result = {"range": name, "majorDimension": "ROWS"}
+        values = sheet.read(cells)
+        if values:
+            result["values"] = values
+        return result
+
+    def values_batch_get(self, book, params):
+        ranges = params.get("ranges", [])
+        ranges = [ranges] if isinstance(ranges, str) else ranges
+        return {"spreadsheetId": book.key, "valueRanges": [self.values_get(book, name) for name in ranges]}
+
+    def values_append(self, book, name, body):
+        sheet, _ = self.sheet(book, name)
+        values = body.get("values", [])
+        updated = sheet.append(values)
+        return {"spreadsheetId": book.key, "tableRange": f"'{sheet.title}'!A1", "updates": {
+            "spreadsheetId": book.key, "updatedRange": updated, "updatedRows": len(values),
+            "updatedColumns": max((len(r) for r in values), default=0),
+            "updatedCells": sum(len(r) for r in values),
+        }}
+
+    def write(self, book, name, values):
+        sheet, cells = self.sheet(book, name)
+        row, col, _, _ = parse_cells(cells)
+        updated = sheet.write(row, col, values)
+        return {"spreadsheetId": book.key, "updatedRange": updated, "updatedRows": len(values),
+                "updatedColumns": max((len(r) for r in values), default=0),
+                "updatedCells": sum(len(r) for r in values)}
+
+    def values_update(self, book, name, body):
+        return self.write(book, name, body.get("values", []))
+
+    def values_batch_update(self, book, body):
+        responses = [self.write(book, item["range"], item.get("values", [])) for item in body.get("data", [])]
+        return {"spreadsheetId": book.key, "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "responses": responses}
+
+    def values_clear(self, book, name):
+        sheet, cells = self.sheet(book, name)
+        row1, col1, row2, col2 = parse_cells(cells)
+        for r in sheet.values[row1 - 1:row2]:
+            for c in range(col1 - 1, min(len(r), col2 or len(r))):
+                r[c] = ""
+        return {"spreadsheetId": book.key, "clearedRange": name}
+
+class LocalAdapter(HTTPAdapter):
+    """Sends requests to `base` instead of the host in their URL, keeping path and query."""
+
+    def __init__(self, base):
+        super().__init__()
+        self.base = base
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = self.base + parts.path + (f"?{parts.query}" if parts.query else "")
+        return super().send(request, **kwargs)
+
+def operations(uid=900_000_001):
+    """(name, storage method, args) for one pass over the storage interface."""
+    return [
+        ("add_realtor", "add_realtor", (uid, "Rieltor", "Chilonzor", "Sotib olish", "+998900000001")),
+        ("get_realtor", "get_realtor", (uid,)),
+        ("get_realtors_by_filter", "get_realtors_by_filter", ("Chilonzor", "sotib olish")),
+        ("get_all_realtors", "get_all_realtors", ()),
+        ("update_balance", "update_balance", (uid, 50000)),
+        ("add_request", "add_request", ({"type": "sotib olish", "region": "Chilonzor", "rooms": "2",
+                                          "price": "400-600", "phone": "+998910000001"},)),
+        ("get_request", "get_request", ("{req_id}",)),
+        ("get_pending_requests", "get_pending_requests", ()),
+        ("update_request_status", "update_request_status", ("{req_id}", "Approved")),
+        ("update_request_details", "update_request_details", ("{req_id}", "Chilonzor", "500", "3")),
+        ("purchase_contact", "purchase_contact", (uid, "{req_id}", 5000)),
+        ("purchase_contact (repeat)", "purchase_contact", (uid, "{req_id}", 5000)),
+        ("get_stats", "get_stats", ()),
+        ("reconcile_realtors", "reconcile_realtors", ()),
+    ]
+
+async def measure(server):
+    import utils.backends.sheets as sheets
+    sheets.open_sheet = server.open
+
+    before = Counter(server.calls)
+    from utils.db import storage
+    await storage.start()
+    backend = storage.backend
+    mirror = getattr(backend, "mirror", None)
+    # The mirror connects in the background; count that as part of connecting
+    await asyncio.to_thread((mirror or backend).client.connected.wait, 30)
+    rows = [("connect", Counter(server.calls) - before)]
+    buffer = getattr(backend, "buffer", None) or getattr(mirror, "buffer", None)
+
+    req_id = None
+    for name, method, args in operations():
+        args = tuple(req_id if a == "{req_id}" else a for a in args)
+        before = Counter(server.calls)
+        result = await getattr(storage, method)(*args)
+        if method == "add_request":
+            req_id = result
+        if buffer:
+            # Charge write-behind calls to the operation that queued them
+            await asyncio.to_thread(buffer.flush)
+        rows.append((name, Counter(server.calls) - before))
+    storage.shutdown()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Sheets API calls per storage operation, against the local stand-in")
+    parser.add_argument("--backend", choices=("sheets", "sqlite"), default="sheets")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--read-quota", type=int)
+    parser.add_argument("--write-quota", type=int)
+    args = parser.parse_args()
+
+    server = SheetsServer(args.latency, args.jitter, args.error_rate, args.read_quota, args.write_quota).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "STORAGE_BACKEND": args.backend, "SHEETS_MIRROR": "1", "MOCK_DB_PATH": "",
+            "SQLITE_PATH": os.path.join(tmp, "data.db"), "WARM_SNAPSHOT_PATH": os.path.join(tmp, "snapshot.json"),
+            "WRITE_SPILL_PATH": os.path.join(tmp, "unsent_{name}.json"), "WRITE_QUOTA_PER_MIN": "100000",
+        })
+        sys.path.insert(0, ROOT)
+        rows = asyncio.run(measure(server))
+
+    print(f"{'operation':<26} {'calls':>5}  breakdown")
+    for name, calls in rows:
+        breakdown = ", ".join(f"{op} {n}" for op, n in sorted(calls.items()))
+        print(f"{name:<26} {sum(calls.values()):>5}  {breakdown}")
+    if server.errors:
+        print("errors: " + ", ".join(f"{op} {status} x{n}" for (op, status), n in sorted(server.errors.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Time from process start to the first useful response, cold and warm.
+
+    python benchmarks/startup.py --latency 0.2 --realtors 2000 --requests 5000
+    python benchmarks/startup.py --backend sheets --runs 3
+
+Starts `python main.py` (web only, BOT_MODE=off) against the local Sheets
+stand-in (see sheets_server.py) and measures, from the moment the
+process is started:
+
+  listening     /metrics answers (Python imports included)
+  first data    /admin/api/realtors returns a page with realtors
+  sheet loaded  /admin/sheets reports the sheet connected and loaded
+
+Each backend is started on the same files two or more times: cold
+(nothing on disk), then warm (with the database or the sheet snapshot
+the previous run left behind), the way a redeploy with a persistent
+disk restarts.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from sheets_server import SheetsServer
+from suite import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child(url, key, log_level):
+    """The app as main.py runs it, with open_sheet() pointed at the parent's stand-in."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    server = SheetsServer()
+    # Served by the parent process; only its address is needed here
+    server.url = url
+
+    import asyncio
+    import utils.backends.sheets as sheets
+    sheets.open_sheet = lambda: server.open(key)
+    import main
+    main.setup_logging(log_level)
+    try:
+        asyncio.run(main.main())
+    finally:
+        main.leader.release()
+        main.storage.shutdown()
+
+def seed(server, realtors, requests_count):
+    from utils.backends.base import REALTOR_HEADERS, REQUEST_HEADERS, TRANSACTION_HEADERS
+    from utils.backends.ledger import LEDGER_HEADERS
+    book = server.create()
+    sheet = server.open(book.key)
+    rows = {
+        "Realtors": [[700_000_000 + i, f"Rieltor {i}", "Chilonzor", "sotib olish", f"+99890{i:07d}", 100000,
+                      "2024-05-01 10:00:00"] for i in range(realtors)],
+        "Requests": [[str(10_000 + i), "sotib olish", "Chilonzor", "2", "400-600", f"+99891{i:07d}", "New",
+                      f"2024-05-{1 + i % 28:02d} 10:00:00"] for i in range(requests_count)],
+        "Transactions": [],
+        "Ledger": [],
+    }
+    headers = {"Realtors": REALTOR_HEADERS, "Requests": REQUEST_HEADERS,
+               "Transactions": TRANSACTION_HEADERS, "Ledger": LEDGER_HEADERS}
+    for tab, values in rows.items():
+        ws = sheet.add_worksheet(title=tab, rows=len(values) + 10, cols=10)
+        ws.append_rows([headers[tab]] + values)
+    return book.key
+
+def wait_for(check, deadline):
+    while time.time() < deadline:
+        try:
+            if check():
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.005)
+    return False
+
+def run_once(args, server, key, tmp, backend):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:benchmark",
+        "BOT_MODE": "off",
+        "PORT": str(port),
+        "STORAGE_BACKEND": backend,
+        "SHEETS_MIRROR": "1",
+        "SQLITE_PATH": os.path.join(tmp, "data.db"),
+        "WARM_SNAPSHOT_PATH": os.path.join(tmp, "snapshot.json"),
+        "WRITE_SPILL_PATH": os.path.join(tmp, "unsent_{name}.json"),
+        "MOCK_DB_PATH": "",
+        "FSM_PATH": os.path.join(tmp, "fsm.db"),
+        "LEADER_LOCK_PATH": os.path.join(tmp, "leader.lock"),
+        "WORKERS": "1",
+        "CHANNEL_ID": "",
+        "WRITE_QUOTA_PER_MIN": "100000",
+        "ADMIN_SECRET": "benchmark",
+        "ADMIN_IDS": "",
+    }
+    session = requests.Session()
+    session.auth = ("admin", env["ADMIN_SECRET"])
+    before = sum(server.calls.values())
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--child", server.url, key, "--log-level", args.log_level],
+        env=env, cwd=ROOT, stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + args.timeout
+        if not wait_for(lambda: session.get(f"{base}/metrics", timeout=args.timeout).ok, deadline):
+            raise RuntimeError(f"{backend}: not listening within {args.timeout}s")
+        listening = time.perf_counter() - started
+
+        def answered():
+            r = session.get(f"{base}/admin/api/realtors", params={"limit": 1}, timeout=args.timeout)
+            return r.ok and r.json()["items"]
+        if not wait_for(answered, deadline):
+            raise RuntimeError(f"{backend}: no realtors served within {args.timeout}s")
+        first = time.perf_counter() - started
+        calls = sum(server.calls.values()) - before
+
+        def loaded():
+            health = session.get(f"{base}/admin/sheets", timeout=args.timeout).json()
+            return health.get("state") == "ok" and health.get("loaded", True)
+        if not wait_for(loaded, deadline):
+            raise RuntimeError(f"{backend}: the sheet did not load within {args.timeout}s")
+        synced = time.perf_counter() - started
+        if backend == "sheets":
+            # The next run starts from the snapshot written once the sheet was read
+            wait_for(lambda: os.path.exists(env["WARM_SNAPSHOT_PATH"]), deadline)
+        return listening, first, synced, calls
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of main.py, cold and warm, against the local Sheets stand-in")
+    parser.add_argument("--backend", choices=("sheets", "sqlite", "all"), default="all")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per Sheets API call")
+    parser.add_argument("--realtors", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=2, help="starts per backend; the first one is cold")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    parser.add_argument("--child", nargs=2, metavar=("URL", "KEY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child, args.log_level)
+
+    sys.path.insert(0, ROOT)
+    server = SheetsServer().start()
+    key = seed(server, args.realtors, args.requests)
+    server.latency = args.latency
+
+    print(f"{'backend':<8} {'start':<6} {'listening':>10} {'first data':>11} {'sheet loaded':>13} {'Sheets calls':>13}")
+    backends = ("sheets", "sqlite") if args.backend == "all" else (args.backend,)
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            for run in range(args.runs):
+                listening, first, synced, calls = run_once(args, server, key, tmp, backend)
+                print(f"{backend:<8} {'cold' if run == 0 else 'warm':<6} {listening * 1000:>7.0f} ms "
+                      f"{first * 1000:>8.0f} ms {synced * 1000:>10.0f} ms {calls:>13}")
+    server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""Offline benchmark of the bot handlers and the web API.
+
+    python benchmarks/suite.py --backend sqlite --sheets-latency 0.1 --save-baseline base.json
+    python benchmarks/suite.py --backend sqlite --sheets-latency 0.1 --baseline base.json
+
+Runs the real dispatcher, FastAPI app and broadcaster in one process on
+temporary files. Google Sheets is replaced by an in-memory spreadsheet
+and the Bot API by a local server (see fakes.py), both with configurable
+latency, so nothing leaves the machine. Scenarios:
+
+  registration  N users go through /start -> name -> contact -> region -> type
+  api           POST /api/request burst
+  fanout        approve requests and wait until every matched realtor got the message
+  buy           concurrent buy_contact: taps, including repeat taps on one request
+
+Each reports throughput, p50/p99 latency and Sheets / Bot API call
+counts. With --baseline, a scenario whose throughput drops, p99 grows
+or call count grows by more than --tolerance fails the run (exit 1).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from fakes import FakeSpreadsheet, FakeTelegram
+from sheets_server import SheetsServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("registration", "api", "fanout", "buy", "admin")
+USER_BASE = 700_000_000
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+def configure(args, tmp):
+    """Environment for the app modules; must run before any of them is imported."""
+    os.environ.update({
+        "BOT_TOKEN": "123456:benchmark",
+        "BOT_MODE": "off",
+        "STORAGE_BACKEND": args.backend,
+        "SHEETS_MIRROR": "1" if args.mirror else "0",
+        "SQLITE_PATH": os.path.join(tmp, "data.db"),
+        "MOCK_DB_PATH": "",
+        "FSM_PATH": os.path.join(tmp, "fsm.db"),
+        "WARM_SNAPSHOT_PATH": os.path.join(tmp, "snapshot.json"),
+        "WRITE_SPILL_PATH": os.path.join(tmp, "unsent_{name}.json"),
+        "LEADER_LOCK_PATH": os.path.join(tmp, "leader.lock"),
+        "WORKERS": "1",
+        "CHANNEL_ID": "",
+        # The scenarios log in to the admin endpoints with any user name
+        "ADMIN_SECRET": "benchmark",
+        "ADMIN_IDS": "",
+        # Measure our own overhead, not Telegram's or Google's rate limits
+        "BROADCAST_RATE": "100000",
+        "BROADCAST_CHAT_INTERVAL": "0",
+        "WRITE_QUOTA_PER_MIN": "100000",
+        # Every simulated client posts from 127.0.0.1
+        "API_IP_RATE": "1000000",
+        "API_IP_BURST": "1000000",
+        "API_PHONE_BURST": "1000000",
+        "INGEST_QUEUE_SIZE": "100000",
+        "LOG_LEVEL": args.log_level,
+    })
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+class Bench:
+    """The app wired to the fakes, plus the drivers the scenarios share."""
+
+    def __init__(self, args):
+        self.args = args
+        if args.sheets == "http":
+            self.sheet = SheetsServer(args.sheets_latency).start()
+            self.open_sheet = self.sheet.open
+        else:
+            self.sheet = FakeSpreadsheet(args.sheets_latency)
+            self.open_sheet = lambda: self.sheet
+        self.telegram = FakeTelegram(args.telegram_latency)
+        self.update_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.waiters = {}
+
+    async def start(self):
+        import utils.backends.sheets as sheets
+        sheets.open_sheet = self.open_sheet
+
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        import uvicorn
+        import main
+        from utils.log import setup_logging
+        setup_logging(self.args.log_level)
+
+        self.main = main
+        self.bot, self.dp = main.bot, main.dp
+        self.db, self.storage = main.storage.backend, main.storage
+        mirror = getattr(self.db, "mirror", None)
+        if mirror:
+            # Connected in the background; scenarios should not pay for it
+            await asyncio.to_thread(mirror.client.connected.wait, 30)
+        self.broadcaster = main.broadcaster
+
+        await self.telegram.start()
+        self.telegram.on_call = self.answered
+        self.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(self.telegram.url, is_local=True))
+
+        port = free_port()
+        self.base = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        self.tasks = [asyncio.create_task(self.server.serve()), asyncio.create_task(self.broadcaster.run())]
+        if self.args.webhook:
+            self.tasks.append(asyncio.create_task(main.updates.run()))
+        while not self.server.started:
+            await asyncio.sleep(0.05)
+        self.http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.args.concurrency),
+                                          auth=aiohttp.BasicAuth("admin", os.environ["ADMIN_SECRET"]))
+
+    async def stop(self):
+        await self.http.close()
+        self.server.should_exit = True
+        await self.tasks[0]
+        for task in self.tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*self.tasks[1:], return_exceptions=True)
+        await self.bot.session.close()
+        await self.telegram.stop()
+        self.main.storage.shutdown()
+
+    def answered(self, method, params):
+        key = (method, str(params.get("chat_id") or params.get("callback_query_id")))
+        future = self.waiters.pop(key, None)
+        if future and not future.done():
+            future.set_result(params)
+
+    def expect(self, method, key):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[(method, str(key))] = future
+        return future
+
+    async def deliver(self, update):
+        if not self.args.webhook:
+            await self.dp.feed_raw_update(self.bot, update)
+            return
+        from utils.config import WEBHOOK_PATH, WEBHOOK_SECRET
+        while True:
+            async with self.http.post(self.base + WEBHOOK_PATH, json=update,
+                                      headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}) as resp:
+                if resp.status != 503:
+                    resp.raise_for_status()
+                    return
+            await asyncio.sleep(float(resp.headers.get("Retry-After", 1)))
+
+    async def step(self, update, method, key):
+        """Deliver an update and wait for the bot's `method` call that answers it."""
+        reply = self.expect(method, key)
+        await self.deliver(update)
+        await asyncio.wait_for(reply, 30)
+
+    def user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+
+    def message(self, uid, text=None, **extra):
+        msg = {"message_id": next(self.update_ids), "date": int(time.time()),
+               "chat": {"id": uid, "type": "private"}, "from": self.user(uid), **extra}
+        if text is not None:
+            msg["text"] = text
+        return {"update_id": next(self.update_ids), "message": msg}
+
+    def callback(self, uid, data):
+        callback_id = str(next(self.callback_ids))
+        update = {"update_id": next(self.update_ids), "callback_query": {
+            "id": callback_id, "from": self.user(uid), "chat_instance": str(uid), "data": data,
+            "message": {"message_id": next(self.update_ids), "date": int(time.time()),
+                        "chat": {"id": uid, "type": "private"}, "text": "Yangi so'rov"},
+        }}
+        return update, callback_id
+
+    async def flush_writes(self):
+        # Let write-behind buffers land, so each scenario is charged its own Sheets calls
+        buffer = getattr(self.db, "buffer", None) or getattr(getattr(self.db, "mirror", None), "buffer", None)
+        if buffer:
+            await asyncio.to_thread(buffer.flush)
+
+    async def measure(self, name, ops, run):
+        """Run `run(op)` for each of `ops` with --concurrency in flight."""
+        await self.flush_writes()
+        sheet_calls = sum(self.sheet.calls.values())
+        bot_calls = sum(self.telegram.calls.values())
+        latencies, errors = [], 0
+        gate = asyncio.Semaphore(self.args.concurrency)
+
+        async def one(op):
+            nonlocal errors
+            async with gate:
+                started = time.perf_counter()
+                try:
+                    await run(op)
+                except Exception as e:
+                    errors += 1
+                    if errors == 1:
+                        print(f"  {name}: first error: {e!r}", file=sys.stderr)
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(op) for op in ops))
+        elapsed = time.perf_counter() - started
+        await self.flush_writes()
+        return {
+            "ops": len(latencies),
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "errors": errors,
+            "sheets_calls": sum(self.sheet.calls.values()) - sheet_calls,
+            "bot_calls": sum(self.telegram.calls.values()) - bot_calls,
+        }
+
+    async def registration(self):
+        async def register(i):
+            uid = USER_BASE + i
+            contact = {"phone_number": f"+99890{i:07d}", "first_name": f"User{uid}", "user_id": uid}
+            for update in (self.message(uid, "/start"), self.message(uid, f"Rieltor {i}"),
+                           self.message(uid, contact=contact), self.message(uid, "Chilonzor"),
+                           self.message(uid, "Sotib olish")):
+                await self.step(update, "sendMessage", uid)
+        return await self.measure("registration", range(self.args.users), register)
+
+    def request_payload(self, i):
+        return {"request_type": "Sotib olish", "region": "Chilonzor", "rooms": str(1 + i % 4),
+                "price": "400-600", "phone": f"+99891{i:07d}"}
+
+    def request_record(self, i):
+        # What submit_request stores for the same payload
+        payload = self.request_payload(i)
+        return {"type": payload.pop("request_type").lower(), **payload}
+
+    async def api(self):
+        async def submit(i):
+            async with self.http.post(self.base + "/api/request", json=self.request_payload(i)) as resp:
+                body = await resp.json()
+                if resp.status != 200 or body.get("status") != "success":
+                    raise RuntimeError(f"HTTP {resp.status}: {body}")
+        return await self.measure("api", range(self.args.requests), submit)
+
+    async def seed_realtors(self):
+        # On top of whoever registered, so fan-out size does not depend on the scenario list
+        for i in range(self.args.realtors):
+            uid = USER_BASE + self.args.users + i
+            r_type = "Ikkisi ham" if i % 2 else "Sotib olish"
+            await self.storage.add_realtor(uid, f"Rieltor {uid}", "Chilonzor", r_type, f"+99893{i:07d}")
+
+    async def fanout(self):
+        await self.seed_realtors()
+        req_ids = [await self.storage.add_request(self.request_record(i))
+                   for i in range(self.args.approvals)]
+        self.approved = req_ids
+
+        async def approve(req_id):
+            async with self.http.post(self.base + "/admin/action", data={"req_id": req_id, "action": "approve"},
+                                      allow_redirects=False) as resp:
+                if resp.status != 303:
+                    raise RuntimeError(f"HTTP {resp.status}")
+            while True:
+                progress = self.broadcaster.progress(req_id)
+                if progress and progress["done"]:
+                    break
+                await asyncio.sleep(0.005)
+            if progress["failed"]:
+                raise RuntimeError(f"{progress['failed']} of {progress['total']} messages failed")
+        return await self.measure("fanout", req_ids, approve)
+
+    async def buy(self):
+        buyers = [USER_BASE + self.args.users + i for i in range(self.args.realtors)]
+        for uid in buyers:
+            await self.storage.update_balance(uid, 5000 * self.args.taps)
+        requests = getattr(self, "approved", None) or [
+            await self.storage.add_request(self.request_record(i)) for i in range(10)
+        ]
+        rng = random.Random(16)
+        taps = [(rng.choice(buyers), rng.choice(requests)) for _ in range(self.args.taps)]
+        # Impatient users: every tenth tap is repeated while the first is still in flight
+        taps += taps[::10]
+        rng.shuffle(taps)
+
+        async def tap(pair):
+            uid, req_id = pair
+            update, callback_id = self.callback(uid, f"buy_contact:{req_id}")
+            await self.step(update, "answerCallbackQuery", callback_id)
+        return await self.measure("buy", taps, tap)
+
+    async def admin(self):
+        # Every page of both dashboard tables; page latency should not grow with the tables
+        pages = []
+        for path in ("/admin/api/realtors", "/admin/api/requests"):
+            cursor = None
+            while True:
+                params = {"cursor": cursor} if cursor else {}
+                async with self.http.get(self.base + path, params=params) as resp:
+                    cursor = (await resp.json())["next"]
+                pages.append((path, params))
+                if not cursor:
+                    break
+
+        async def fetch(page):
+            path, params = page
+            async with self.http.get(self.base + path, params=params) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"HTTP {resp.status}")
+                await resp.read()
+        return await self.measure("admin", pages, fetch)
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as printable lines."""
+    failures = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            failures.append(f"{name}: throughput {r['throughput']} < baseline {base['throughput']}")
+        if r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p99 {r['p99_ms']} ms > baseline {base['p99_ms']} ms")
+        for key in ("sheets_calls", "bot_calls"):
+            # Call counts are nearly deterministic; allow the tolerance plus a couple for timer-driven flushes
+            if r[key] > base[key] * (1 + tolerance) + 2:
+                failures.append(f"{name}: {key} {r[key]} > baseline {base[key]}")
+        if r["errors"] > base["errors"]:
+            failures.append(f"{name}: {r['errors']} errors, baseline had {base['errors']}")
+    return failures
+
+def report(results, baseline):
+    print(f"{'scenario':<13} {'ops':>6} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'sheets':>7} {'bot':>6} {'errors':>6}")
+    for name, r in results.items():
+        line = (f"{name:<13} {r['ops']:>6} {r['throughput']:>9.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                f"{r['sheets_calls']:>7} {r['bot_calls']:>6} {r['errors']:>6}")
+        base = (baseline or {}).get(name)
+        if base and base["throughput"]:
+            line += f"   x{r['throughput'] / base['throughput']:.2f} vs baseline"
+        print(line)
+
+async def run(args):
+    bench = Bench(args)
+    await bench.start()
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = await getattr(bench, name)()
+    finally:
+        await bench.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--backend", choices=("sqlite", "sheets", "memory"), default="sqlite")
+    parser.add_argument("--no-mirror", dest="mirror", action="store_false", help="sqlite without the sheet mirror")
+    parser.add_argument("--sheets", choices=("memory", "http"), default="memory",
+                        help="in-memory gspread stand-in, or real gspread against sheets_server.py")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="seconds per Sheets call")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="seconds per Bot API call")
+    parser.add_argument("--webhook", action="store_true", help="deliver updates through the webhook endpoint")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--realtors", type=int, default=500)
+    parser.add_argument("--approvals", type=int, default=20)
+    parser.add_argument("--taps", type=int, default=500)
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--save-baseline", help="write this run's results here")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(args, tmp)
+        results = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results, baseline)
+    if args.save_baseline:
+        params = {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "json")}
+        with open(args.save_baseline, "w") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+    if baseline:
+        failures = compare(results, baseline, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
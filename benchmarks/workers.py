@@ -0,0 +1,112 @@
+"""Throughput of POST /api/request against 1..N worker processes.
+
+    python benchmarks/workers.py --workers 1 2 4 --seconds 10 --clients 64
+
+Each round starts workers.py on a fresh SQLite file (no sheet mirror,
+bot off), drives it with concurrent keep-alive clients and prints
+requests/sec with p50/p99 latency, so the effect of adding workers is
+visible directly.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+async def wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up")
+
+async def load(url, seconds, clients):
+    latencies, errors = [], 0
+    payload = {"request_type": "Sotib olish", "region": "chilonzor", "rooms": "2", "price": "50000", "phone": "+998900000000"}
+    deadline = time.perf_counter() + seconds
+
+    async def client(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=payload) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(clients)))
+    return latencies, errors
+
+def run_round(workers, seconds, clients):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, WORKERS=str(workers), PORT=str(port), BOT_MODE="off",
+                   BOT_TOKEN=os.getenv("BOT_TOKEN", "123456:benchmark"),
+                   STORAGE_BACKEND="sqlite", SHEETS_MIRROR="0",
+                   SQLITE_PATH=os.path.join(tmp, "data.db"), FSM_PATH=os.path.join(tmp, "fsm.db"),
+                   LEADER_LOCK_PATH=os.path.join(tmp, "leader.lock"))
+        proc = subprocess.Popen([sys.executable, "workers.py"], cwd=ROOT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_ready(base + "/"))
+            latencies, errors = asyncio.run(load(base + "/api/request", seconds, clients))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=60)
+    return {
+        "workers": workers,
+        "rps": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    baseline = None
+    for n in args.workers:
+        r = run_round(n, args.seconds, args.clients)
+        baseline = baseline or r["rps"]
+        print(f"{r['workers']:>7} {r['rps']:>9.0f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7}"
+              f"   x{r['rps'] / baseline:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+from bot.loader import bot
+from utils.config import (
+    BROADCAST_RATE, BROADCAST_CHAT_INTERVAL, BROADCAST_WORKERS, BROADCAST_MAX_RETRIES, WORKERS, SQLITE_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Recipients that can never succeed (blocked the bot, chat not found, ...)
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+class RateLimiter:
+    """Hands out send slots no faster than `rate` per second overall and
+    one per `chat_interval` seconds for any single chat."""
+
+    def __init__(self, rate, chat_interval):
+        self.interval = 1.0 / rate
+        self.chat_interval = chat_interval
+        self.next_slot = 0.0
+        self.chat_next = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        # No await between reading and moving the slots, so reservations never overlap
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        slot = max(slot, self.chat_next.get(chat_id, 0.0))
+        self.chat_next[chat_id] = slot + self.chat_interval
+        if len(self.chat_next) > 10000:
+            self.chat_next = {c: t for c, t in self.chat_next.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        # Telegram asked us to back off: hold every sender, not just the one that got the error
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcast_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    markup TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON broadcast_outbox(status, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_job ON broadcast_outbox(job_id);
+"""
+
+class Outbox:
+    """Broadcast messages shared by all worker processes, in the SQLite database.
+
+    Any worker adds messages; only the leader's Broadcaster claims and
+    sends them, so the overall Telegram rate limit holds however many
+    workers run. Delivery status is written back, so any worker can
+    report a job's progress.
+    """
+
+    def __init__(self, path, keep_seconds=7 * 24 * 3600):
+        self.path = path
+        self.keep_seconds = keep_seconds
+        self.local = threading.local()
+        self.conn().executescript(OUTBOX_SCHEMA)
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def write(self, statements):
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, args in statements:
+                conn.execute(sql, args)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add(self, job_id, messages):
+        now = time.time()
+        self.write([(
+            "INSERT INTO broadcast_outbox (job_id, chat_id, text, markup, created_at) VALUES (?, ?, ?, ?, ?)",
+            (str(job_id), str(chat_id), text, reply_markup.model_dump_json(exclude_none=True) if reply_markup else None, now)
+        ) for chat_id, text, reply_markup in messages])
+
+    def claim(self, limit):
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, job_id, chat_id, text, markup FROM broadcast_outbox WHERE status = 'queued' ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    f"UPDATE broadcast_outbox SET status = 'sending' WHERE id IN ({', '.join('?' * len(rows))})",
+                    [r[0] for r in rows]
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def release_claimed(self):
+        # A new leader resends what the previous one claimed but never finished
+        self.write([
+            ("UPDATE broadcast_outbox SET status = 'queued' WHERE status IN ('sending', 'retrying')", ()),
+            ("DELETE FROM broadcast_outbox WHERE created_at < ?", (time.time() - self.keep_seconds,))
+        ])
+
+    def mark(self, row_id, status, error=None):
+        self.conn().execute("UPDATE broadcast_outbox SET status = ?, error = ? WHERE id = ?", (status, error, row_id))
+
+    def progress(self, job_id):
+        conn = self.conn()
+        counts = {"queued": 0, "retrying": 0, "sent": 0, "failed": 0}
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM broadcast_outbox WHERE job_id = ? GROUP BY status", (str(job_id),)
+        ).fetchall()
+        if not rows:
+            return None
+        for status, count in rows:
+            counts["queued" if status == "sending" else status] += count
+        errors = dict(conn.execute(
+            "SELECT chat_id, error FROM broadcast_outbox WHERE job_id = ? AND error IS NOT NULL", (str(job_id),)
+        ).fetchall())
+        return {
+            "id": str(job_id),
+            "total": sum(counts.values()),
+            **counts,
+            "done": counts["queued"] == 0 and counts["retrying"] == 0,
+            "errors": errors,
+        }
+
+class BroadcastJob:
+    def __init__(self, job_id, chat_ids):
+        self.id = job_id
+        self.created_at = time.time()
+        self.status = {chat_id: "queued" for chat_id in chat_ids}
+        self.errors = {}
+
+    def progress(self):
+        counts = {"queued": 0, "retrying": 0, "sent": 0, "failed": 0}
+        for state in self.status.values():
+            counts[state] += 1
+        return {
+            "id": self.id,
+            "total": len(self.status),
+            **counts,
+            "done": counts["queued"] == 0 and counts["retrying"] == 0,
+            "errors": self.errors,
+        }
+
+class Broadcaster:
+    """Background fan-out queue for Telegram messages.
+
+    Messages are sent by a pool of workers at the highest rate Telegram
+    allows, honouring RetryAfter and retrying transient failures with
+    exponential backoff. Delivery status is tracked per recipient.
+
+    With an `outbox`, submit() only stores the messages; run() (on the
+    leader) claims them from the outbox and feeds the same queue.
+    """
+
+    def __init__(self, bot, rate=BROADCAST_RATE, chat_interval=BROADCAST_CHAT_INTERVAL,
+                 workers=BROADCAST_WORKERS, max_retries=BROADCAST_MAX_RETRIES, history=200, outbox=None):
+        self.bot = bot
+        self.limiter = RateLimiter(rate, chat_interval)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.history = history
+        self.queue = asyncio.Queue()
+        self.jobs = OrderedDict()
+        self.tasks = []
+        self.outbox = outbox
+
+    def job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self.jobs[job_id] = BroadcastJob(job_id, [])
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+        return job
+
+    async def submit(self, job_id, messages):
+        """Queue messages given as (chat_id, text, reply_markup) tuples."""
+        if self.outbox:
+            # A SQLite write, which may wait for another worker's lock: not on the loop
+            await asyncio.to_thread(self.outbox.add, job_id, messages)
+            return
+        job = self.job(job_id)
+        for chat_id, text, reply_markup in messages:
+            job.status[chat_id] = "queued"
+            self.queue.put_nowait((job, chat_id, text, reply_markup, 0, None))
+
+    def progress(self, job_id):
+        if self.outbox:
+            return self.outbox.progress(job_id)
+        job = self.jobs.get(job_id)
+        return job.progress() if job else None
+
+    def summary(self, job_ids):
+        """Combined progress of several jobs, e.g. one bulk approval; jobs not submitted yet count as pending."""
+        totals = {"jobs": 0, "pending": 0, "total": 0, "queued": 0, "retrying": 0, "sent": 0, "failed": 0}
+        for job_id in dict.fromkeys(job_ids):
+            progress = self.progress(job_id)
+            totals["jobs"] += 1
+            if not progress:
+                totals["pending"] += 1
+                continue
+            for key in ("total", "queued", "retrying", "sent", "failed"):
+                totals[key] += progress[key]
+        totals["done"] = totals["pending"] == 0 and totals["queued"] == 0 and totals["retrying"] == 0
+        return totals
+
+    async def set_status(self, item, status, error=None):
+        job, chat_id, row_id = item[0], item[1], item[5]
+        job.status[chat_id] = status
+        if error:
+            job.errors[chat_id] = error
+        if row_id is not None:
+            try:
+                await asyncio.to_thread(self.outbox.mark, row_id, status, job.errors.get(chat_id))
+            except Exception as e:
+                logger.error(f"Broadcast {job.id}: could not record status of {chat_id}: {e}")
+
+    async def send(self, item):
+        job, chat_id, text, reply_markup, attempt, row_id = item
+        await self.limiter.wait(chat_id)
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+            await self.set_status(item, "sent")
+            return
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+            delay = e.retry_after
+        except PERMANENT_ERRORS as e:
+            await self.set_status(item, "failed", str(e))
+            logger.warning(f"Broadcast {job.id}: giving up on {chat_id}: {e}")
+            return
+        except Exception as e:
+            job.errors[chat_id] = str(e)
+            delay = min(60, 2 ** attempt) + random.random()
+
+        if attempt >= self.max_retries:
+            await self.set_status(item, "failed")
+            logger.error(f"Broadcast {job.id}: failed to deliver to {chat_id} after {attempt + 1} attempts")
+            return
+        await self.set_status(item, "retrying")
+        retry = (job, chat_id, text, reply_markup, attempt + 1, row_id)
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, retry)
+
+    async def pull(self, batch=200, idle=0.5):
+        """Move messages from the shared outbox to the send queue (leader only)."""
+        await asyncio.to_thread(self.outbox.release_claimed)
+        while True:
+            rows = []
+            # Claim no more than the workers can start on soon, so a failover resends little
+            if self.queue.qsize() < batch:
+                try:
+                    rows = await asyncio.to_thread(self.outbox.claim, batch)
+                except Exception as e:
+                    logger.error(f"Broadcast outbox error: {e}")
+            for row_id, job_id, chat_id, text, markup in rows:
+                job = self.job(job_id)
+                job.status[chat_id] = "queued"
+                reply_markup = InlineKeyboardMarkup.model_validate_json(markup) if markup else None
+                self.queue.put_nowait((job, chat_id, text, reply_markup, 0, row_id))
+            if len(rows) < batch:
+                await asyncio.sleep(idle)
+
+    async def worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.send(item)
+            except Exception as e:
+                logger.error(f"Broadcast worker error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if self.outbox:
+            self.tasks.append(asyncio.create_task(self.pull()))
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+# Several workers share one outbox so that only the leader sends
+broadcaster = Broadcaster(bot, outbox=Outbox(SQLITE_PATH) if WORKERS > 1 else None)
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm(updated_at);
+"""
+
+class SQLiteFSMStorage(BaseStorage):
+    """aiogram FSM storage in a SQLite (WAL) file.
+
+    Registration flows survive restarts, and every bot worker pointed at
+    the same file sees the same state: each call is one statement (or one
+    BEGIN IMMEDIATE transaction for update_data), so concurrent processes
+    never interleave a read-modify-write. Sessions untouched for `ttl`
+    seconds count as abandoned; they read as empty and are purged from
+    the file every `purge_interval` seconds.
+    """
+
+    def __init__(self, path, ttl, purge_interval=600):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.local = threading.local()
+        self.connections = []
+        self.last_purge = 0.0
+        self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.connections.append(conn)
+        return conn
+
+    @staticmethod
+    def make_key(key):
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id,
+            getattr(key, "thread_id", None) or "",
+            getattr(key, "business_connection_id", None) or "",
+            key.destiny
+        ))
+
+    def cutoff(self):
+        return time.time() - self.ttl
+
+    # Blocking parts; run in a thread so a busy database never stalls the event loop
+
+    def _read(self, key):
+        row = self.conn().execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND updated_at >= ?", (key, self.cutoff())
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, {})
+
+    def _set_state(self, key, state):
+        now = time.time()
+        self.conn().execute(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, "
+            "data = CASE WHEN fsm.updated_at >= ? THEN fsm.data ELSE '{}' END",
+            (key, state, now, self.cutoff())
+        )
+        self.maybe_purge(now)
+
+    def _set_data(self, key, data):
+        now = time.time()
+        self.conn().execute(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at, "
+            "state = CASE WHEN fsm.updated_at >= ? THEN fsm.state ELSE NULL END",
+            (key, json.dumps(data, ensure_ascii=False), now, self.cutoff())
+        )
+        self.maybe_purge(now)
+
+    def _update_data(self, key, data):
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, current = self._read(key)
+            current.update(data)
+            conn.execute(
+                "INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                (key, state, json.dumps(current, ensure_ascii=False), time.time())
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.maybe_purge(time.time())
+        return dict(current)
+
+    def maybe_purge(self, now):
+        if now - self.last_purge < self.purge_interval:
+            return
+        self.last_purge = now
+        self.conn().execute("DELETE FROM fsm WHERE updated_at < ?", (self.cutoff(),))
+
+    # aiogram BaseStorage interface
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._set_state, self.make_key(key), state)
+
+    async def get_state(self, key):
+        state, _ = await asyncio.to_thread(self._read, self.make_key(key))
+        return state
+
+    async def set_data(self, key, data):
+        await asyncio.to_thread(self._set_data, self.make_key(key), dict(data))
+
+    async def get_data(self, key):
+        _, data = await asyncio.to_thread(self._read, self.make_key(key))
+        return data
+
+    async def update_data(self, key, data):
+        return await asyncio.to_thread(self._update_data, self.make_key(key), dict(data))
+
+    async def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
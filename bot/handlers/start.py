@@ -1,19 +1,18 @@
+from typing import Optional
 from aiogram import Router, F
 from aiogram.filters import CommandStart
-from aiogram.types import Message, ReplyKeyboardRemove
+from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from bot.states.realtor import RegisterState
 from bot.keyboards.reply import contact_kb, get_regions_kb, type_kb, menu_kb
 
-from utils.db import db
-from bot.loader import bot
+from utils.db import storage
 
 router = Router()
 
 @router.message(CommandStart())
-async def start_handler(message: Message, state: FSMContext):
-    # Check if already registered
-    realtor = db.get_realtor(message.from_user.id)
+async def start_handler(message: Message, state: FSMContext, realtor: Optional[list]):
+    # Check if already registered (realtor is looked up by RealtorContext)
     if realtor:
         await message.answer(f"Assalomu alaykum, {realtor[1]}! Xush kelibsiz.", reply_markup=menu_kb)
         return
@@ -22,8 +21,7 @@ async def start_handler(message: Message, state: FSMContext):
     await state.set_state(RegisterState.fullName)
 
 @router.message(F.text == "💰 Mening Balansim")
-async def balance_handler(message: Message):
-    realtor = db.get_realtor(message.from_user.id)
+async def balance_handler(message: Message, realtor: Optional[list]):
     if realtor:
         # realtor: id, name, region, type, phone, balance, reg
         # Balance is at index 5
@@ -64,7 +62,7 @@ async def get_type(message: Message, state: FSMContext):
     # Map text to simplified type if needed, or store as is
     # Data: telegram_id, full_name, region, r_type, phone
     
-    success = db.add_realtor(
+    success = await storage.add_realtor(
         telegram_id=message.from_user.id,
         full_name=data['fullName'],
         region=data['region'],
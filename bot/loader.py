@@ -2,7 +2,9 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
-from utils.config import BOT_TOKEN
+from bot.fsm_storage import SQLiteFSMStorage
+from utils.config import BOT_TOKEN, FSM_STORAGE, FSM_PATH, FSM_TTL
 
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+fsm_storage = SQLiteFSMStorage(FSM_PATH, FSM_TTL) if FSM_STORAGE == "sqlite" else MemoryStorage()
+dp = Dispatcher(storage=fsm_storage)
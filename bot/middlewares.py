@@ -0,0 +1,39 @@
+import time
+
+from aiogram import BaseMiddleware
+from utils.metrics import HANDLER_SECONDS, HANDLER_ERRORS
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware: records how long each handler takes, labelled by handler function."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+class RealtorContext(BaseMiddleware):
+    """Inner middleware: looks the sender's realtor row up once per update.
+
+    Handlers that take a `realtor` argument get the row (None when the
+    sender is not registered) instead of each calling get_realtor()
+    themselves; others do not pay for the lookup. Lookups of one user
+    arriving together (a double tap) share a single storage call.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        user = data.get("event_from_user")
+        wants = handler_object is None or "realtor" in handler_object.params or handler_object.varkw
+        if user is not None and wants and "realtor" not in data:
+            data["realtor"] = await self.storage.get_realtor(user.id)
+        return await handler(event, data)
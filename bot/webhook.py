@@ -0,0 +1,85 @@
+import asyncio
+import hmac
+import logging
+
+from aiogram.types import Update
+from bot.loader import bot, dp
+from utils.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_ENQUEUE_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+class UpdateQueue:
+    """Updates received on the webhook, handled by a fixed pool of workers.
+
+    The endpoint only checks the secret and enqueues, so Telegram gets its
+    answer at once. When the queue stays full for `enqueue_timeout`
+    seconds the endpoint answers 503 instead of accepting the update;
+    Telegram keeps unacknowledged updates and redelivers them, so load
+    spikes and restarts delay updates rather than drop them.
+    """
+
+    def __init__(self, bot, dp, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE,
+                 enqueue_timeout=UPDATE_ENQUEUE_TIMEOUT):
+        self.bot = bot
+        self.dp = dp
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.queue = asyncio.Queue(maxsize)
+        self.counters = {"accepted": 0, "rejected": 0, "handled": 0, "failed": 0}
+
+    def check_secret(self, token):
+        return hmac.compare_digest(token or "", WEBHOOK_SECRET)
+
+    async def submit(self, data):
+        """Queue a raw update; False means "full, let Telegram retry"."""
+        update = Update.model_validate(data, context={"bot": self.bot})
+        try:
+            await asyncio.wait_for(self.queue.put(update), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected"] += 1
+            logger.warning(f"Update queue full, asking Telegram to redeliver update {update.update_id}")
+            return False
+        self.counters["accepted"] += 1
+        return True
+
+    async def worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.counters["handled"] += 1
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.error(f"Error handling update {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run(self):
+        await asyncio.gather(*(self.worker() for _ in range(self.workers)))
+
+    async def drain(self, timeout):
+        """Finish the updates already accepted; called on shutdown."""
+        logger.info(f"Draining {self.queue.qsize()} queued updates...")
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.queue.qsize()} updates still queued at shutdown")
+
+    def status(self):
+        return {**self.counters, "queued": self.queue.qsize()}
+
+async def set_webhook():
+    if not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_URL (or RENDER_EXTERNAL_URL)")
+    # Pending updates are kept: whatever arrived during the restart is delivered now
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False
+    )
+
+updates = UpdateQueue(bot, dp)
@@ -1,51 +1,137 @@
+import argparse
 import asyncio
 import uvicorn
 import logging
 import os
 from bot.loader import bot, dp
+from bot.broadcast import broadcaster
+from bot.webhook import updates, set_webhook
 from web.app import app
+from utils.db import storage
+from utils.leader import leader
+from utils.config import REALTOR_SYNC_INTERVAL, LEDGER_RECONCILE_INTERVAL, BOT_MODE, WORKER_ID, LISTEN_FD, LOG_LEVEL
+from utils.log import setup_logging
+from bot.middlewares import HandlerTimer, RealtorContext
 from bot.handlers import start, realtor
 
+logger = logging.getLogger(__name__)
+
 # Register routers
 dp.include_router(start.router)
 dp.include_router(realtor.router)
+for router in (start.router, realtor.router):
+    router.message.middleware(HandlerTimer())
+    router.callback_query.middleware(HandlerTimer())
+    router.message.middleware(RealtorContext(storage))
+    router.callback_query.middleware(RealtorContext(storage))
 
 async def start_bot():
-    print("Bot starting...")
+    if BOT_MODE == "off":
+        return
+    logger.info("Bot starting...")
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        print("Webhook deleted. Starting polling...")
+        if BOT_MODE == "webhook":
+            # Updates arrive on every worker's web app; registering the URL is the only singleton part
+            await set_webhook()
+            logger.info("Webhook set.")
+            return
+        # Keep pending updates: they were sent while we were restarting
+        await bot.delete_webhook(drop_pending_updates=False)
+        logger.info("Webhook deleted. Starting polling...")
         await dp.start_polling(bot)
-        print("Bot polling finished (unexpectedly)!")
+        logger.warning("Bot polling finished (unexpectedly)!")
     except Exception as e:
-        print(f"Bot Error: {e}")
+        logger.error(f"Bot Error: {e}")
 
 async def start_web():
-    print("Web starting...")
+    logger.info("Web starting...")
     try:
-        port = int(os.getenv("PORT", 8002))
-        config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
+        if LISTEN_FD is not None:
+            # Socket bound once by workers.py and shared by every worker
+            config = uvicorn.Config(app, fd=LISTEN_FD, log_level="info")
+        else:
+            port = int(os.getenv("PORT", 8002))
+            config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
         server = uvicorn.Server(config)
         await server.serve()
-        print("Web server finished (unexpectedly)!")
+        logger.warning("Web server finished (unexpectedly)!")
+    except Exception as e:
+        logger.error(f"Web Error: {e}")
+
+async def start_reconciler():
+    # Picks up balances and realtors edited by hand in the sheet
+    while True:
+        await asyncio.sleep(REALTOR_SYNC_INTERVAL)
+        try:
+            await storage.reconcile_realtors()
+        except Exception as e:
+            logger.error(f"Reconcile Error: {e}")
+
+async def start_ledger_check():
+    # Snapshots ledger balances and reports drift from the stored ones (logged, and in /metrics)
+    while True:
+        await asyncio.sleep(LEDGER_RECONCILE_INTERVAL)
+        try:
+            await storage.reconcile_ledger()
+        except Exception as e:
+            logger.error(f"Ledger check Error: {e}")
+
+async def start_broadcaster():
+    logger.info("Broadcaster starting...")
+    try:
+        await broadcaster.run()
     except Exception as e:
-        print(f"Web Error: {e}")
+        logger.error(f"Broadcaster Error: {e}")
+
+async def start_update_handlers():
+    logger.info("Update handlers starting...")
+    try:
+        await updates.run()
+    except Exception as e:
+        logger.error(f"Update handler Error: {e}")
+
+async def start_singletons():
+    # Polling, webhook registration, reconciliation, ledger checks and broadcast dispatch run on one worker only
+    while True:
+        await leader.acquire()
+        logger.info(f"Worker {WORKER_ID} elected leader")
+        jobs = [
+            asyncio.create_task(start_bot()),
+            asyncio.create_task(start_reconciler()),
+            asyncio.create_task(start_ledger_check()),
+            asyncio.create_task(start_broadcaster())
+        ]
+        try:
+            await leader.hold()
+        finally:
+            for job in jobs:
+                job.cancel()
+        logger.warning(f"Worker {WORKER_ID} lost leadership, stopping singleton jobs")
 
 async def main():
-    logging.basicConfig(level=logging.INFO)
-    print("Main started")
+    logger.info("Main started")
     
     tasks = [
-        asyncio.create_task(start_bot()),
-        asyncio.create_task(start_web())
+        # Storage comes up alongside the web server; calls made before it is ready wait for it
+        asyncio.create_task(storage.start()),
+        asyncio.create_task(start_web()),
+        asyncio.create_task(start_singletons())
     ]
+    if BOT_MODE == "webhook":
+        tasks.append(asyncio.create_task(start_update_handlers()))
     
-    print("Gathering tasks...")
+    logger.info("Gathering tasks...")
     await asyncio.gather(*tasks)
-    print("Main finished")
+    logger.info("Main finished")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="DEBUG, INFO, WARNING or ERROR (default: LOG_LEVEL)")
+    setup_logging(parser.parse_args().log_level)
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        logging.info("Bot stopped!")
+        logger.info("Bot stopped!")
+    finally:
+        leader.release()
+        storage.shutdown()
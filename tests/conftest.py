@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+# Read by utils.config on first import: the web app can be imported without a bot or files in the tree
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("FSM_STORAGE", "memory")
+
+from fakes import FakeSpreadsheet
+from utils.backends.memory import MemoryStorage
+from utils.backends.sheets import GoogleSheet
+from utils.backends.sqlite import SQLiteStorage
+
+@pytest.fixture(params=["memory", "sqlite", "sheets"])
+def backend(request, tmp_path):
+    """A fresh storage backend with no real Google Sheet behind it."""
+    if request.param == "memory":
+        db = MemoryStorage()
+    elif request.param == "sqlite":
+        db = SQLiteStorage(str(tmp_path / "data.db"))
+    else:
+        # The Sheets backend itself (indexes, write buffer, locks) against sheets held in memory
+        db = GoogleSheet(FakeSpreadsheet(), snapshot_path=None, spill_path=None)
+        # Flush often, so writers held back by WRITE_MAX_PENDING are not kept waiting for seconds
+        db.buffer.interval = 0.05
+    yield db
+    db.close()
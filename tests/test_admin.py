@@ -0,0 +1,40 @@
+"""Every /admin endpoint wants the admin login before it does anything."""
+import base64
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import ROOT
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.chdir(ROOT)  # the app mounts web/static relative to the working directory
+    import web.app
+    monkeypatch.setattr(web.app, "ADMIN_SECRET", "s3cret")
+    monkeypatch.setattr(web.app, "ADMIN_IDS", [700000001])
+    return TestClient(web.app.app)
+
+def admin_routes():
+    import web.app
+    for route in web.app.app.routes:
+        if route.path == "/admin" or route.path.startswith("/admin/"):
+            for method in route.methods - {"HEAD"}:
+                yield method, re.sub(r"\{[^}]+\}", "1", route.path)
+
+def basic(user, password):
+    return {"Authorization": "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()}
+
+def test_every_admin_route_needs_a_login(client):
+    routes = list(admin_routes())
+    assert ("GET", "/admin/api/realtors") in routes and ("POST", "/admin/refund") in routes
+    for method, path in routes:
+        for headers in ({}, basic("700000001", "wrong"), basic("700000002", "s3cret"),
+                        {"Authorization": "Basic bm90IGJhc2U2NA=="}, {"Authorization": "Basic ÿÿÿ".encode("latin-1")}):
+            response = client.request(method, path, headers=headers)
+            assert response.status_code == 401, (method, path, headers)
+            assert response.headers["WWW-Authenticate"] == 'Basic realm="admin"'
+
+def test_admin_login_is_let_through(client):
+    response = client.get("/admin/updates", headers=basic("700000001", "s3cret"))
+    assert response.status_code == 200
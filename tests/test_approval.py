@@ -0,0 +1,27 @@
+"""Approving a request is a one-time New -> Approved transition, however often it is submitted."""
+from concurrent.futures import ThreadPoolExecutor
+
+def add(db, n):
+    return [db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": str(i), "phone": "+99891"})
+            for i in range(n)]
+
+def test_concurrent_approvals_change_each_request_once(backend):
+    req_ids = add(backend, 20)
+    # Single approvals and overlapping bulk approvals racing each other
+    calls = [[req_id] for req_id in req_ids] * 5 + [req_ids[:10], req_ids[5:], req_ids] * 5
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(lambda ids: backend.set_request_statuses(ids, "Approved", only_from="New"), calls))
+    changed = [r["id"] for result in results for r in result]
+    assert sorted(changed) == sorted(req_ids)
+    assert all(r["status"] == "Approved" for result in results for r in result)
+
+def test_only_new_requests_are_approved(backend):
+    approved, rejected, new = add(backend, 3)
+    backend.set_request_statuses([approved], "Approved", only_from="New")
+    backend.set_request_statuses([rejected], "Rejected")
+
+    changed = backend.set_request_statuses([approved, rejected, new, "404"], "Approved", only_from="New")
+    assert [r["id"] for r in changed] == [new]
+    assert backend.get_request(rejected)[6] == "Rejected"
+    # Without only_from any other status moves
+    assert [r["id"] for r in backend.set_request_statuses([rejected], "Approved")] == [rejected]
@@ -0,0 +1,84 @@
+"""Generated ids: unique across threads and workers, and ever-growing even when the clock misbehaves."""
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.backends.base as base
+from utils.backends.base import IdGenerator, ID_EPOCH_MS
+
+def parts(id_):
+    value = int(id_)
+    return value >> 22, (value >> 12) & 0x3FF, value & 0xFFF
+
+class FrozenClock:
+    """Stands in for time.time(): stays put until moved."""
+
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms / 1000
+
+def test_threads_get_unique_growing_ids():
+    gen = IdGenerator(7)
+
+    def take(_):
+        return [int(gen.next()) for _ in range(20000)]
+
+    with ThreadPoolExecutor(16) as pool:
+        batches = list(pool.map(take, range(16)))
+    ids = [i for batch in batches for i in batch]
+    assert len(set(ids)) == len(ids)
+    for batch in batches:
+        assert batch == sorted(batch) and len(set(batch)) == len(batch)
+    assert {parts(i)[1] for i in ids} == {7}
+
+def test_workers_never_collide():
+    # Same clock, same millisecond: only the worker bits tell them apart
+    gens = [IdGenerator(w) for w in range(4)]
+    ids = [g.next() for _ in range(1000) for g in gens]
+    assert len(set(ids)) == len(ids)
+
+def test_sequence_rollover_runs_ahead(monkeypatch):
+    clock = FrozenClock(ID_EPOCH_MS + 1_000_000)
+    monkeypatch.setattr(base.time, "time", clock)
+    gen = IdGenerator(1)
+
+    ids = [int(gen.next()) for _ in range(3 * 4096 + 10)]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    # 4096 ids per millisecond, then the generator borrows the next one
+    assert [parts(i)[0] - 1_000_000 for i in ids[::4096]] == [0, 1, 2, 3]
+    assert parts(ids[4095]) == (1_000_000, 1, 4095)
+    assert parts(ids[4096]) == (1_000_001, 1, 0)
+
+    # Once the real clock passes the borrowed milliseconds, ids follow it again
+    clock.ms += 10
+    assert parts(gen.next()) == (1_000_010, 1, 0)
+
+def test_clock_going_backwards_never_repeats(monkeypatch):
+    clock = FrozenClock(ID_EPOCH_MS + 5_000_000)
+    monkeypatch.setattr(base.time, "time", clock)
+    gen = IdGenerator(3)
+
+    before = [int(gen.next()) for _ in range(100)]
+    clock.ms -= 2000  # NTP steps the clock back two seconds
+    after = [int(gen.next()) for _ in range(5000)]
+    ids = before + after
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert all(parts(i)[0] >= 5_000_000 for i in after)
+
+def test_concurrent_inserts_get_unique_ids(backend):
+    backend.add_realtor(700000001, "Rieltor", "Chilonzor", "sotib olish", "+998901234567")
+
+    def insert(n):
+        req_id = backend.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": str(n),
+                                      "phone": "+99891"})
+        backend.add_transaction(700000001, req_id, 5000)
+        return req_id
+
+    with ThreadPoolExecutor(16) as pool:
+        req_ids = list(pool.map(insert, range(2000)))
+    assert len(set(req_ids)) == 2000
+    page, _ = backend.list_requests(limit=5000)
+    assert sorted(r["id"] for r in page) == sorted(req_ids)
+    transactions, _ = backend.list_transactions(limit=5000)
+    assert len(transactions) == 2000
+    assert len({t["id"] for t in transactions}) == 2000
@@ -0,0 +1,142 @@
+"""Crash safety of the memory backend's journal: a SIGKILLed writer leaves a prefix that replays cleanly."""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils.backends.journal import Journal
+from utils.backends.ledger import Ledger
+from utils.backends.memory import MemoryStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRICE = 5000
+TOP_UP = 10 ** 12
+
+# Requests numbered by price, each bought right after it is added, until the process is killed
+WRITER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from utils.backends.memory import MemoryStorage
+db = MemoryStorage(sys.argv[2])
+db.add_realtor(700000001, "Rieltor", "Chilonzor", "sotib olish", "+998901234567")
+db.update_balance(700000001, %d)
+print("ready", flush=True)
+i = 0
+while True:
+    req_id = db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": str(i), "phone": "+99891"})
+    db.purchase_contact(700000001, req_id, %d)
+    i += 1
+""" % (TOP_UP, PRICE)
+
+def kill_writer(path, after, compact_every):
+    env = {**os.environ, "JOURNAL_COMPACT_EVERY": str(compact_every), "JOURNAL_FSYNC_INTERVAL": "0.01"}
+    proc = subprocess.Popen([sys.executable, "-c", WRITER, ROOT, path], env=env, stdout=subprocess.PIPE)
+    try:
+        # Skip whatever the imports print before the writer starts
+        assert any(line.strip() == b"ready" for line in proc.stdout)
+        time.sleep(after)
+    finally:
+        proc.send_signal(signal.SIGKILL)
+        proc.wait()
+        proc.stdout.close()
+
+def assert_consistent(db, unpaid=0):
+    requests = db.data["requests"]
+    prices = sorted(int(r["price"]) for r in requests)
+    # Every write up to some point survived, nothing after it, and nothing twice
+    assert prices == list(range(len(prices)))
+    assert len({r["id"] for r in requests}) == len(requests)
+    bought = len(db.data["transactions"])
+    # The writer may have died between adding a request and buying it
+    assert len(requests) - unpaid - bought in (0, 1)
+    assert int(db.get_realtor(700000001)[5]) == TOP_UP - PRICE * bought
+    report = db.reconcile_ledger()
+    assert report["drift"] == []
+    assert report["unbalanced_entries"] == []
+    return len(requests)
+
+@pytest.mark.parametrize("compact_every", [100000, 37])
+@pytest.mark.parametrize("after", [0.05, 0.3, 0.8])
+def test_killed_writer_replays_a_prefix(tmp_path, compact_every, after):
+    # compact_every=37 compacts every few dozen writes, so kills also land mid-compaction
+    path = str(tmp_path / "mock_db.json")
+    kill_writer(path, after, compact_every)
+
+    db = MemoryStorage(path)
+    written = assert_consistent(db)
+    assert written > 0
+
+    # The reopened journal carries on where the survivors end
+    db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": str(written), "phone": "+99891"})
+    db.close()
+    assert assert_consistent(MemoryStorage(path), unpaid=1) == written + 1
+
+def test_torn_last_line_is_cut_off(tmp_path):
+    path = str(tmp_path / "db.json")
+    journal = Journal(path, compact_every=1000)
+    journal.load()
+    for i in range(5):
+        journal.append({"op": "note", "n": i})
+    journal.close()
+    with open(journal.log_path, "ab") as f:
+        f.write(b'{"op": "note", "n": 5, "se')
+    good_size = os.path.getsize(journal.log_path) - len(b'{"op": "note", "n": 5, "se')
+
+    journal = Journal(path, compact_every=1000)
+    _, entries = journal.load()
+    assert [e["n"] for e in entries] == [0, 1, 2, 3, 4]
+    assert [e["seq"] for e in entries] == [1, 2, 3, 4, 5]
+    assert os.path.getsize(journal.log_path) == good_size
+
+    journal.append({"op": "note", "n": 5})
+    journal.close()
+    with open(journal.log_path) as f:
+        assert [json.loads(line)["seq"] for line in f] == [1, 2, 3, 4, 5, 6]
+
+def test_crash_between_snapshot_and_truncate_does_not_replay_twice(tmp_path):
+    path = str(tmp_path / "db.json")
+    journal = Journal(path, compact_every=1000)
+    journal.load()
+    for i in range(3):
+        journal.append({"op": "note", "n": i})
+    with open(journal.log_path, "rb") as f:
+        before = f.read()
+    journal.compact({"notes": [0, 1, 2]})
+    journal.append({"op": "note", "n": 3})
+    journal.close()
+    # As if the process died after os.replace() but before the log was emptied
+    with open(journal.log_path, "rb") as f:
+        after = f.read()
+    with open(journal.log_path, "wb") as f:
+        f.write(before + after)
+
+    snapshot, entries = Journal(path).load()
+    assert snapshot == {"notes": [0, 1, 2]}
+    assert [e["n"] for e in entries] == [3]
+
+def test_restart_resumes_ledger_from_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.json")
+    db = MemoryStorage(path)
+    db.journal.compact_every = 7
+    db.add_realtor(700000001, "Rieltor", "Chilonzor", "sotib olish", "+998901234567")
+    db.update_balance(700000001, TOP_UP)
+    req_ids = [db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": str(i),
+                               "phone": "+99891"}) for i in range(10)]
+    for req_id in req_ids:
+        db.purchase_contact(700000001, req_id, PRICE)
+    assert db.refund_purchase(700000001, req_ids[0]) == "ok"
+    db.close()
+
+    restored, real_restore = [], Ledger.restore
+    monkeypatch.setattr(Ledger, "restore", lambda self, state: restored.append(state["rows"]) or real_restore(self, state))
+    reopened = MemoryStorage(path)
+    # The compacted snapshot's ledger state was picked up, and the rows logged after it replayed on top
+    assert restored and 0 < restored[0] < len(reopened.data["ledger"])
+    assert reopened.ledger.rows == len(reopened.data["ledger"])
+    assert reopened.refund_purchase(700000001, req_ids[0]) == "already_refunded"
+    assert reopened.reconcile_ledger()["drift"] == []
+    assert reopened.get_stats()["total_revenue"] == PRICE * 9
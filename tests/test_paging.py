@@ -0,0 +1,65 @@
+"""Keyset pages walked to the end: every matching row once, in order, whatever the page size."""
+import pytest
+
+from utils.matching import region_key
+
+REGIONS = ["Chilonzor", "Yunusobod", "Mirzo Ulug'bek"]
+
+def walk(fetch, limit):
+    rows, after = [], None
+    while True:
+        page, after = fetch(after, limit)
+        assert len(page) <= limit
+        rows.extend(page)
+        if after is None:
+            return rows
+
+@pytest.fixture
+def filled(backend):
+    for i in range(40):
+        backend.add_realtor(700000100 + i * 7 % 40, f"Rieltor {i}", REGIONS[i % 3], "sotib olish", "+998901234567")
+        backend.update_balance(700000100 + i * 7 % 40, 1_000_000 + 5000 * i)
+    req_ids = [backend.add_request({"type": "sotib olish", "region": REGIONS[i % 3], "rooms": "2", "price": str(i),
+                                    "phone": "+99891"}) for i in range(60)]
+    for i, req_id in enumerate(req_ids[::2]):
+        backend.purchase_contact(700000100 + i % 4, req_id, 5000)
+    for req_id in req_ids[::5]:
+        backend.update_request_status(req_id, "Approved")
+    return backend
+
+def test_region_filter_matches_any_spelling(backend):
+    spellings = {"Chilonzor": ["Chilonzor", "chilonzor", " CHILONZOR "],
+                 "Mirzo Ulug'bek": ["Mirzo Ulug‘bek", "mirzo ulugbek", "Mirzo-Ulugbek"]}
+    ids = {region: [backend.add_request({"type": "sotib olish", "region": spelling, "rooms": "2", "price": "1",
+                                         "phone": "+99891"}) for spelling in variants]
+           for region, variants in spellings.items()}
+    for region, variants in spellings.items():
+        for spelling in variants:
+            page, _ = backend.list_requests(region=spelling, limit=100)
+            assert sorted(r["id"] for r in page) == sorted(ids[region])
+
+@pytest.mark.parametrize("limit", [1, 7, 100])
+def test_request_pages_cover_the_table(filled, limit):
+    everything, _ = filled.list_requests(limit=1000)
+    assert [r["id"] for r in everything] == sorted((r["id"] for r in everything), reverse=True)
+    assert [r["id"] for r in walk(lambda after, n: filled.list_requests(after=after, limit=n), limit)] == \
+        [r["id"] for r in everything]
+
+    oldest_first = walk(lambda after, n: filled.list_requests(after=after, limit=n, region="Yunusobod",
+                                                              newest_first=False), limit)
+    assert [r["id"] for r in oldest_first] == sorted(r["id"] for r in everything if r["region"] == "Yunusobod")
+    approved = walk(lambda after, n: filled.list_requests("Approved", after=after, limit=n), limit)
+    assert len(approved) == 12 and all(r["status"] == "Approved" for r in approved)
+
+@pytest.mark.parametrize("limit", [1, 7, 100])
+def test_realtor_and_transaction_pages_cover_the_table(filled, limit):
+    realtors = walk(lambda after, n: filled.list_realtors(after=after, limit=n), limit)
+    assert [r["telegram_id"] for r in realtors] == sorted(str(700000100 + i) for i in range(40))
+    rich = walk(lambda after, n: filled.list_realtors("Chilonzor", min_balance=1_100_000, after=after, limit=n), limit)
+    assert rich and all(region_key(r["region"]) == region_key("Chilonzor") and int(r["balance"]) >= 1_100_000 for r in rich)
+
+    transactions = walk(lambda after, n: filled.list_transactions(after=after, limit=n), limit)
+    assert len(transactions) == 30
+    assert [(t["date"], t["id"]) for t in transactions] == sorted((t["date"], t["id"]) for t in transactions)
+    mine = walk(lambda after, n: filled.list_transactions("700000101", after=after, limit=n), limit)
+    assert len(mine) == 8 and all(str(t["realtor_id"]) == "700000101" for t in mine)
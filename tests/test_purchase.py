@@ -0,0 +1,112 @@
+"""Hundreds of concurrent contact purchases: each contact is charged once and balances match the ledger."""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from fakes import FakeSpreadsheet
+from utils.backends.sheets import GoogleSheet
+
+PRICE = 5000
+TOP_UP = 1_000_000
+
+def seed(db, realtors, requests):
+    for telegram_id in realtors:
+        assert db.add_realtor(telegram_id, f"Rieltor {telegram_id}", "Chilonzor", "sotib olish", "+998901234567")
+    return [db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": "500",
+                            "phone": f"+99891{i:07d}"}) for i in range(requests)]
+
+def tap_all(db, taps, workers=32):
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda tap: db.purchase_contact(*tap, PRICE), taps))
+
+def balance(db, telegram_id):
+    return int(db.get_realtor(telegram_id)[5])
+
+def test_concurrent_taps_charge_each_contact_once(backend):
+    realtors = ["700000001", "700000002", "700000003", "700000004"]
+    req_ids = seed(backend, realtors, 25)
+    for telegram_id in realtors:
+        assert backend.update_balance(telegram_id, TOP_UP)
+
+    # Every realtor taps every request four times: 400 callbacks, 100 distinct purchases
+    taps = [pair for pair in product(realtors, req_ids) for _ in range(4)]
+    results = tap_all(backend, taps)
+
+    statuses = [status for status, _ in results]
+    assert statuses.count("ok") == len(realtors) * len(req_ids)
+    assert statuses.count("duplicate") == len(taps) - len(realtors) * len(req_ids)
+    # A repeat tap still gets the phone, without another charge
+    assert all(phone for _, phone in results)
+    for telegram_id in realtors:
+        assert balance(backend, telegram_id) == TOP_UP - PRICE * len(req_ids)
+
+    report = backend.reconcile_ledger()
+    assert report["checked"] == len(realtors)
+    assert report["drift"] == []
+    assert report["unbalanced_entries"] == []
+
+def test_double_tap_charges_once(backend):
+    (req_id,) = seed(backend, ["700000005"], 1)
+    assert backend.update_balance("700000005", TOP_UP)
+    phone = backend.get_request(req_id)[5]
+
+    assert backend.purchase_contact("700000005", req_id, PRICE) == ("ok", phone)
+    assert backend.purchase_contact("700000005", req_id, PRICE) == ("duplicate", phone)
+    # The same tap delivered many times at once
+    results = tap_all(backend, [("700000005", req_id)] * 50)
+    assert set(results) == {("duplicate", phone)}
+
+    assert balance(backend, "700000005") == TOP_UP - PRICE
+    transactions, _ = backend.list_transactions(realtor_id="700000005")
+    assert [t["request_id"] for t in transactions] == [req_id]
+
+def test_sheet_gets_each_purchase_once():
+    sheet = FakeSpreadsheet()
+    db = GoogleSheet(sheet, snapshot_path=None, spill_path=None)
+    try:
+        req_ids = seed(db, ["700000006", "700000007"], 10)
+        for telegram_id in ("700000006", "700000007"):
+            assert db.update_balance(telegram_id, TOP_UP)
+        taps = [pair for pair in product(["700000006", "700000007"], req_ids) for _ in range(5)]
+        # Flushing while the taps run: a purchase's debit and transaction row must land together
+        with ThreadPoolExecutor(1) as flusher:
+            flushes = flusher.submit(lambda: [db.buffer.flush() for _ in range(20)])
+            tap_all(db, taps)
+            flushes.result()
+        db.buffer.flush()
+    finally:
+        db.close()
+
+    rows = sheet.tabs["Transactions"].rows[1:]
+    assert sorted((r[1], r[2]) for r in rows) == sorted(set(taps))
+    balances = {r[0]: int(r[5]) for r in sheet.tabs["Realtors"].rows[1:]}
+    assert balances == {"700000006": TOP_UP - PRICE * 10, "700000007": TOP_UP - PRICE * 10}
+
+def test_concurrent_taps_never_overdraw(backend):
+    req_ids = seed(backend, ["700000009"], 30)
+    assert backend.update_balance("700000009", PRICE * 3)
+
+    taps = [("700000009", req_id) for req_id in req_ids for _ in range(5)]
+    results = tap_all(backend, taps)
+
+    paid = [req_id for (_, req_id), (status, _) in zip(taps, results) if status == "ok"]
+    assert len(paid) == len(set(paid)) == 3
+    assert {status for status, _ in results} <= {"ok", "duplicate", "insufficient"}
+    assert balance(backend, "700000009") == 0
+    assert backend.reconcile_ledger()["drift"] == []
+
+def test_refund_after_concurrent_taps(backend):
+    req_ids = seed(backend, ["700000010"], 5)
+    assert backend.update_balance("700000010", TOP_UP)
+    tap_all(backend, [("700000010", req_id) for req_id in req_ids for _ in range(10)])
+
+    with ThreadPoolExecutor(8) as pool:
+        refunds = list(pool.map(lambda _: backend.refund_purchase("700000010", req_ids[0]), range(8)))
+
+    assert refunds.count("ok") == 1
+    assert refunds.count("already_refunded") == 7
+    assert balance(backend, "700000010") == TOP_UP - PRICE * (len(req_ids) - 1)
+    assert backend.reconcile_ledger()["drift"] == []
+    # The refunded contact no longer counts as revenue
+    stats = backend.get_stats()
+    assert stats["total_revenue"] == PRICE * (len(req_ids) - 1)
+    assert stats["total_refunds"] == 1
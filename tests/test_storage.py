@@ -0,0 +1,51 @@
+"""AsyncStorage builds its backend once, outside the timeout of the calls waiting for it."""
+import asyncio
+import time
+
+from utils.backends.memory import MemoryStorage
+from utils.db import AsyncStorage
+
+def test_slow_build_is_shared_and_untimed():
+    builds = []
+
+    def factory():
+        builds.append(1)
+        time.sleep(0.3)
+        return MemoryStorage()
+
+    storage = AsyncStorage(factory, timeout=0.1)
+
+    async def main():
+        return await asyncio.gather(*(storage.get_all_realtors() for _ in range(8)))
+
+    try:
+        assert asyncio.run(main()) == [[]] * 8
+        assert len(builds) == 1
+    finally:
+        storage.shutdown()
+
+def test_failed_build_is_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("database not reachable")
+        return MemoryStorage()
+
+    storage = AsyncStorage(factory)
+
+    async def main():
+        try:
+            await storage.get_all_realtors()
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("the first build should fail")
+        return await storage.get_all_realtors()
+
+    try:
+        assert asyncio.run(main()) == []
+        assert len(attempts) == 2
+    finally:
+        storage.shutdown()
@@ -0,0 +1,68 @@
+"""Writes the sheet could not take before shutdown are sent by the next process, not dropped."""
+from fakes import FakeSpreadsheet
+from utils.backends.sheets import GoogleSheet, WriteBuffer
+
+PRICE = 5000
+
+def open_circuit(db):
+    for _ in range(db.client.breaker.threshold):
+        db.client.breaker.failure()
+    assert not db.client.available()
+
+def test_buffer_closed_while_circuit_is_open_spills_its_queue(tmp_path):
+    spill = str(tmp_path / "unsent.json")
+    sheet = FakeSpreadsheet()
+    ws = sheet.add_worksheet("Requests")
+    ws.append_rows([["id", "status"], ["1", "New"]])
+    up = [False]
+
+    buffer = WriteBuffer(lambda name: sheet.worksheet(name), {"Requests": lambda key, ws, refresh=False: 2},
+                         available=lambda: up[0], spill_path=spill)
+    buffer.append("Requests", ["2", "New"])
+    buffer.update("Requests", "1", 2, "Approved")
+    buffer.close()
+    assert buffer.pending == 0
+    assert ws.rows == [["id", "status"], ["1", "New"]]
+
+    up[0] = True
+    restarted = WriteBuffer(lambda name: sheet.worksheet(name), {"Requests": lambda key, ws, refresh=False: 2},
+                            available=lambda: up[0], spill_path=spill)
+    restarted.start()
+    assert restarted.queued("Requests") == ([["2", "New"]], {("1", 2): "Approved"})
+    restarted.close()
+    assert ws.rows == [["id", "status"], ["1", "Approved"], ["2", "New"]]
+    # Sent once: a third start has nothing left to replay
+    again = WriteBuffer(lambda name: sheet.worksheet(name), {}, spill_path=spill)
+    again.replay()
+    assert again.pending == 0
+
+def test_restart_after_outage_keeps_purchases_and_balances(tmp_path):
+    spill = str(tmp_path / "unsent.json")
+    sheet = FakeSpreadsheet()
+    db = GoogleSheet(sheet, snapshot_path=None, spill_path=spill)
+    try:
+        assert db.add_realtor("700000001", "Rieltor", "Chilonzor", "sotib olish", "+998901234567")
+        req_id = db.add_request({"type": "sotib olish", "region": "Chilonzor", "rooms": "2", "price": "500",
+                                 "phone": "+998911234567"})
+        assert db.update_balance("700000001", 100000)
+        db.buffer.flush()
+
+        open_circuit(db)
+        assert db.purchase_contact("700000001", req_id, PRICE)[0] == "ok"
+        assert db.update_request_status(req_id, "Approved")
+    finally:
+        db.close()
+    assert len(sheet.tabs["Transactions"].rows) == 1
+
+    db = GoogleSheet(sheet, snapshot_path=None, spill_path=spill)
+    try:
+        # Served as the queued writes will leave the sheet, before they are sent
+        assert int(db.get_realtor("700000001")[5]) == 100000 - PRICE
+        assert db.get_request(req_id)[6] == "Approved"
+        assert db.purchase_contact("700000001", req_id, PRICE)[0] == "duplicate"
+        assert db.reconcile_ledger()["drift"] == []
+        db.buffer.flush()
+    finally:
+        db.close()
+    assert [r[2] for r in sheet.tabs["Transactions"].rows[1:]] == [req_id]
+    assert sheet.tabs["Realtors"].rows[1][5] == str(100000 - PRICE)
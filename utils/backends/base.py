@@ -0,0 +1,435 @@
+from utils.config import WORKER_ID
+from utils.matching import RoutingTable, region_key, type_key
+
+import bisect
+import threading
+import time
+
+REALTOR_HEADERS = ["telegram_id", "full_name", "region", "type", "phone", "balance", "registered_at"]
+REQUEST_HEADERS = ["id", "type", "region", "rooms", "price", "phone", "status", "created_at"]
+TRANSACTION_HEADERS = ["id", "realtor_id", "request_id", "amount", "date"]
+
+# 1-based sheet columns
+BALANCE_COL = 6
+STATUS_COL = 7
+
+# Custom epoch for ids (2024-01-01 UTC) so they stay short for callback_data
+ID_EPOCH_MS = 1704067200000
+
+class IdGenerator:
+    """Snowflake-style ids: 41 bits of milliseconds, 10 bits of worker, 12 bits of sequence.
+
+    Unique across threads and, with distinct WORKER_IDs, across processes.
+    Ids only grow, so they sort by creation time. Up to 4096 ids per
+    millisecond; past that, or if the clock steps back, the generator
+    runs ahead on its own clock rather than repeat an id.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id & 0x3FF
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.seq = 0
+
+    def next(self):
+        with self.lock:
+            now = max(int(time.time() * 1000) - ID_EPOCH_MS, self.last_ms)
+            if now == self.last_ms:
+                self.seq = (self.seq + 1) & 0xFFF
+                if self.seq == 0:
+                    now += 1
+            else:
+                self.seq = 0
+            self.last_ms = now
+            return str((now << 22) | (self.worker_id << 12) | self.seq)
+
+id_generator = IdGenerator(WORKER_ID)
+
+def new_id():
+    return id_generator.next()
+
+def realtor_as_row(record):
+    # List format the handlers expect: id, name, region, type, phone, balance, reg
+    return [str(record.get(h, "")) if h == "telegram_id" else record.get(h, "") for h in REALTOR_HEADERS]
+
+def request_as_row(record):
+    # List format: id, type, region, rooms, price, phone, status, created_at
+    return [record.get(h, "") for h in REQUEST_HEADERS]
+
+def realtor_sort_key(record):
+    return (str(record.get("telegram_id", "")),)
+
+def request_sort_key(record):
+    # Newest first; the id breaks ties between requests created in the same microsecond
+    return (str(record.get("created_at", "")), str(record.get("id", "")))
+
+def transaction_sort_key(record):
+    return (str(record.get("date", "")), str(record.get("id", "")))
+
+def balance_of(record):
+    try:
+        return int(record.get("balance") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def merge_changes(changes):
+    # One net amount per realtor, in first-seen order
+    merged = {}
+    for telegram_id, amount in changes:
+        key = str(telegram_id)
+        merged[key] = merged.get(key, 0) + int(amount)
+    return merged
+
+def realtor_matches(record, r_type=None, min_balance=None, max_balance=None, region=None):
+    if region and region_key(record.get("region")) != region_key(region):
+        return False
+    if r_type and type_key(record.get("type")) != type_key(r_type):
+        return False
+    if min_balance is not None and balance_of(record) < min_balance:
+        return False
+    return max_balance is None or balance_of(record) <= max_balance
+
+def in_range(value, since=None, until=None):
+    # since inclusive, until exclusive, compared as "YYYY-MM-DD HH:MM:SS" text
+    value = str(value or "")
+    return (not since or value >= since) and (not until or value < until)
+
+def request_matches(record, status=None, since=None, until=None, region=None):
+    # since/until are created_at bounds
+    if status and record.get("status") != status:
+        return False
+    if region and region_key(record.get("region")) != region_key(region):
+        return False
+    return in_range(record.get("created_at"), since, until)
+
+def transaction_matches(record, realtor_id=None, since=None, until=None):
+    if realtor_id and str(record.get("realtor_id")) != str(realtor_id):
+        return False
+    return in_range(record.get("date"), since, until)
+
+class KeysetIndex:
+    """Sort keys of a resident table, kept in order, so a keyset page starts at its cursor.
+
+    A page bisects to the cursor and reads on from there instead of
+    passing over every record, so walking a whole table page by page
+    (an export) reads each row once. Each key holds a value that
+    `resolve` turns into the current record (an id to look up, or the
+    record itself).
+    """
+
+    def __init__(self, sort_key):
+        self.sort_key = sort_key
+        self.lock = threading.Lock()
+        self.keys = []
+        self.values = []
+
+    def reset(self, records, value=None):
+        pairs = sorted(((tuple(self.sort_key(r)), value(r) if value else r) for r in records), key=lambda p: p[0])
+        with self.lock:
+            self.keys = [k for k, _ in pairs]
+            self.values = [v for _, v in pairs]
+
+    def add(self, record, value=None):
+        key = tuple(self.sort_key(record))
+        with self.lock:
+            # New rows sort last, so this is nearly always an append
+            i = bisect.bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.values.insert(i, record if value is None else value)
+
+    def remove(self, record, value=None):
+        key, value = tuple(self.sort_key(record)), record if value is None else value
+        with self.lock:
+            i = bisect.bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                if self.values[i] == value:
+                    del self.keys[i], self.values[i]
+                    return
+                i += 1
+
+    def page(self, match=None, after=None, limit=50, newest_first=False, resolve=None):
+        """The `limit` matching records after the `after` key, and the next key (None on the last page).
+
+        Records `resolve` maps to None are skipped.
+        """
+        page, after = [], tuple(after) if after is not None else None
+        while len(page) <= limit:
+            # A chunk at a time, so the lock is not held while records are looked up
+            with self.lock:
+                if newest_first:
+                    end = len(self.keys) if after is None else bisect.bisect_left(self.keys, after)
+                    start = max(0, end - limit - 1)
+                    chunk = self.values[start:end][::-1]
+                    if chunk:
+                        after = self.keys[start]
+                else:
+                    start = 0 if after is None else bisect.bisect_right(self.keys, after)
+                    chunk = self.values[start:start + limit + 1]
+                    if chunk:
+                        after = self.keys[start + len(chunk) - 1]
+            if not chunk:
+                break
+            for value in chunk:
+                record = resolve(value) if resolve else value
+                if record is not None and (match is None or match(record)):
+                    page.append(record)
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, list(self.sort_key(page[-1]))
+
+class RealtorIndex:
+    """Resident copy of the realtors table.
+
+    Keyed by telegram_id, with a RoutingTable (region -> deal type ->
+    ids) for matching requests to realtors. Every local write bumps a
+    generation counter, so a reload can tell which realtors changed
+    after its read began.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_id = {}
+        self.rows = {}
+        self.routes = RoutingTable()
+        # telegram_ids in order, for the admin pages
+        self.order = KeysetIndex(realtor_sort_key)
+        self.pending = {}
+        # telegram_id -> generation of its latest local write
+        self.generation = 0
+        self.written = {}
+        self.loaded_at = 0
+
+    def read_started(self):
+        """Generation to pass to load() for a read that starts now."""
+        with self.lock:
+            return self.generation
+
+    def load(self, records, first_row=2, since=None):
+        """Replace the index with `records`, read from the store.
+
+        Realtors with a write still in flight, or written after generation
+        `since` (when the read began), keep our copy: the read may have
+        missed that write even if it has finished since.
+        """
+        by_id, rows, routes = {}, {}, RoutingTable()
+        for offset, record in enumerate(records):
+            key = str(record.get("telegram_id", "")).strip()
+            if not key:
+                continue
+            by_id[key] = record
+            rows[key] = first_row + offset
+            routes.add(key, record.get("region"), record.get("type"))
+
+        with self.lock:
+            newer = [k for k, g in self.written.items() if since is not None and g > since]
+            for key in dict.fromkeys([*self.pending, *newer]):
+                record = self.by_id.get(key)
+                if record is None:
+                    continue
+                by_id[key] = record
+                routes.add(key, record.get("region"), record.get("type"))
+                if key in self.rows:
+                    rows.setdefault(key, self.rows[key])
+            self.by_id, self.rows, self.routes = by_id, rows, routes
+            self.order.reset(by_id.values(), lambda r: str(r["telegram_id"]).strip())
+            self.loaded_at = time.time()
+
+    def begin_write(self, telegram_id):
+        key = str(telegram_id)
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + 1
+            self.generation += 1
+            self.written[key] = self.generation
+
+    def end_write(self, telegram_id):
+        key = str(telegram_id)
+        with self.lock:
+            if self.pending.get(key, 0) <= 1:
+                self.pending.pop(key, None)
+            else:
+                self.pending[key] -= 1
+
+    def get(self, telegram_id):
+        return self.by_id.get(str(telegram_id))
+
+    def row(self, telegram_id):
+        return self.rows.get(str(telegram_id))
+
+    def move(self, telegram_id, row):
+        # The realtor's sheet row changed under us (rows sorted or deleted by hand)
+        with self.lock:
+            if row:
+                self.rows[str(telegram_id)] = row
+            else:
+                self.rows.pop(str(telegram_id), None)
+
+    def add(self, record, row=None):
+        key = str(record["telegram_id"])
+        with self.lock:
+            if key not in self.by_id:
+                self.order.add(record, key)
+            self.by_id[key] = record
+            if row:
+                self.rows[key] = row
+            self.routes.add(key, record.get("region"), record.get("type"))
+
+    def remove(self, telegram_id):
+        key = str(telegram_id)
+        with self.lock:
+            record = self.by_id.pop(key, None)
+            if record is not None:
+                self.order.remove(record, key)
+            self.rows.pop(key, None)
+            self.routes.remove(key)
+
+    def match(self, region, r_type):
+        with self.lock:
+            return [self.by_id[k] for k in self.routes.match(region, r_type)]
+
+    def all(self):
+        with self.lock:
+            return list(self.by_id.values())
+
+    def page(self, region=None, r_type=None, min_balance=None, max_balance=None, after=None, limit=50):
+        return self.order.page(lambda r: realtor_matches(r, r_type, min_balance, max_balance, region),
+                               after, limit, resolve=self.by_id.get)
+
+class StorageBackend:
+    """Interface shared by every storage engine.
+
+    Rows come back in the list formats the handlers already index into
+    (see realtor_as_row / request_as_row); collections come back as
+    lists of dicts keyed by the sheet headers.
+    """
+
+    name = "base"
+
+    def add_realtor(self, telegram_id, full_name, region, r_type, phone):
+        raise NotImplementedError
+
+    def get_realtor(self, telegram_id):
+        raise NotImplementedError
+
+    def get_realtors_by_filter(self, region, r_type):
+        raise NotImplementedError
+
+    def get_all_realtors(self):
+        raise NotImplementedError
+
+    def list_realtors(self, region=None, r_type=None, min_balance=None, max_balance=None, after=None, limit=50):
+        """One page of realtors ordered by telegram_id, for the admin API.
+
+        `after` is the key returned with the previous page. Returns
+        (records, next key or None).
+        """
+        return self.realtors.page(region, r_type, min_balance, max_balance, after, limit)
+
+    def update_balance(self, telegram_id, amount_change):
+        raise NotImplementedError
+
+    def update_balances(self, changes):
+        """Apply many (telegram_id, amount_change) pairs as one batch.
+
+        Returns {telegram_id: new balance} for the realtors that exist;
+        unknown ids are skipped.
+        """
+        balances = {}
+        for key, amount in merge_changes(changes).items():
+            if self.update_balance(key, amount):
+                balances[key] = balance_of(dict(zip(REALTOR_HEADERS, self.get_realtor(key))))
+        return balances
+
+    def add_request(self, request_data):
+        raise NotImplementedError
+
+    def get_request(self, req_id):
+        raise NotImplementedError
+
+    def get_pending_requests(self):
+        raise NotImplementedError
+
+    def list_requests(self, status=None, since=None, until=None, after=None, limit=50, region=None, newest_first=True):
+        """One page of requests, newest first unless newest_first=False; like list_realtors().
+
+        `since` and `until` bound created_at (inclusive and exclusive),
+        e.g. "2024-05-01".
+        """
+        raise NotImplementedError
+
+    def update_request_status(self, req_id, status):
+        raise NotImplementedError
+
+    def set_request_statuses(self, req_ids, status, only_from=None):
+        """Move many requests to `status` as one batch.
+
+        Returns the requests (dicts) whose status changed; unknown ids
+        and requests already in `status` are left out, and so with
+        `only_from` are requests not currently in that status. Approving
+        only from "New" means approving twice does not broadcast twice.
+        """
+        changed = []
+        for req_id in dict.fromkeys(str(i) for i in req_ids):
+            row = self.get_request(req_id)
+            if (row and row[6] != status and (only_from is None or row[6] == only_from)
+                    and self.update_request_status(req_id, status)):
+                changed.append({**dict(zip(REQUEST_HEADERS, row)), "status": status})
+        return changed
+
+    def update_request_details(self, req_id, region, price, rooms):
+        raise NotImplementedError
+
+    def add_transaction(self, realtor_id, request_id, amount):
+        raise NotImplementedError
+
+    def list_transactions(self, realtor_id=None, since=None, until=None, after=None, limit=50):
+        """One page of transactions, oldest first by date; like list_requests()."""
+        raise NotImplementedError
+
+    def purchase_contact(self, realtor_id, request_id, price):
+        """Charge a realtor for a request's contact exactly once.
+
+        Returns (status, phone) where status is one of "ok", "duplicate",
+        "not_registered", "not_found", "insufficient" or "error". The
+        phone is only returned once the debit and transaction are both
+        stored.
+        """
+        raise NotImplementedError
+
+    def refund_purchase(self, realtor_id, request_id):
+        """Credit a realtor back what a contact cost them, at most once.
+
+        Returns "ok", "not_found" (no such purchase), "already_refunded"
+        or "error".
+        """
+        raise NotImplementedError
+
+    def get_ledger(self, telegram_id):
+        """Stored and ledger balance of a realtor with their latest ledger rows; None if not registered."""
+        raise NotImplementedError
+
+    def reconcile_ledger(self):
+        """Snapshot ledger balances and report where stored balances drift from them (see ledger.drift_report)."""
+        raise NotImplementedError
+
+    def get_stats(self):
+        """Dashboard header numbers, served from the incremental StatsEngine in self.stats."""
+        return self.stats.summary()
+
+    def get_stats_report(self, days=30):
+        return self.stats.report(days)
+
+    def cache_stats(self):
+        """Hit/miss counters of the backend's read cache, if it has one."""
+        return {}
+
+    def sheets_health(self):
+        """Connection state of the Google Sheet behind this backend, or None if there is none."""
+        return None
+
+    def reconcile_realtors(self):
+        """Pick up changes made outside this process; a no-op by default."""
+        return True
+
+    def close(self):
+        """Flush anything buffered; called before the process exits."""
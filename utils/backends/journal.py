@@ -0,0 +1,114 @@
+from utils.config import JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_EVERY
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Journal:
+    """Append-only mutation log next to a JSON snapshot.
+
+    Every change is one JSON line carrying a sequence number, so a write
+    costs the same however large the dataset is. Lines are flushed to the
+    OS immediately and fsynced in batches every `fsync_interval` seconds.
+    After `compact_every` entries the caller writes a fresh snapshot
+    (atomically, via rename) and the log starts over. On load, entries
+    already covered by the snapshot's `_seq` are skipped and a torn last
+    line from a crash mid-write is cut off.
+    """
+
+    def __init__(self, path, fsync_interval=JOURNAL_FSYNC_INTERVAL, compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.log_path = path + ".journal"
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.entries = 0
+        self.file = None
+        self.dirty = False
+        self.thread = None
+        self.stopped = False
+
+    def load(self):
+        """Return (snapshot or None, entries to replay) and open the log for appending."""
+        snapshot = None
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        base_seq = snapshot.pop("_seq", 0) if snapshot else 0
+
+        entries, good_offset = [], 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Journal {self.log_path}: dropping torn entry at byte {good_offset}")
+                        break
+                    good_offset += len(line)
+                    if entry.get("seq", 0) > base_seq:
+                        entries.append(entry)
+            with open(self.log_path, "r+b") as f:
+                f.truncate(good_offset)
+
+        self.seq = max([base_seq] + [e["seq"] for e in entries])
+        self.entries = len(entries)
+        self.file = open(self.log_path, "a")
+        return snapshot, entries
+
+    def start(self):
+        if self.thread: return
+        self.thread = threading.Thread(target=self.run, name="journal-sync", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, entry):
+        """Log one entry; returns True once the log is due for compaction."""
+        with self.lock:
+            self.seq += 1
+            entry["seq"] = self.seq
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            self.dirty = True
+            self.entries += 1
+            return self.entries >= self.compact_every
+
+    def sync(self):
+        with self.lock:
+            if self.dirty and self.file:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def compact(self, data):
+        """Write `data` (current up to the last appended entry) as the new snapshot."""
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({**data, "_seq": self.seq}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            # A crash before this truncate is harmless: replay skips seq <= _seq
+            self.file.close()
+            self.file = open(self.log_path, "w")
+            self.entries = 0
+            self.dirty = False
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing journal: {e}")
+
+    def close(self):
+        self.stopped = True
+        if self.file:
+            self.sync()
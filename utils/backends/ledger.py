@@ -0,0 +1,190 @@
+from utils.backends.base import new_id
+from utils.config import LEDGER_SNAPSHOT_EVERY
+from utils.metrics import LEDGER_DRIFT, LEDGER_UNBALANCED
+from collections import deque
+from datetime import datetime
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+LEDGER_HEADERS = ["entry_id", "kind", "account", "amount", "ref", "created_at"]
+
+# Counter-accounts: money paid in (or back out) by realtors, and contact sales
+CASH = "cash"
+REVENUE = "revenue"
+
+def realtor_account(telegram_id):
+    return f"realtor:{telegram_id}"
+
+def legs(kind, amount):
+    """(counter-account, amount for the realtor) of an entry; the counter-account gets the opposite amount.
+
+    Kinds: "opening" (balance found when the ledger started), "topup"
+    and "withdrawal" (admin changes), "purchase" and "refund".
+    """
+    if kind == "purchase":
+        return REVENUE, -amount
+    if kind == "refund":
+        return REVENUE, amount
+    return CASH, amount
+
+def entry(kind, telegram_id, amount, ref=""):
+    """The two rows of one double-entry posting; their amounts sum to zero."""
+    counter, realtor_amount = legs(kind, int(amount))
+    entry_id, created_at = new_id(), str(datetime.now())
+    return [
+        {"entry_id": entry_id, "kind": kind, "account": realtor_account(telegram_id),
+         "amount": realtor_amount, "ref": str(ref or ""), "created_at": created_at},
+        {"entry_id": entry_id, "kind": kind, "account": counter,
+         "amount": -realtor_amount, "ref": str(ref or ""), "created_at": created_at},
+    ]
+
+def refund_of(row):
+    """(realtor_id, request_id, amount, created_at) if `row` is a realtor's leg of a refund, else None."""
+    account, prefix = str(row["account"]), realtor_account("")
+    if row["kind"] != "refund" or not account.startswith(prefix):
+        return None
+    return account[len(prefix):], str(row["ref"]), int(row["amount"] or 0), str(row["created_at"])
+
+def resume(state, rows):
+    """A Ledger at `state` with the rest of `rows` (the whole ledger, in order) applied.
+
+    When the state does not line up with the rows (none saved, or the
+    rows were edited since) every row is replayed instead.
+    """
+    ledger = Ledger()
+    covered = state["rows"] if state else 0
+    if covered and covered <= len(rows) and str(rows[covered - 1]["entry_id"]) == str(state["through"]):
+        ledger.restore(state)
+        rows = rows[covered:]
+    ledger.apply(rows)
+    return ledger
+
+def balance_kind(amount_change):
+    return "topup" if amount_change >= 0 else "withdrawal"
+
+def drift_report(balances, unbalanced):
+    """Compare stored balances with the ledger; `balances` yields (telegram_id, stored, ledger).
+
+    Updates the drift gauges and logs a warning when anything is off.
+    """
+    drift, checked = [], 0
+    for telegram_id, stored, ledger in balances:
+        checked += 1
+        if stored != ledger:
+            drift.append({"telegram_id": str(telegram_id), "stored": stored, "ledger": ledger, "drift": stored - ledger})
+    LEDGER_DRIFT.set(len(drift))
+    LEDGER_UNBALANCED.set(len(unbalanced))
+    if drift or unbalanced:
+        logger.warning(f"Ledger drift: {len(drift)} of {checked} balances differ, {len(unbalanced)} entries do not balance")
+    return {
+        "checked": checked,
+        "drift": drift,
+        "unbalanced_entries": list(unbalanced),
+        "checked_at": str(datetime.now()),
+    }
+
+class Ledger:
+    """Per-account state of a double-entry ledger kept in memory.
+
+    The rows themselves live in the backend (journal or Ledger sheet).
+    Each account holds the balance at its last snapshot plus the rows
+    posted since; the tail is folded into a new snapshot once it reaches
+    `snapshot_every` rows, so a balance is a snapshot and a short sum.
+
+    state() captures all of it, with the count and last entry id of the
+    rows applied so far. The backends save it with their data, and on
+    restart restore() it and apply only the rows after it.
+    """
+
+    def __init__(self, snapshot_every=LEDGER_SNAPSHOT_EVERY, keep_recent=20):
+        self.snapshot_every = snapshot_every
+        self.keep_recent = keep_recent
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.tails = {}
+        self.history = {}
+        # entry_id -> sum of the legs seen so far; double entry brings it back to 0
+        self.open_entries = {}
+        # (realtor_id, request_id) -> (amount, created_at) of refunds made
+        self.refunds = {}
+        self.rows = 0
+        self.last_entry = None
+
+    def apply(self, rows):
+        with self.lock:
+            for row in rows:
+                account, amount = str(row["account"]), int(row["amount"] or 0)
+                tail = self.tails.setdefault(account, [])
+                tail.append(amount)
+                if len(tail) >= self.snapshot_every:
+                    self.fold(account)
+                self.history.setdefault(account, deque(maxlen=self.keep_recent)).append(row)
+                total = self.open_entries.get(row["entry_id"], 0) + amount
+                if total:
+                    self.open_entries[row["entry_id"]] = total
+                else:
+                    self.open_entries.pop(row["entry_id"], None)
+                refund = refund_of(row)
+                if refund:
+                    self.refunds[refund[:2]] = refund[2:]
+                self.rows += 1
+                self.last_entry = str(row["entry_id"])
+
+    def fold(self, account):
+        tail = self.tails.pop(account, [])
+        self.snapshots[account] = self.snapshots.get(account, 0) + sum(tail)
+
+    def snapshot(self):
+        """Fold every tail into its snapshot; the periodic reconciliation calls this."""
+        with self.lock:
+            for account in list(self.tails):
+                self.fold(account)
+
+    def state(self):
+        """Everything apply() has built, as JSON-ready data for restore()."""
+        with self.lock:
+            for account in list(self.tails):
+                self.fold(account)
+            return {
+                "rows": self.rows,
+                "through": self.last_entry,
+                "balances": dict(self.snapshots),
+                "open_entries": dict(self.open_entries),
+                "refunds": [[r, q, amount, at] for (r, q), (amount, at) in self.refunds.items()],
+                "recent": {account: list(rows) for account, rows in self.history.items()},
+            }
+
+    def restore(self, state):
+        """Start from a state() taken earlier; rows applied afterwards carry on from there."""
+        with self.lock:
+            self.snapshots = {account: int(balance) for account, balance in state["balances"].items()}
+            self.tails = {}
+            self.history = {account: deque(rows, maxlen=self.keep_recent) for account, rows in state["recent"].items()}
+            self.open_entries = dict(state["open_entries"])
+            self.refunds = {(str(r), str(q)): (int(amount), at) for r, q, amount, at in state["refunds"]}
+            self.rows = state["rows"]
+            self.last_entry = state["through"]
+
+    def balance(self, account):
+        with self.lock:
+            return self.snapshots.get(account, 0) + sum(self.tails.get(account, ()))
+
+    def recent(self, account):
+        """The account's last few rows, newest first."""
+        with self.lock:
+            return list(reversed(self.history.get(account, ())))
+
+    def refunded(self, realtor_id, request_id):
+        return (str(realtor_id), str(request_id)) in self.refunds
+
+    def refund_records(self):
+        """(realtor_id, request_id, amount, created_at) of every refund, for StatsEngine.rebuild()."""
+        with self.lock:
+            return [(r, q, amount, at) for (r, q), (amount, at) in self.refunds.items()]
+
+    def unbalanced(self):
+        with self.lock:
+            return list(self.open_entries)
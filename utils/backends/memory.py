@@ -0,0 +1,276 @@
+from utils.backends.base import (
+    StorageBackend, RealtorIndex, new_id, realtor_as_row, request_as_row, request_matches, request_sort_key, KeysetIndex,
+    transaction_matches, transaction_sort_key, merge_changes, balance_of
+)
+from utils.backends.journal import Journal
+from utils.backends.ledger import entry as ledger_entry, balance_kind, drift_report, realtor_account, refund_of, resume
+from utils.matching import region_key, type_key
+from utils.stats import StatsEngine
+from utils.metrics import instrument
+from datetime import datetime
+
+import threading
+
+@instrument
+class MemoryStorage(StorageBackend):
+    """Everything in process memory; used for tests and as the local mock DB.
+
+    With a `path`, changes are persisted through an append-only journal
+    next to a JSON snapshot at that path (the old mock_db.json file).
+    Every mutation is an entry passed to commit(), which applies it and
+    logs it; startup replays snapshot + journal through the same apply().
+    """
+
+    name = "memory"
+
+    def __init__(self, path=None):
+        self.lock = threading.RLock()
+        self.data = {
+            "realtors": [],
+            "requests": [],
+            "transactions": [],
+            "ledger": []
+        }
+        self.journal = Journal(path) if path else None
+        entries = []
+        if self.journal:
+            snapshot, entries = self.journal.load()
+            if snapshot:
+                self.data = snapshot
+                # Snapshots written before the ledger existed
+                self.data.setdefault("ledger", [])
+        # The index shares the dicts in self.data
+        self.realtors = RealtorIndex()
+        self.realtors.load(self.data["realtors"])
+        self.requests = {str(r["id"]): r for r in self.data["requests"]}
+        # Sort orders for the admin pages and exports
+        self.request_order = KeysetIndex(request_sort_key)
+        self.request_order.reset(self.requests.values(), lambda r: str(r["id"]))
+        self.transaction_order = KeysetIndex(transaction_sort_key)
+        self.transaction_order.reset(self.data["transactions"])
+        # (realtor_id, request_id) -> price paid
+        self.purchases = {(str(t.get("realtor_id")), str(t.get("request_id"))): int(t.get("amount") or 0)
+                          for t in self.data["transactions"]}
+        # The compacted snapshot carries the ledger's state, so only rows logged after it are replayed
+        self.ledger = resume(self.data.pop("ledger_state", None), self.data["ledger"])
+        self.stats = StatsEngine()
+        self.stats.rebuild(self.data["realtors"], self.data["requests"], self.data["transactions"],
+                           self.ledger.refund_records())
+        for entry in entries:
+            self.apply(entry)
+        if self.journal:
+            self.journal.start()
+        self.open_ledger()
+
+    def open_ledger(self):
+        # First start with a ledger: book the balances realtors already have as opening entries
+        with self.lock:
+            if self.data["ledger"]:
+                return
+            openings = [self.post_entry("opening", r["telegram_id"], balance_of(r))
+                        for r in self.realtors.all() if balance_of(r)]
+            if openings:
+                self.commit(*openings)
+
+    def apply(self, entry):
+        op = entry["op"]
+        if op == "batch":
+            for sub in entry["entries"]:
+                self.apply(sub)
+        elif op == "add_realtor":
+            record = entry["record"]
+            self.data["realtors"].append(record)
+            self.realtors.add(record)
+            self.stats.record_registration(record["region"], record["registered_at"])
+        elif op == "set_balance":
+            self.realtors.get(entry["telegram_id"])["balance"] = entry["balance"]
+        elif op == "add_request":
+            record = entry["record"]
+            self.data["requests"].append(record)
+            if str(record["id"]) not in self.requests:
+                self.requests[str(record["id"])] = record
+                self.request_order.add(record, str(record["id"]))
+            self.stats.record_request(record["id"], record["region"], record["created_at"])
+        elif op == "update_request":
+            self.requests[str(entry["id"])].update(entry["fields"])
+        elif op == "add_transaction":
+            record = entry["record"]
+            self.data["transactions"].append(record)
+            self.transaction_order.add(record)
+            self.purchases[(str(record["realtor_id"]), str(record["request_id"]))] = int(record["amount"] or 0)
+            self.stats.record_sale(record["realtor_id"], record["request_id"], record["amount"], record["date"])
+        elif op == "post":
+            self.data["ledger"].extend(entry["rows"])
+            self.ledger.apply(entry["rows"])
+            for refund in filter(None, map(refund_of, entry["rows"])):
+                self.stats.record_refund(*refund)
+
+    def commit(self, *entries):
+        # Several entries are logged as one line, so they survive a crash together or not at all
+        entry = entries[0] if len(entries) == 1 else {"op": "batch", "entries": list(entries)}
+        with self.lock:
+            self.apply(entry)
+            if self.journal and self.journal.append(entry):
+                self.journal.compact({**self.data, "ledger_state": self.ledger.state()})
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+    def add_realtor(self, telegram_id, full_name, region, r_type, phone):
+        with self.lock:
+            if self.realtors.get(telegram_id): return False
+            self.commit({"op": "add_realtor", "record": {
+                "telegram_id": str(telegram_id),
+                "full_name": full_name,
+                "region": region_key(region),
+                "type": type_key(r_type),
+                "phone": phone,
+                "balance": 0,
+                "registered_at": str(datetime.now())
+            }})
+            return True
+
+    def get_realtor(self, telegram_id):
+        r = self.realtors.get(telegram_id)
+        return realtor_as_row(r) if r else None
+
+    def get_realtors_by_filter(self, region, r_type):
+        return self.realtors.match(region, r_type)
+
+    def get_all_realtors(self):
+        return self.realtors.all()
+
+    def set_balance_entry(self, realtor, amount_change):
+        return {"op": "set_balance", "telegram_id": str(realtor["telegram_id"]),
+                "balance": int(realtor.get("balance") or 0) + amount_change}
+
+    def post_entry(self, kind, telegram_id, amount, ref=""):
+        return {"op": "post", "rows": ledger_entry(kind, telegram_id, amount, ref)}
+
+    def update_balance(self, telegram_id, amount_change):
+        with self.lock:
+            r = self.realtors.get(telegram_id)
+            if not r: return False
+            self.commit(self.set_balance_entry(r, amount_change),
+                        self.post_entry(balance_kind(amount_change), telegram_id, amount_change))
+            return True
+
+    def update_balances(self, changes):
+        with self.lock:
+            entries = []
+            for key, amount in merge_changes(changes).items():
+                r = self.realtors.get(key)
+                if r:
+                    entries += [self.set_balance_entry(r, amount), self.post_entry(balance_kind(amount), key, amount)]
+            if entries:
+                self.commit(*entries)
+            return {e["telegram_id"]: e["balance"] for e in entries if e["op"] == "set_balance"}
+
+    def add_request(self, request_data):
+        with self.lock:
+            req_id = new_id()
+            self.commit({"op": "add_request", "record": {
+                "id": req_id,
+                "type": request_data.get('type'),
+                "region": request_data.get('region'),
+                "rooms": request_data.get('rooms'),
+                "price": request_data.get('price'),
+                "phone": request_data.get('phone'),
+                "status": "New",
+                "created_at": str(datetime.now())
+            }})
+            return req_id
+
+    def get_request(self, req_id):
+        r = self.requests.get(str(req_id))
+        return request_as_row(r) if r else None
+
+    def get_pending_requests(self):
+        with self.lock:
+            return [r for r in self.data["requests"] if r.get("status") == "New"]
+
+    def list_requests(self, status=None, since=None, until=None, after=None, limit=50, region=None, newest_first=True):
+        return self.request_order.page(lambda r: request_matches(r, status, since, until, region),
+                                       after, limit, newest_first, resolve=self.requests.get)
+
+    def update_request_fields(self, req_id, **fields):
+        with self.lock:
+            if str(req_id) not in self.requests: return False
+            self.commit({"op": "update_request", "id": str(req_id), "fields": fields})
+            return True
+
+    def update_request_status(self, req_id, status):
+        return self.update_request_fields(req_id, status=status)
+
+    def set_request_statuses(self, req_ids, status, only_from=None):
+        with self.lock:
+            changed = [self.requests[k] for k in dict.fromkeys(str(i) for i in req_ids)
+                       if k in self.requests and self.requests[k].get("status") != status
+                       and (only_from is None or self.requests[k].get("status") == only_from)]
+            if changed:
+                self.commit(*({"op": "update_request", "id": str(r["id"]), "fields": {"status": status}} for r in changed))
+            return [dict(r) for r in changed]
+
+    def update_request_details(self, req_id, region, price, rooms):
+        return self.update_request_fields(req_id, region=region, price=price, rooms=rooms)
+
+    def transaction_entry(self, realtor_id, request_id, amount):
+        return {"op": "add_transaction", "record": {
+            "id": new_id(),
+            "realtor_id": str(realtor_id),
+            "request_id": str(request_id),
+            "amount": amount,
+            "date": str(datetime.now())
+        }}
+
+    def add_transaction(self, realtor_id, request_id, amount):
+        self.commit(self.transaction_entry(realtor_id, request_id, amount))
+        return True
+
+    def list_transactions(self, realtor_id=None, since=None, until=None, after=None, limit=50):
+        return self.transaction_order.page(lambda t: transaction_matches(t, realtor_id, since, until), after, limit)
+
+    def purchase_contact(self, realtor_id, request_id, price):
+        with self.lock:
+            realtor = self.realtors.get(realtor_id)
+            if not realtor:
+                return "not_registered", None
+            request_data = self.requests.get(str(request_id))
+            if not request_data:
+                return "not_found", None
+            phone = request_data.get("phone")
+            if (str(realtor_id), str(request_id)) in self.purchases:
+                return "duplicate", phone
+            if int(realtor.get("balance") or 0) < price:
+                return "insufficient", None
+            self.commit(self.set_balance_entry(realtor, -price), self.transaction_entry(realtor_id, request_id, price),
+                        self.post_entry("purchase", realtor_id, price, request_id))
+            return "ok", phone
+
+    def refund_purchase(self, realtor_id, request_id):
+        with self.lock:
+            price = self.purchases.get((str(realtor_id), str(request_id)))
+            realtor = self.realtors.get(realtor_id)
+            if price is None or not realtor:
+                return "not_found"
+            if self.ledger.refunded(realtor_id, request_id):
+                return "already_refunded"
+            self.commit(self.set_balance_entry(realtor, price), self.post_entry("refund", realtor_id, price, request_id))
+            return "ok"
+
+    def get_ledger(self, telegram_id):
+        r = self.realtors.get(telegram_id)
+        if not r:
+            return None
+        account = realtor_account(r["telegram_id"])
+        return {"telegram_id": str(r["telegram_id"]), "balance": balance_of(r),
+                "ledger_balance": self.ledger.balance(account), "recent": self.ledger.recent(account)}
+
+    def reconcile_ledger(self):
+        with self.lock:
+            self.ledger.snapshot()
+            balances = [(r["telegram_id"], balance_of(r), self.ledger.balance(realtor_account(r["telegram_id"])))
+                        for r in self.realtors.all()]
+            return drift_report(balances, self.ledger.unbalanced())
+
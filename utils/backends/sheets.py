@@ -0,0 +1,1289 @@
+import gspread
+import requests
+from gspread.utils import rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+from utils.config import (
+    GOOGLE_KEY_FILE, SHEET_URL, WRITE_FLUSH_INTERVAL, WRITE_MAX_PENDING, WRITE_QUOTA_PER_MIN, DB_WORKERS,
+    WARM_SNAPSHOT_PATH, WARM_WRITE_WAIT, WRITE_SPILL_PATH,
+    SHEETS_RETRIES, SHEETS_BACKOFF, SHEETS_BACKOFF_MAX, SHEETS_BREAKER_THRESHOLD, SHEETS_BREAKER_COOLDOWN
+)
+from utils.cache import TaggedCache
+from utils.stats import StatsEngine
+from utils.matching import region_key, type_key
+from utils.metrics import (
+    SHEETS_CALLS, SHEETS_ERRORS, SHEETS_SECONDS, SHEETS_RETRIED, SHEETS_BREAKER, SHEETS_QUOTA_USED, SHEETS_QUOTA_LIMIT,
+    instrument
+)
+from utils.backends.ledger import (
+    LEDGER_HEADERS, Ledger, entry as ledger_entry, balance_kind, drift_report, realtor_account, refund_of
+)
+from utils.backends.base import (
+    StorageBackend, RealtorIndex, REALTOR_HEADERS, REQUEST_HEADERS, TRANSACTION_HEADERS,
+    BALANCE_COL, STATUS_COL, new_id, realtor_as_row, request_matches, request_sort_key, KeysetIndex, balance_of,
+    transaction_matches, transaction_sort_key
+)
+from collections import deque
+from datetime import datetime
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def open_sheet():
+    """Authorize with the service account and open SHEET_URL.
+
+    Returns None when no credentials are configured.
+    """
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+    # 1. Try ENV Variable (Best for Render/Cloud)
+    json_creds = os.getenv("GOOGLE_CREDENTIALS_JSON")
+    if json_creds:
+        creds_dict = json.loads(json_creds)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    # 2. Try File (Best for Local)
+    elif GOOGLE_KEY_FILE and os.path.exists(GOOGLE_KEY_FILE):
+        creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_KEY_FILE, scope)
+    else:
+        return None
+
+    client = gspread.authorize(creds)
+    return client.open_by_url(SHEET_URL)
+
+def api_call(op, fn, *args, **kwargs):
+    """Make one Sheets API call, counted and timed under `op`."""
+    SHEETS_CALLS.inc(op=op)
+    started = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        SHEETS_ERRORS.inc(op=op)
+        raise
+    finally:
+        SHEETS_SECONDS.observe(time.perf_counter() - started, op=op)
+
+class NotConfigured(RuntimeError):
+    """No Google credentials: there is no sheet to connect to, now or later."""
+
+class SheetsUnavailable(RuntimeError):
+    """Raised without calling the API while the sheet is not connected or the circuit is open."""
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def status_of(error):
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+def is_transient(error):
+    return isinstance(error, requests.exceptions.RequestException) or status_of(error) in RETRY_STATUSES
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def jittered(delay):
+    # Half fixed, half random: spreads retries out without ever retrying at once
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failed calls.
+
+    While open, calls are refused; once `cooldown` seconds have passed a
+    single probe call is let through, and its outcome closes the circuit
+    or opens it for another cooldown.
+    """
+
+    def __init__(self, threshold=SHEETS_BREAKER_THRESHOLD, cooldown=SHEETS_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def ready(self):
+        """True if a call would be let through, without claiming the probe."""
+        with self.lock:
+            return self.opened_at is None or (not self.probing and time.monotonic() - self.opened_at >= self.cooldown)
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            if self.opened_at is not None:
+                logger.info("Google Sheets reachable again; circuit closed")
+                self.opened_at = None
+                self.probing = False
+                SHEETS_BREAKER.set(0)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                if not self.probing:
+                    logger.warning(f"Google Sheets failed {self.failures} times in a row; circuit open")
+                self.opened_at = time.monotonic()
+                self.probing = False
+                SHEETS_BREAKER.set(1)
+
+class SheetsClient:
+    """The process's one connection to the Google Sheet.
+
+    Worksheet handles are looked up once and reused, and the authorized
+    HTTP session (with a connection pool sized for the storage threads)
+    lives as long as the process. Calls failing with 429/5xx or a network
+    error are retried with jittered exponential backoff. Repeated
+    failures open a CircuitBreaker: calls then fail fast with
+    SheetsUnavailable and writes wait in their WriteBuffer. A sheet that
+    cannot be opened at startup is retried in a background thread, and
+    on_connect() listeners run once it is.
+    """
+
+    def __init__(self, opener=None, retries=SHEETS_RETRIES, backoff=SHEETS_BACKOFF,
+                 backoff_max=SHEETS_BACKOFF_MAX, breaker=None):
+        # open_sheet is looked up at call time so benchmarks can point it elsewhere
+        self.opener = opener or (lambda: open_sheet())
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.lock = threading.RLock()
+        self.sheet = None
+        self.handles = {}
+        self.listeners = []
+        self.listeners_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.reconnecting = None
+        self.unconfigured = False
+        self.last_error = None
+        self.last_success = None
+        self.connected_at = None
+
+    def call(self, op, fn, *args, **kwargs):
+        if not self.breaker.allow():
+            raise SheetsUnavailable("Google Sheets circuit is open")
+        attempt = 0
+        while True:
+            try:
+                result = api_call(op, fn, *args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The API answered; the request itself was wrong
+                    self.breaker.success()
+                    raise
+                self.last_error = f"{op}: {e}"
+                if attempt >= self.retries:
+                    self.breaker.failure()
+                    raise
+                delay = retry_after(e) or jittered(min(self.backoff_max, self.backoff * 2 ** attempt))
+                attempt += 1
+                SHEETS_RETRIED.inc(op=op)
+                logger.debug(f"Sheets {op} failed ({e}); retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.success()
+            self.last_success = time.time()
+            return result
+
+    def require(self):
+        if self.sheet is None:
+            raise SheetsUnavailable("Google Sheet is not connected")
+        return self.sheet
+
+    def worksheet(self, name):
+        ws = self.handles.get(name)
+        if ws is None:
+            sheet = self.require()
+            ws = self.handles[name] = MeteredWorksheet(self.call("worksheet", sheet.worksheet, name), self)
+        return ws
+
+    def forget(self, name):
+        self.handles.pop(name, None)
+
+    def tune(self, sheet):
+        # Enough pooled keep-alive connections for every storage thread plus the writers
+        session = getattr(getattr(sheet, "client", None), "session", None)
+        if isinstance(session, requests.Session):
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DB_WORKERS + 4))
+
+    def connect(self):
+        with self.lock:
+            sheet = self.call("open", self.opener)
+            if sheet is None:
+                raise NotConfigured("No Google Credentials found")
+            self.tune(sheet)
+            self.sheet = sheet
+            self.handles.clear()
+            # Listeners may be added while the others run (without waiting for them); run those too
+            done = 0
+            while True:
+                with self.listeners_lock:
+                    if done == len(self.listeners):
+                        self.connected_at = time.time()
+                        self.connected.set()
+                        break
+                    pending = self.listeners[done:]
+                for listener in pending:
+                    listener()
+                done += len(pending)
+        logger.info("Connected to Google Sheet")
+
+    def start(self, background=False):
+        """Connect now if possible, otherwise keep trying in the background.
+
+        Returns whether the sheet is connected; raises NotConfigured when
+        there are no credentials at all. With background=True even the
+        first attempt is made from the reconnect thread, so the caller
+        does not wait for OAuth and the sheet lookup; missing credentials
+        then leave the client `unconfigured`.
+        """
+        if background:
+            self.reconnect(immediately=True)
+            return False
+        try:
+            self.connect()
+            return True
+        except NotConfigured:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"Google Sheet unreachable ({e}); reconnecting in the background")
+            self.reconnect()
+            return False
+
+    def on_connect(self, listener):
+        """Run listener() when the sheet connects, or now if it already is."""
+        with self.listeners_lock:
+            self.listeners.append(listener)
+            if not self.connected.is_set():
+                return
+        listener()
+
+    def reconnect(self, immediately=False):
+        with self.lock:
+            if self.reconnecting and self.reconnecting.is_alive():
+                return
+            self.reconnecting = threading.Thread(target=self.reconnect_loop, args=(immediately,),
+                                                 name="sheets-reconnect", daemon=True)
+            self.reconnecting.start()
+
+    def reconnect_loop(self, immediately=False):
+        attempt = 0
+        while not self.connected.is_set():
+            if attempt or not immediately:
+                time.sleep(jittered(min(self.breaker.cooldown, self.backoff * 2 ** attempt)))
+            attempt += 1
+            try:
+                self.connect()
+            except NotConfigured as e:
+                # Retrying will not produce credentials
+                self.last_error = str(e)
+                self.unconfigured = True
+                logger.warning(f"{e}; the Google Sheet stays disconnected")
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"Reconnecting to Google Sheet failed (attempt {attempt}): {e}")
+
+    def available(self):
+        """True when a call stands a chance: connected, and the circuit closed or ready for a probe."""
+        return self.connected.is_set() and self.breaker.ready()
+
+    def health(self):
+        if self.unconfigured:
+            state = "unconfigured"
+        elif not self.connected.is_set():
+            state = "offline"
+        elif self.breaker.state != "closed":
+            state = "degraded"
+        else:
+            state = "ok"
+        return {
+            "state": state,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "last_error": self.last_error,
+            "last_success": self.last_success,
+            "connected_at": self.connected_at,
+            "worksheets": sorted(self.handles),
+        }
+
+class MeteredWorksheet:
+    """A gspread Worksheet whose method calls all go through SheetsClient.call()."""
+
+    def __init__(self, ws, client):
+        self.ws = ws
+        self.client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self.ws, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return self.client.call(name, attr, *args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if status_of(e) in (400, 404):
+                    # The tab may have been renamed or deleted; look it up again next time
+                    self.client.forget(self.ws.title)
+                raise
+        return call
+
+# Bumped when the warm snapshot layout changes; older files are ignored
+SNAPSHOT_VERSION = 1
+
+def purchases_of(transactions):
+    # (realtor_id, request_id) -> price paid
+    return {(str(t.get("realtor_id")), str(t.get("request_id"))): int(t.get("amount") or 0) for t in transactions}
+
+MIRROR_TABS = {"Realtors": REALTOR_HEADERS, "Requests": REQUEST_HEADERS, "Transactions": TRANSACTION_HEADERS}
+# As the primary store the sheet also holds the ledger
+PRIMARY_TABS = {**MIRROR_TABS, "Ledger": LEDGER_HEADERS}
+
+def ensure_tabs(client, required_tabs=MIRROR_TABS):
+    sheet = client.require()
+    # The listing doubles as the handle cache, saving a metadata call per tab
+    for ws in client.call("worksheets", sheet.worksheets):
+        client.handles[ws.title] = MeteredWorksheet(ws, client)
+
+    for tab, headers in required_tabs.items():
+        if tab not in client.handles:
+            try:
+                ws = client.handles[tab] = MeteredWorksheet(
+                    client.call("add_worksheet", sheet.add_worksheet, title=tab, rows=1000, cols=10), client
+                )
+                logger.info(f"Created missing worksheet: {tab}")
+                ws.append_row(headers)
+            except Exception as e:
+                if is_transient(e) or isinstance(e, SheetsUnavailable):
+                    raise
+                logger.error(f"Error creating tab {tab}: {e}")
+
+def log_flush_error(error, message):
+    # With the circuit open every flush fails the same way; the breaker already logged why
+    (logger.debug if isinstance(error, SheetsUnavailable) else logger.error)(message)
+
+def appended_row(response):
+    # append_row responds with e.g. {"updates": {"updatedRange": "Realtors!A5:G5"}}
+    try:
+        updated = response["updates"]["updatedRange"]
+        return int("".join(ch for ch in updated.split("!")[-1].split(":")[0] if ch.isdigit()))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def first_cell(value_range):
+    return str(value_range[0][0]).strip() if value_range and value_range[0] else ""
+
+def spill_file(name):
+    return WRITE_SPILL_PATH.format(name=name) if WRITE_SPILL_PATH else None
+
+class WriteBuffer:
+    """Write-behind queue for sheet mutations.
+
+    Appended rows and cell updates are collected per worksheet and sent
+    every `interval` seconds as one append_rows and one batch_update call
+    per sheet. Repeated writes to the same cell are coalesced. Writers
+    block once `max_pending` operations are waiting, and the flusher keeps
+    under `quota` write calls per minute. While `available()` is false
+    (sheet down, circuit open) nothing is sent and writes just queue.
+
+    Writes still queued at close() are appended to `spill_path` and
+    queued again by the next start(), so an outage that outlasts the
+    process does not lose them. Callbacks do not survive the restart.
+    """
+
+    def __init__(self, get_worksheet, resolvers, interval=WRITE_FLUSH_INTERVAL,
+                 max_pending=WRITE_MAX_PENDING, quota=WRITE_QUOTA_PER_MIN, on_flush=None, name="sheets",
+                 available=None, spill_path=None):
+        self.name = name
+        self.spill_path = spill_path
+        self.available = available or (lambda: True)
+        self.get_worksheet = get_worksheet
+        # sheet name -> function(locator, ws, refresh=False) returning the row number of a record;
+        # refresh=True drops any remembered row and looks the record up again
+        self.resolvers = resolvers
+        # called with (sheet name, "append" or "update") once writes to it have landed
+        self.on_flush = on_flush
+        self.interval = interval
+        self.max_pending = max_pending
+        self.quota = quota
+        self.calls = deque()
+        self.cond = threading.Condition(threading.RLock())
+        self.flush_lock = threading.Lock()
+        self.appends = {}
+        self.updates = {}
+        self.pending = 0
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        if self.thread: return
+        self.replay()
+        self.thread = threading.Thread(target=self.run, name="sheet-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def wait_for_room(self):
+        # Back-pressure: let the flusher catch up instead of growing without bound
+        # ...but not during an outage, when this queue is all there is
+        deadline = time.time() + self.interval * 10
+        while self.pending >= self.max_pending and not self.stopped and time.time() < deadline and self.available():
+            self.cond.wait(self.interval)
+
+    def append(self, sheet_name, values, on_row=None):
+        with self.cond:
+            self.wait_for_room()
+            self.appends.setdefault(sheet_name, []).append((values, on_row))
+            self.pending += 1
+
+    def append_rows(self, sheet_name, rows, on_queued=None):
+        """Queue several rows together; on_queued() runs right after, still under the lock,
+        so whatever it records happens in the same order as the rows reach the sheet."""
+        with self.cond:
+            self.wait_for_room()
+            self.appends.setdefault(sheet_name, []).extend((values, None) for values in rows)
+            self.pending += len(rows)
+            if on_queued:
+                on_queued()
+
+    def update(self, sheet_name, locator, col, value, on_done=None):
+        with self.cond:
+            self.wait_for_room()
+            cells = self.updates.setdefault(sheet_name, {})
+            _, callbacks = cells.get((locator, col), (None, []))
+            if on_done:
+                callbacks.append(on_done)
+            if (locator, col) not in cells:
+                self.pending += 1
+            cells[(locator, col)] = (value, callbacks)
+
+    def queued(self, sheet_name):
+        """Rows and cell values ({(locator, col): value}) still waiting to be sent to sheet_name."""
+        with self.cond:
+            rows = [values for values, _ in self.appends.get(sheet_name, [])]
+            cells = {key: value for key, (value, _) in self.updates.get(sheet_name, {}).items()}
+        return rows, cells
+
+    def throttle(self):
+        while True:
+            now = time.time()
+            while self.calls and now - self.calls[0] > 60:
+                self.calls.popleft()
+            if len(self.calls) < self.quota:
+                self.calls.append(now)
+                SHEETS_QUOTA_USED.set(len(self.calls), writer=self.name)
+                SHEETS_QUOTA_LIMIT.set(self.quota, writer=self.name)
+                return
+            time.sleep(60 - (now - self.calls[0]))
+
+    def flush(self):
+        if not self.available():
+            return
+        with self.flush_lock:
+            with self.cond:
+                appends, self.appends = self.appends, {}
+                updates, self.updates = self.updates, {}
+            # Appends first so rows added in this window can be resolved for the updates
+            for sheet_name, items in appends.items():
+                try:
+                    ws = self.get_worksheet(sheet_name)
+                    if not ws: raise RuntimeError(f"{sheet_name} sheet not found")
+                    self.throttle()
+                    response = ws.append_rows([values for values, _ in items])
+                except Exception as e:
+                    log_flush_error(e, f"Error flushing {len(items)} rows to {sheet_name}: {e}")
+                    with self.cond:
+                        self.appends[sheet_name] = items + self.appends.get(sheet_name, [])
+                    continue
+                first = appended_row(response)
+                for offset, (_, on_row) in enumerate(items):
+                    if on_row:
+                        on_row(first + offset if first else None)
+                self.done(len(items))
+                self.flushed(sheet_name, "append")
+
+            for sheet_name, cells in updates.items():
+                try:
+                    ws = self.get_worksheet(sheet_name)
+                    if not ws: raise RuntimeError(f"{sheet_name} sheet not found")
+                    rows = self.locate(sheet_name, ws, dict.fromkeys(locator for locator, _ in cells))
+                    data, unresolved = [], {}
+                    for (locator, col), (value, callbacks) in cells.items():
+                        row = rows[locator]
+                        if row:
+                            data.append({"range": rowcol_to_a1(row, col), "values": [[value]]})
+                        else:
+                            unresolved[(locator, col)] = (value, callbacks)
+                    if data:
+                        self.throttle()
+                        ws.batch_update(data)
+                except Exception as e:
+                    log_flush_error(e, f"Error flushing {len(cells)} cells to {sheet_name}: {e}")
+                    self.requeue(sheet_name, cells)
+                    continue
+                for key, (_, callbacks) in cells.items():
+                    if key in unresolved:
+                        logger.warning(f"Dropping update for missing {sheet_name} record {key[0]}")
+                    for callback in callbacks:
+                        callback()
+                self.done(len(cells))
+                self.flushed(sheet_name, "update")
+
+    def flushed(self, sheet_name, kind):
+        if self.on_flush:
+            try:
+                self.on_flush(sheet_name, kind)
+            except Exception as e:
+                logger.error(f"Error in flush hook for {sheet_name}: {e}")
+
+    def locate(self, sheet_name, ws, locators):
+        """Row of each record, checked against the id in column A just before writing.
+
+        Remembered row numbers go stale when rows are sorted, deleted or
+        inserted by hand; those records are looked up again.
+        """
+        resolve = self.resolvers[sheet_name]
+        rows = {locator: resolve(locator, ws) for locator in locators}
+        known = [(locator, row) for locator, row in rows.items() if row]
+        if known:
+            ids = ws.batch_get([f"A{row}" for _, row in known])
+            for (locator, row), found in zip(known, ids):
+                if first_cell(found) != str(locator):
+                    logger.warning(f"{sheet_name} row {row} no longer holds {locator}; looking it up again")
+                    rows[locator] = resolve(locator, ws, refresh=True)
+        return rows
+
+    def requeue(self, sheet_name, cells):
+        with self.cond:
+            current = self.updates.setdefault(sheet_name, {})
+            for key, (value, callbacks) in cells.items():
+                if key in current:
+                    # A newer value arrived meanwhile; keep it but fire both sets of callbacks
+                    current[key][1].extend(callbacks)
+                    self.pending -= 1
+                else:
+                    current[key] = (value, callbacks)
+
+    def done(self, count):
+        with self.cond:
+            self.pending -= count
+            self.cond.notify_all()
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in sheet writer: {e}")
+
+    def close(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+        self.flush()
+        if self.pending and self.spill_path:
+            self.spill()
+        elif self.pending:
+            logger.warning(f"{self.pending} {self.name} writes were not delivered to the sheet")
+
+    def spill(self):
+        """Move the queued writes to spill_path, appending to whatever other processes left there."""
+        with self.cond:
+            ops = [{"sheet": sheet_name, "append": values}
+                   for sheet_name, items in self.appends.items() for values, _ in items]
+            ops += [{"sheet": sheet_name, "update": [locator, col, value]}
+                    for sheet_name, cells in self.updates.items() for (locator, col), (value, _) in cells.items()]
+            self.appends, self.updates = {}, {}
+            self.pending = 0
+        try:
+            with open(self.spill_path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.writelines(json.dumps(op, default=str) + "\n" for op in ops)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Could not save {len(ops)} unsent {self.name} writes to {self.spill_path}: {e}")
+            return
+        logger.warning(f"{len(ops)} {self.name} writes could not be sent; saved to {self.spill_path} for the next start")
+
+    def replay(self):
+        """Queue the writes a previous run left in spill_path, ahead of any new ones."""
+        if not self.spill_path:
+            return
+        try:
+            with open(self.spill_path, "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                lines = f.readlines()
+                f.seek(0)
+                f.truncate()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f"Could not read unsent {self.name} writes from {self.spill_path}: {e}")
+            return
+        ops = []
+        for line in lines:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # Cut short by a crash while saving
+                logger.warning(f"Skipping a damaged line in {self.spill_path}")
+        appends = {}
+        with self.cond:
+            # Not through append()/update(): these were accepted long ago and must not wait for room
+            for op in ops:
+                if "append" in op:
+                    appends.setdefault(op["sheet"], []).append((op["append"], None))
+                    continue
+                locator, col, value = op["update"]
+                cells = self.updates.setdefault(op["sheet"], {})
+                # A value written since the restart is newer
+                if (locator, col) not in cells:
+                    cells[(locator, col)] = (value, [])
+                    self.pending += 1
+            for sheet_name, items in appends.items():
+                self.appends[sheet_name] = items + self.appends.get(sheet_name, [])
+                self.pending += len(items)
+        if ops:
+            logger.info(f"Queued {len(ops)} {self.name} writes left unsent by the previous run")
+
+class SheetsMirror:
+    """Asynchronous export of another backend's changes to the Google Sheet.
+
+    Rows are located by the id in their first column, found once and then
+    remembered, so the sheet stays readable by hand without being the
+    source of truth.
+    """
+
+    def __init__(self, client, spill_path=spill_file("mirror")):
+        self.client = client
+        self.rows = {"Realtors": {}, "Requests": {}}
+        self.buffer = WriteBuffer(self.get_worksheet, {
+            "Realtors": self.resolver("Realtors"),
+            "Requests": self.resolver("Requests")
+        }, name="mirror", available=client.available, spill_path=spill_path)
+        client.on_connect(lambda: ensure_tabs(client))
+        # The primary store does not need the sheet to serve, so nobody waits for OAuth here
+        client.start(background=True)
+        self.buffer.start()
+
+    def get_worksheet(self, name):
+        return self.client.worksheet(name)
+
+    def resolver(self, sheet_name):
+        rows = self.rows[sheet_name]
+
+        def resolve(key, ws, refresh=False):
+            if refresh:
+                rows.pop(key, None)
+            if key not in rows:
+                cell = ws.find(str(key), in_column=1)
+                if not cell: return None
+                rows[key] = cell.row
+            return rows[key]
+        return resolve
+
+    def batch(self):
+        # Holding this keeps several changes in the same flush
+        return self.buffer.cond
+
+    def append(self, sheet_name, values):
+        if self.client.unconfigured: return
+        rows = self.rows.get(sheet_name)
+        key = str(values[0])
+
+        def on_row(row):
+            if row and rows is not None:
+                rows[key] = row
+        self.buffer.append(sheet_name, values, on_row)
+
+    def update(self, sheet_name, key, col, value):
+        if self.client.unconfigured: return
+        self.buffer.update(sheet_name, str(key), col, value)
+
+    def read(self, sheet_name):
+        return self.get_worksheet(sheet_name).get_all_records()
+
+    def health(self):
+        return {**self.client.health(), "queued_writes": self.buffer.pending}
+
+    def close(self):
+        self.buffer.close()
+
+@instrument
+class GoogleSheet(StorageBackend):
+    """Google Sheets as the primary store.
+
+    Realtors are served from a resident index and every write goes
+    through the write-behind buffer. If the sheet cannot be reached at
+    startup the backend comes up empty and not ready: requests are still
+    queued, registrations and purchases are refused (we cannot tell who
+    is registered), and the data loads as soon as the client connects.
+
+    The indexes are also saved to `snapshot_path`. A restarted process
+    serves reads from that snapshot straight away and re-reads the sheet
+    in the background; writes that need the full data wait briefly for
+    the re-read (WARM_WRITE_WAIT) before being refused.
+    """
+
+    name = "sheets"
+
+    def __init__(self, sheet=None, client=None, snapshot_path=WARM_SNAPSHOT_PATH, spill_path=spill_file("sheets")):
+        self.client = client or SheetsClient((lambda: sheet) if sheet else None)
+        self.snapshot_path = snapshot_path
+        self.ready = False
+        self.loaded = threading.Event()
+        self.restored_at = None
+        self.snapshot_lock = threading.Lock()
+        # Requests added or edited since a warm start; the re-read keeps our version of them
+        self.touched = set()
+        self.lock = threading.RLock()
+        self.realtors = RealtorIndex()
+        self.realtor_locks = {}
+        # (realtor_id, request_id) -> price paid, so repeat taps never charge twice
+        self.purchases = {}
+        self.transactions = []
+        self.ledger = Ledger()
+        # Ledger state from the snapshot, until load() has read the rows after it
+        self.ledger_state = None
+        # Request rows by id, loaded at startup so reads and status updates skip find()
+        self.requests = {}
+        self.request_rows = {}
+        # Sort orders for the admin pages and exports
+        self.request_order = KeysetIndex(request_sort_key)
+        self.transaction_order = KeysetIndex(transaction_sort_key)
+        # Whole-sheet reads for the dashboard; writes mark them stale (tags are lowercased sheet names)
+        self.cache = TaggedCache()
+        self.stats = StatsEngine()
+        self.buffer = WriteBuffer(self.get_worksheet, {
+            "Realtors": self.realtor_row,
+            "Requests": self.request_row
+        }, on_flush=self.flushed, available=self.client.available, spill_path=spill_path)
+        self.connect()
+
+    def connect(self):
+        # Raises NotConfigured without credentials; an unreachable sheet is retried in the background.
+        # With a snapshot to serve from, even the first attempt does not hold up startup.
+        restored = self.restore()
+        # Started first, so writes left unsent by the previous run are queued before load() reads
+        self.buffer.start()
+        self.client.on_connect(self.load)
+        try:
+            self.client.start(background=restored)
+        except NotConfigured:
+            # Saved again for a run that has credentials
+            self.buffer.close()
+            raise
+
+    def load(self):
+        ensure_tabs(self.client, PRIMARY_TABS)
+        since = self.realtors.read_started()
+        self.realtors.load(self.with_unsent("Realtors", REALTOR_HEADERS,
+                                            self.get_worksheet("Realtors").get_all_records()), since=since)
+        self.load_requests()
+        transactions = self.load_purchases()
+        self.load_ledger()
+        # The only full read of the three sheets; from here on the counters follow our own writes
+        self.stats.rebuild(
+            self.realtors.all(),
+            (dict(zip(REQUEST_HEADERS, row)) for row in self.requests.values()),
+            transactions,
+            self.ledger.refund_records()
+        )
+        self.ready = True
+        self.loaded.set()
+        self.touched.clear()
+        self.save_snapshot()
+        self.cache.warm("pending_requests", self.load_pending_requests, ("requests",))
+
+    def wait_loaded(self):
+        """Whether the sheet has been read; after a warm start, waits a little for the re-read."""
+        if not self.ready and self.restored_at:
+            self.loaded.wait(WARM_WRITE_WAIT)
+        return self.ready
+
+    def restore(self):
+        """Fill the indexes from the snapshot of a previous run; returns whether there was one."""
+        if not self.snapshot_path:
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.snapshot_path}: {e}")
+            return False
+        if data.get("version") != SNAPSHOT_VERSION or data.get("sheet") != SHEET_URL:
+            return False
+
+        for row, record in data["realtors"]:
+            self.realtors.add(record, row)
+        for row, values in data["requests"]:
+            req_id = str(values[0])
+            self.requests[req_id] = values
+            if row:
+                self.request_rows[req_id] = row
+        self.order_requests()
+        self.transactions = data["transactions"]
+        self.purchases = purchases_of(self.transactions)
+        self.transaction_order.reset(self.transactions)
+        self.ledger_state = data.get("ledger")
+        self.stats.rebuild(
+            self.realtors.all(),
+            (dict(zip(REQUEST_HEADERS, row)) for row in self.requests.values()),
+            self.transactions,
+            [tuple(refund) for refund in (self.ledger_state or {}).get("refunds", [])]
+        )
+        self.restored_at = data["saved_at"]
+        logger.info(f"Serving {len(data['realtors'])} realtors and {len(self.requests)} requests from "
+                    f"the snapshot of {datetime.fromtimestamp(self.restored_at)} while the sheet is re-read")
+        return True
+
+    def save_snapshot(self):
+        """Write the indexes to snapshot_path (atomically) for the next process to start from."""
+        if not self.snapshot_path or not self.ready:
+            return
+        with self.realtors.lock:
+            realtors = [[self.realtors.row(r["telegram_id"]), dict(r)] for r in self.realtors.all()]
+        with self.lock:
+            requests = [[self.request_rows.get(k), list(row)] for k, row in list(self.requests.items())]
+            transactions = list(self.transactions)
+        data = {"version": SNAPSHOT_VERSION, "sheet": SHEET_URL, "saved_at": time.time(),
+                "realtors": realtors, "requests": requests, "transactions": transactions,
+                "ledger": self.ledger.state()}
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with self.snapshot_lock:
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, default=str)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not save snapshot {self.snapshot_path}: {e}")
+
+    def reconcile_realtors(self):
+        """Reload the realtor index from the sheet to pick up manual edits."""
+        try:
+            since = self.realtors.read_started()
+            self.realtors.load(self.get_worksheet("Realtors").get_all_records(), since=since)
+        except Exception as e:
+            logger.error(f"Error reconciling realtors: {e}")
+            return False
+        self.save_snapshot()
+        return True
+
+    def load_requests(self):
+        values = self.get_worksheet("Requests").get_all_values()
+        queued, cells = self.buffer.queued("Requests")
+        requests, request_rows = {}, {}
+        for row_number, row in [*enumerate(values[1:], start=2), *((None, list(v)) for v in queued)]:
+            req_id = str(row[0]).strip() if row else ""
+            # Older second-based ids may repeat; keep the first row, like find() did
+            if req_id and req_id not in requests:
+                requests[req_id] = row
+                if row_number:
+                    request_rows[req_id] = row_number
+        for (req_id, col), value in cells.items():
+            row = requests.get(str(req_id))
+            if row is not None:
+                row = requests[str(req_id)] = list(row) + [""] * (col - len(row))
+                row[col - 1] = value
+        with self.lock:
+            # Queued before this read finished, so newer than the sheet's copy
+            for req_id in self.touched:
+                if req_id in self.requests:
+                    requests[req_id] = self.requests[req_id]
+                if req_id in self.request_rows:
+                    request_rows.setdefault(req_id, self.request_rows[req_id])
+            self.requests, self.request_rows = requests, request_rows
+            self.order_requests()
+
+    def order_requests(self):
+        self.request_order.reset((dict(zip(REQUEST_HEADERS, row)) for row in self.requests.values()),
+                                 lambda r: str(r["id"]).strip())
+
+    def request_record(self, req_id):
+        row = self.requests.get(req_id)
+        return dict(zip(REQUEST_HEADERS, row)) if row is not None else None
+
+    def load_purchases(self):
+        transactions = self.with_unsent("Transactions", TRANSACTION_HEADERS,
+                                        self.get_worksheet("Transactions").get_all_records())
+        with self.lock:
+            self.transactions = transactions
+            self.purchases = purchases_of(transactions)
+            self.transaction_order.reset(transactions)
+        return transactions
+
+    def load_ledger(self):
+        ws = self.get_worksheet("Ledger")
+        ledger = self.resume_ledger(ws)
+        if ledger is None:
+            ledger = Ledger()
+            records = self.with_unsent("Ledger", LEDGER_HEADERS, ws.get_all_records())
+            ledger.apply([r for r in records if str(r.get("entry_id", "")).strip()])
+        self.ledger = ledger
+        if not ledger.rows:
+            # First start with a ledger: book the balances realtors already have as opening entries
+            for r in self.realtors.all():
+                if balance_of(r):
+                    self.post("opening", r["telegram_id"], balance_of(r))
+
+    def with_unsent(self, sheet_name, headers, records):
+        """`records` read from sheet_name plus the writes still queued for it, as the next flush leaves the sheet.
+
+        At startup these are requests queued before the load and the writes
+        the previous run could not send (see WriteBuffer.replay).
+        """
+        rows, cells = self.buffer.queued(sheet_name)
+        records = list(records) + [dict(zip(headers, values)) for values in rows]
+        if cells:
+            by_key = {str(r.get(headers[0], "")).strip(): r for r in records}
+            for (locator, col), value in cells.items():
+                record = by_key.get(str(locator))
+                if record is not None:
+                    record[headers[col - 1]] = value
+        return records
+
+    def resume_ledger(self, ws):
+        """The snapshot's ledger state plus only the sheet rows after it; None if they do not line up."""
+        state, self.ledger_state = self.ledger_state, None
+        if not state or not state["rows"]:
+            return None
+        # Row 1 is the header, so the last row the state covers is rows + 1; read from there on
+        last_col = chr(ord("A") + len(LEDGER_HEADERS) - 1)
+        values = ws.get(f"A{state['rows'] + 1}:{last_col}")
+        if first_cell(values[:1]) != str(state["through"]):
+            logger.info("Ledger sheet does not line up with the snapshot; reading all of it")
+            return None
+        ledger = Ledger()
+        ledger.restore(state)
+        ledger.apply([dict(zip(LEDGER_HEADERS, list(v) + [""] * len(LEDGER_HEADERS)))
+                      for v in values[1:] if v and str(v[0]).strip()])
+        return ledger
+
+    def close(self):
+        self.buffer.close()
+        self.save_snapshot()
+
+    def flushed(self, sheet_name, kind):
+        # Balance cells are not part of any cached view; everything else is
+        if (sheet_name, kind) != ("Realtors", "update"):
+            self.cache.invalidate(sheet_name.lower())
+
+    def realtor_row(self, telegram_id, ws, refresh=False):
+        row = None if refresh else self.realtors.row(telegram_id)
+        if not row:
+            cell = ws.find(str(telegram_id), in_column=1)
+            row = cell.row if cell else None
+            if refresh:
+                self.realtors.move(telegram_id, row)
+        return row
+
+    def request_row(self, req_id, ws, refresh=False):
+        if refresh:
+            self.request_rows.pop(str(req_id), None)
+        row = self.request_rows.get(str(req_id))
+        if not row:
+            cell = ws.find(str(req_id), in_column=1)
+            if cell:
+                row = self.request_rows[str(req_id)] = cell.row
+        return row
+
+    def realtor_lock(self, telegram_id):
+        with self.lock:
+            return self.realtor_locks.setdefault(str(telegram_id), threading.RLock())
+
+    def get_worksheet(self, name):
+        return self.client.worksheet(name)
+
+    def add_realtor(self, telegram_id, full_name, region, r_type, phone):
+        region = region_key(region)
+        r_type = type_key(r_type)
+        # Until the sheet has loaded we cannot tell whether they are registered already
+        if not self.wait_loaded(): return False
+
+        with self.realtors.lock:
+            if self.realtors.get(telegram_id): return False
+            record = {
+                "telegram_id": str(telegram_id),
+                "full_name": full_name,
+                "region": region,
+                "type": r_type,
+                "phone": phone,
+                "balance": 0,
+                "registered_at": str(datetime.now())
+            }
+            # Reserve the id so a concurrent registration cannot append a second row
+            self.realtors.add(record)
+            self.realtors.begin_write(telegram_id)
+
+        def on_row(row):
+            if row:
+                self.realtors.add(record, row)
+            self.realtors.end_write(telegram_id)
+
+        self.buffer.append("Realtors", [record[h] for h in REALTOR_HEADERS], on_row)
+        self.cache.invalidate("realtors")
+        self.stats.record_registration(region, record["registered_at"])
+        return True
+
+    def get_realtor(self, telegram_id):
+        r = self.realtors.get(telegram_id)
+        if not r: return None
+        return realtor_as_row(r)
+
+    def get_realtors_by_filter(self, region, r_type):
+        return self.realtors.match(region, r_type)
+
+    def update_balance(self, telegram_id, amount_change):
+        # A balance from the snapshot may be stale, and the re-read replaces the ledger
+        if not self.wait_loaded(): return False
+        # Serialized per realtor so sheet writes land in the same order as the index updates
+        with self.realtor_lock(telegram_id):
+            if not self._update_balance(str(telegram_id), amount_change):
+                return False
+            self.post(balance_kind(amount_change), telegram_id, amount_change)
+            return True
+
+    def post(self, kind, telegram_id, amount, ref=""):
+        rows = ledger_entry(kind, telegram_id, amount, ref)
+        # Applied in the order the rows are queued, so a saved ledger state lines up with the sheet
+        self.buffer.append_rows("Ledger", [[row[h] for h in LEDGER_HEADERS] for row in rows],
+                                lambda: self.ledger.apply(rows))
+        for refund in filter(None, map(refund_of, rows)):
+            self.stats.record_refund(*refund)
+
+    def _update_balance(self, key, amount_change):
+        with self.realtors.lock:
+            r = self.realtors.get(key)
+            if not r: return False
+            new_bal = int(r.get("balance") or 0) + amount_change
+            r["balance"] = new_bal
+            self.realtors.begin_write(key)
+
+        self.buffer.update("Realtors", key, BALANCE_COL, new_bal, lambda: self.realtors.end_write(key))
+        return True
+
+    def add_request(self, request_data):
+        req_id = new_id()
+        row = [
+            req_id,
+            request_data.get('type'),
+            request_data.get('region'),
+            request_data.get('rooms'),
+            request_data.get('price'),
+            request_data.get('phone'),
+            "New",
+            str(datetime.now())
+        ]
+        with self.lock:
+            self.requests[req_id] = row
+            self.request_order.add(dict(zip(REQUEST_HEADERS, row)), req_id)
+            if not self.ready:
+                self.touched.add(req_id)
+        self.buffer.append("Requests", row, lambda n: self.request_rows.__setitem__(req_id, n) if n else None)
+        self.cache.invalidate("requests")
+        self.stats.record_request(req_id, row[2], row[7])
+        return req_id
+
+    def get_request(self, req_id):
+        req_id = str(req_id)
+        if req_id in self.requests:
+            return list(self.requests[req_id])
+        try:
+            ws = self.get_worksheet("Requests")
+            if not ws: return None
+            row = self.request_row(req_id, ws)
+            if row:
+                values = ws.row_values(row)
+                with self.lock:
+                    if req_id not in self.requests:
+                        self.request_order.add(dict(zip(REQUEST_HEADERS, values)), req_id)
+                    self.requests[req_id] = values
+                return list(values)
+        except Exception as e:
+            logger.error(f"Error getting request {req_id}: {e}")
+        return None
+
+    def add_transaction(self, realtor_id, request_id, amount):
+        values = [new_id(), str(realtor_id), str(request_id), amount, str(datetime.now())]
+        self.buffer.append("Transactions", values)
+        with self.lock:
+            self.purchases[(str(realtor_id), str(request_id))] = amount
+            self.transactions.append(dict(zip(TRANSACTION_HEADERS, values)))
+            self.transaction_order.add(self.transactions[-1])
+        self.cache.invalidate("transactions")
+        self.stats.record_sale(realtor_id, request_id, amount, values[4])
+        return True
+
+    def purchase_contact(self, realtor_id, request_id, price):
+        key = (str(realtor_id), str(request_id))
+        if not self.wait_loaded():
+            return "error", None
+        with self.realtor_lock(realtor_id):
+            realtor = self.realtors.get(realtor_id)
+            if not realtor:
+                return "not_registered", None
+
+            # Resolve the phone first so nobody is charged for a missing request
+            request_data = self.get_request(request_id)
+            if not request_data:
+                return "not_found", None
+            # Request row: id, type, region, rooms, price, phone, status, created_at
+            phone = request_data[5]
+
+            if key in self.purchases:
+                return "duplicate", phone
+            if int(realtor.get("balance") or 0) < price:
+                return "insufficient", None
+
+            # Holding the buffer lock puts the debit and the transaction in the same flush
+            with self.buffer.cond:
+                if not self._update_balance(key[0], -price):
+                    return "error", None
+                if not self.add_transaction(realtor_id, request_id, price):
+                    self._update_balance(key[0], price)
+                    return "error", None
+                self.post("purchase", realtor_id, price, request_id)
+            return "ok", phone
+
+    def refund_purchase(self, realtor_id, request_id):
+        key = (str(realtor_id), str(request_id))
+        if not self.wait_loaded():
+            return "error"
+        with self.realtor_lock(realtor_id):
+            price = self.purchases.get(key)
+            if price is None:
+                return "not_found"
+            if self.ledger.refunded(*key):
+                return "already_refunded"
+            with self.buffer.cond:
+                if not self._update_balance(key[0], price):
+                    return "not_found"
+                self.post("refund", realtor_id, price, request_id)
+            return "ok"
+
+    def get_ledger(self, telegram_id):
+        self.wait_loaded()
+        r = self.realtors.get(telegram_id)
+        if not r:
+            return None
+        account = realtor_account(r["telegram_id"])
+        return {"telegram_id": str(r["telegram_id"]), "balance": balance_of(r),
+                "ledger_balance": self.ledger.balance(account), "recent": self.ledger.recent(account)}
+
+    def reconcile_ledger(self):
+        # Run after reconcile_realtors() has picked up balances edited by hand in the sheet
+        if not self.wait_loaded():
+            # Snapshot balances against a ledger not read yet would all look like drift
+            raise SheetsUnavailable("Google Sheet is not loaded yet")
+        self.ledger.snapshot()
+        balances = [(r["telegram_id"], balance_of(r), self.ledger.balance(realtor_account(r["telegram_id"])))
+                    for r in self.realtors.all()]
+        return drift_report(balances, self.ledger.unbalanced())
+
+    def get_all_realtors(self):
+        return self.realtors.all()
+
+    def load_pending_requests(self):
+        all_reqs = self.get_worksheet("Requests").get_all_records()
+        return [r for r in all_reqs if r.get("status") == "New"]
+
+    def get_pending_requests(self):
+        try:
+            return self.cache.get("pending_requests", self.load_pending_requests, ("requests",))
+        except Exception as e:
+            logger.error(f"Error fetching pending requests: {e}")
+            return []
+
+    def list_requests(self, status=None, since=None, until=None, after=None, limit=50, region=None, newest_first=True):
+        # Served from the resident request rows, not a sheet read
+        return self.request_order.page(lambda r: request_matches(r, status, since, until, region),
+                                       after, limit, newest_first, resolve=self.request_record)
+
+    def list_transactions(self, realtor_id=None, since=None, until=None, after=None, limit=50):
+        return self.transaction_order.page(lambda t: transaction_matches(t, realtor_id, since, until), after, limit)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def sheets_health(self):
+        return {**self.client.health(), "loaded": self.ready, "snapshot_from": self.restored_at,
+                "queued_writes": self.buffer.pending}
+
+    def update_request_status(self, req_id, status):
+        return self.update_request_cells(req_id, {STATUS_COL: status})
+
+    def update_request_details(self, req_id, region, price, rooms):
+        # Headers: id(1), type(2), region(3), rooms(4), price(5), phone(6), status(7), created_at(8)
+        return self.update_request_cells(req_id, {3: region, 4: rooms, 5: price})
+
+    def set_request_statuses(self, req_ids, status, only_from=None):
+        # Fetched first (this may read the sheet), then checked and set under the lock,
+        # so of two concurrent approvals of a request only one sees it change
+        keys = [k for k in dict.fromkeys(str(i) for i in req_ids) if self.get_request(k)]
+        changed = []
+        with self.lock:
+            for req_id in keys:
+                row = self.requests[req_id]
+                current = row[STATUS_COL - 1] if len(row) >= STATUS_COL else ""
+                if current == status or (only_from is not None and current != only_from):
+                    continue
+                while len(row) < STATUS_COL:
+                    row.append("")
+                row[STATUS_COL - 1] = status
+                if not self.ready:
+                    self.touched.add(req_id)
+                changed.append(dict(zip(REQUEST_HEADERS, row)))
+        for record in changed:
+            self.buffer.update("Requests", str(record["id"]), STATUS_COL, status)
+        if changed:
+            self.cache.invalidate("requests")
+        return changed
+
+    def update_request_cells(self, req_id, values):
+        req_id = str(req_id)
+        # Make sure the request exists (and is cached) before queueing the write
+        if not self.get_request(req_id):
+            return False
+        with self.lock:
+            row = self.requests[req_id]
+            if not self.ready:
+                self.touched.add(req_id)
+        for col, value in values.items():
+            while len(row) < col:
+                row.append("")
+            row[col - 1] = value
+            self.buffer.update("Requests", req_id, col, value)
+        self.cache.invalidate("requests")
+        return True
@@ -0,0 +1,555 @@
+from utils.backends.ledger import (
+    LEDGER_HEADERS, entry as ledger_entry, balance_kind, drift_report, realtor_account, refund_of
+)
+from utils.backends.base import (
+    StorageBackend, REALTOR_HEADERS, REQUEST_HEADERS, TRANSACTION_HEADERS, BALANCE_COL,
+    STATUS_COL, new_id, realtor_as_row, request_as_row, merge_changes
+)
+from utils.matching import DealType, region_key, type_key
+from utils.stats import StatsEngine
+from utils.metrics import instrument
+from utils.config import LEDGER_SNAPSHOT_EVERY, SQLITE_SEED_WAIT
+from contextlib import contextmanager
+from datetime import datetime
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS realtors (
+    telegram_id TEXT PRIMARY KEY,
+    full_name TEXT,
+    region TEXT,
+    type TEXT,
+    phone TEXT,
+    balance INTEGER NOT NULL DEFAULT 0,
+    registered_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_realtors_region_type ON realtors(region, type);
+
+CREATE TABLE IF NOT EXISTS requests (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    region TEXT,
+    rooms TEXT,
+    price TEXT,
+    phone TEXT,
+    status TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
+-- Keyset pagination for the admin API, newest first, optionally by status
+CREATE INDEX IF NOT EXISTS idx_requests_created ON requests(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_requests_status_created ON requests(status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_requests_region ON requests(region);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT NOT NULL,
+    realtor_id TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_id ON transactions(id);
+CREATE INDEX IF NOT EXISTS idx_transactions_purchase ON transactions(realtor_id, request_id);
+-- Keyset pagination for exports, oldest first
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date, id);
+
+-- Double-entry ledger: every entry is two rows whose amounts sum to zero
+CREATE TABLE IF NOT EXISTS ledger (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    account TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    ref TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_account ON ledger(account, seq);
+CREATE INDEX IF NOT EXISTS idx_ledger_ref ON ledger(ref, kind);
+
+-- Balance of each account as of ledger row `seq`; the balance now is this plus the rows after it
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    account TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    taken_at TEXT
+);
+"""
+
+def chunks(keys, size=500):
+    # Stay under SQLite's limit on bound parameters per statement
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+@instrument
+class SQLiteStorage(StorageBackend):
+    """SQLite (WAL) as the primary store.
+
+    Each worker thread gets its own connection. Writes run in
+    BEGIN IMMEDIATE transactions; an optional SheetsMirror receives every
+    committed change and exports it to the Google Sheet in the background.
+    An empty database is seeded from the mirror on first start.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, mirror=None, seed_wait=SQLITE_SEED_WAIT):
+        self.path = path
+        self.mirror = mirror
+        self.local = threading.local()
+        # SQLite allows one writer anyway; this also keeps mirror exports in commit order
+        self.write_lock = threading.Lock()
+        self.conn().executescript(SCHEMA)
+        if mirror:
+            mirror.client.on_connect(self.seed_from_mirror)
+            if self.is_empty() and not mirror.client.connected.is_set():
+                # Serving from an empty database would split the data from the sheet's
+                logger.warning(f"Database is empty; waiting up to {seed_wait:g}s for the sheet to seed it from")
+                deadline = time.monotonic() + seed_wait
+                while not mirror.client.connected.wait(0.1) and not mirror.client.unconfigured:
+                    if time.monotonic() >= deadline:
+                        logger.warning("Sheet not reachable; starting with an empty database, "
+                                       "it is seeded when the sheet connects if nothing is written before")
+                        break
+        self.canonicalize_realtors()
+        self.open_ledger()
+        # Ledger rows up to here have been checked for entries that do not balance
+        self.ledger_checked = 0
+        self.ledger_unbalanced = []
+        self.stats = StatsEngine()
+        self.stats_lock = threading.Lock()
+        self.stats_seen = {"realtors": 0, "requests": 0, "transactions": 0, "refunds": 0}
+        self.sync_stats()
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # Lets queries match the free-text region of requests in canonical form
+            conn.create_function("region_key", 1, region_key, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yields (conn, exports); exports are (method, args...) tuples sent to the mirror after COMMIT."""
+        with self.write_lock:
+            conn = self.conn()
+            exports = []
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn, exports
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.export(exports)
+
+    def export(self, exports):
+        if not self.mirror or not exports: return
+        try:
+            with self.mirror.batch():
+                for method, *args in exports:
+                    getattr(self.mirror, method)(*args)
+        except Exception as e:
+            logger.error(f"Error exporting to sheet mirror: {e}")
+
+    def is_empty(self):
+        conn = self.conn()
+        return not any(conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() for t in ("realtors", "requests", "transactions"))
+
+    def seed_from_mirror(self):
+        # Only an empty database is seeded; after that the sheet is just an export target
+        if self.is_empty():
+            self.import_from(self.mirror)
+            self.canonicalize_realtors()
+            self.open_ledger()
+
+    def import_from(self, mirror):
+        tables = [
+            ("realtors", "Realtors", REALTOR_HEADERS),
+            ("requests", "Requests", REQUEST_HEADERS),
+            ("transactions", "Transactions", TRANSACTION_HEADERS),
+        ]
+        with self.write_lock:
+            conn = self.conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have seeded it while we waited for the lock
+                if not self.is_empty():
+                    conn.execute("ROLLBACK")
+                    return
+                for table, sheet_name, headers in tables:
+                    records = mirror.read(sheet_name)
+                    rows = [[str(r.get(h, "")) if h in ("telegram_id", "id", "realtor_id", "request_id") else r.get(h, "")
+                             for h in headers] for r in records if str(r.get(headers[0], "")).strip()]
+                    # Duplicate ids keep the first row, like find() did
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO {table} ({', '.join(headers)}) VALUES ({', '.join('?' * len(headers))})",
+                        rows
+                    )
+                    logger.info(f"Imported {len(rows)} rows from {sheet_name}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def canonicalize_realtors(self):
+        """Rewrite region/type of older rows (free text, imported from the sheet) to canonical keys."""
+        rows = self.conn().execute("SELECT telegram_id, region, type FROM realtors").fetchall()
+        changes = [(region_key(r["region"]), type_key(r["type"]), r["telegram_id"]) for r in rows
+                   if (region_key(r["region"]), type_key(r["type"])) != (r["region"], r["type"])]
+        if changes:
+            with self.transaction() as (conn, exports):
+                conn.executemany("UPDATE realtors SET region = ?, type = ? WHERE telegram_id = ?", changes)
+
+    def sync_stats(self):
+        """Feed the counters the rows added since the last call, by this or any other process.
+
+        Tables are append-only, so following them by rowid reads each row
+        once and keeps every worker's numbers identical.
+        """
+        with self.stats_lock:
+            conn = self.conn()
+            seen = self.stats_seen
+            for r in conn.execute("SELECT rowid, region, registered_at FROM realtors WHERE rowid > ? ORDER BY rowid", (seen["realtors"],)):
+                self.stats.record_registration(r["region"], r["registered_at"])
+                seen["realtors"] = r["rowid"]
+            # Requests before transactions, so sales get a region
+            for r in conn.execute("SELECT rowid, id, region, created_at FROM requests WHERE rowid > ? ORDER BY rowid", (seen["requests"],)):
+                self.stats.record_request(r["id"], r["region"], r["created_at"])
+                seen["requests"] = r["rowid"]
+            for r in conn.execute("SELECT rowid, realtor_id, request_id, amount, date FROM transactions WHERE rowid > ? ORDER BY rowid", (seen["transactions"],)):
+                self.stats.record_sale(r["realtor_id"], r["request_id"], r["amount"], r["date"])
+                seen["transactions"] = r["rowid"]
+            for r in conn.execute(
+                "SELECT seq, account, kind, amount, ref, created_at FROM ledger WHERE kind = 'refund' AND seq > ? "
+                "AND account LIKE ? ORDER BY seq", (seen["refunds"], realtor_account("") + "%")
+            ):
+                self.stats.record_refund(*refund_of(r))
+                seen["refunds"] = r["seq"]
+
+    def get_stats(self):
+        self.sync_stats()
+        return self.stats.summary()
+
+    def get_stats_report(self, days=30):
+        self.sync_stats()
+        return self.stats.report(days)
+
+    def sheets_health(self):
+        return self.mirror.health() if self.mirror else None
+
+    def close(self):
+        if self.mirror:
+            self.mirror.close()
+
+    def add_realtor(self, telegram_id, full_name, region, r_type, phone):
+        record = {
+            "telegram_id": str(telegram_id),
+            "full_name": full_name,
+            "region": region_key(region),
+            "type": type_key(r_type),
+            "phone": phone,
+            "balance": 0,
+            "registered_at": str(datetime.now())
+        }
+        values = [record[h] for h in REALTOR_HEADERS]
+        with self.transaction() as (conn, exports):
+            cur = conn.execute(f"INSERT OR IGNORE INTO realtors VALUES ({', '.join('?' * len(values))})", values)
+            if cur.rowcount == 0:
+                return False
+            exports.append(("append", "Realtors", values))
+        return True
+
+    def get_realtor(self, telegram_id):
+        row = self.conn().execute("SELECT * FROM realtors WHERE telegram_id = ?", (str(telegram_id),)).fetchone()
+        return realtor_as_row(dict(row)) if row else None
+
+    def get_realtors_by_filter(self, region, r_type):
+        # Columns hold canonical keys, so idx_realtors_region_type is the routing table
+        region = region_key(region)
+        r_type = type_key(r_type)
+        if r_type == DealType.BOTH.value:
+            rows = self.conn().execute("SELECT * FROM realtors WHERE region = ?", (region,))
+        else:
+            rows = self.conn().execute(
+                "SELECT * FROM realtors WHERE region = ? AND type IN (?, ?)", (region, r_type, DealType.BOTH.value)
+            )
+        return [dict(r) for r in rows]
+
+    def get_all_realtors(self):
+        return [dict(r) for r in self.conn().execute("SELECT * FROM realtors ORDER BY rowid")]
+
+    def list_realtors(self, region=None, r_type=None, min_balance=None, max_balance=None, after=None, limit=50):
+        clauses = []
+        if region:
+            clauses.append(("region = ?", region_key(region)))
+        if r_type:
+            clauses.append(("type = ?", type_key(r_type)))
+        if min_balance is not None:
+            clauses.append(("balance >= ?", min_balance))
+        if max_balance is not None:
+            clauses.append(("balance <= ?", max_balance))
+        if after:
+            clauses.append(("telegram_id > ?", *after))
+        return self.page("realtors", clauses, ("telegram_id",), limit)
+
+    def page(self, table, clauses, key_columns, limit, descending=False):
+        """Keyset page: rows past the cursor clause in key_columns order, plus the next cursor."""
+        sql = f"SELECT * FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clause for clause, *_ in clauses)
+        order = " DESC" if descending else ""
+        sql += " ORDER BY " + ", ".join(c + order for c in key_columns) + " LIMIT ?"
+        params = [value for _, *values in clauses for value in values]
+        # One extra row tells whether another page follows
+        rows = [dict(r) for r in self.conn().execute(sql, (*params, limit + 1))]
+        if len(rows) <= limit:
+            return rows, None
+        return rows[:limit], [rows[limit - 1][c] for c in key_columns]
+
+    def update_balance(self, telegram_id, amount_change):
+        key = str(telegram_id)
+        with self.transaction() as (conn, exports):
+            cur = conn.execute("UPDATE realtors SET balance = balance + ? WHERE telegram_id = ?", (amount_change, key))
+            if cur.rowcount == 0:
+                return False
+            balance = conn.execute("SELECT balance FROM realtors WHERE telegram_id = ?", (key,)).fetchone()[0]
+            exports.append(("update", "Realtors", key, BALANCE_COL, balance))
+            self.post(conn, balance_kind(amount_change), key, amount_change)
+        return True
+
+    def update_balances(self, changes):
+        merged = merge_changes(changes)
+        balances = {}
+        with self.transaction() as (conn, exports):
+            conn.executemany("UPDATE realtors SET balance = balance + ? WHERE telegram_id = ?",
+                             [(amount, key) for key, amount in merged.items()])
+            for chunk in chunks(list(merged)):
+                balances.update(conn.execute(
+                    f"SELECT telegram_id, balance FROM realtors WHERE telegram_id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            exports += [("update", "Realtors", key, BALANCE_COL, balance) for key, balance in balances.items()]
+            for key in balances:
+                self.post(conn, balance_kind(merged[key]), key, merged[key])
+        return balances
+
+    def add_request(self, request_data):
+        values = [
+            new_id(),
+            request_data.get('type'),
+            request_data.get('region'),
+            request_data.get('rooms'),
+            request_data.get('price'),
+            request_data.get('phone'),
+            "New",
+            str(datetime.now())
+        ]
+        with self.transaction() as (conn, exports):
+            conn.execute(f"INSERT INTO requests VALUES ({', '.join('?' * len(values))})", values)
+            exports.append(("append", "Requests", values))
+        return values[0]
+
+    def get_request(self, req_id):
+        row = self.conn().execute("SELECT * FROM requests WHERE id = ?", (str(req_id),)).fetchone()
+        return request_as_row(dict(row)) if row else None
+
+    def get_pending_requests(self):
+        return [dict(r) for r in self.conn().execute("SELECT * FROM requests WHERE status = 'New' ORDER BY rowid")]
+
+    def list_requests(self, status=None, since=None, until=None, after=None, limit=50, region=None, newest_first=True):
+        clauses = []
+        if status:
+            clauses.append(("status = ?", status))
+        if region:
+            # Requests keep the region as submitted, in any case or spelling; compare canonical keys
+            clauses.append(("region_key(region) = ?", region_key(region)))
+        if since:
+            clauses.append(("created_at >= ?", since))
+        if until:
+            clauses.append(("created_at < ?", until))
+        if after:
+            clauses.append((f"(created_at, id) {'<' if newest_first else '>'} (?, ?)", *after))
+        return self.page("requests", clauses, ("created_at", "id"), limit, descending=newest_first)
+
+    def update_request_fields(self, req_id, fields):
+        # fields: {column name: value}
+        with self.transaction() as (conn, exports):
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            cur = conn.execute(f"UPDATE requests SET {assignments} WHERE id = ?", (*fields.values(), str(req_id)))
+            if cur.rowcount == 0:
+                return False
+            for name, value in fields.items():
+                exports.append(("update", "Requests", str(req_id), REQUEST_HEADERS.index(name) + 1, value))
+        return True
+
+    def update_request_status(self, req_id, status):
+        return self.update_request_fields(req_id, {"status": status})
+
+    def set_request_statuses(self, req_ids, status, only_from=None):
+        keys = list(dict.fromkeys(str(i) for i in req_ids))
+        changed = []
+        current = " AND status = ?" if only_from is not None else ""
+        with self.transaction() as (conn, exports):
+            for chunk in chunks(keys):
+                changed += [dict(r) for r in conn.execute(
+                    f"SELECT * FROM requests WHERE id IN ({', '.join('?' * len(chunk))}) AND status IS NOT ?{current}",
+                    (*chunk, status, *([only_from] if only_from is not None else []))
+                )]
+            conn.executemany("UPDATE requests SET status = ? WHERE id = ?", [(status, r["id"]) for r in changed])
+            exports += [("update", "Requests", r["id"], STATUS_COL, status) for r in changed]
+        return [{**r, "status": status} for r in changed]
+
+    def update_request_details(self, req_id, region, price, rooms):
+        return self.update_request_fields(req_id, {"region": region, "rooms": rooms, "price": price})
+
+    def _insert_transaction(self, conn, exports, realtor_id, request_id, amount):
+        values = [new_id(), str(realtor_id), str(request_id), amount, str(datetime.now())]
+        conn.execute("INSERT INTO transactions VALUES (?, ?, ?, ?, ?)", values)
+        exports.append(("append", "Transactions", values))
+
+    def add_transaction(self, realtor_id, request_id, amount):
+        with self.transaction() as (conn, exports):
+            self._insert_transaction(conn, exports, realtor_id, request_id, amount)
+        return True
+
+    def list_transactions(self, realtor_id=None, since=None, until=None, after=None, limit=50):
+        clauses = []
+        if realtor_id:
+            clauses.append(("realtor_id = ?", str(realtor_id)))
+        if since:
+            clauses.append(("date >= ?", since))
+        if until:
+            clauses.append(("date < ?", until))
+        if after:
+            clauses.append(("(date, id) > (?, ?)", *after))
+        return self.page("transactions", clauses, ("date", "id"), limit)
+
+    def purchase_contact(self, realtor_id, request_id, price):
+        realtor_id, request_id = str(realtor_id), str(request_id)
+        with self.transaction() as (conn, exports):
+            realtor = conn.execute("SELECT balance FROM realtors WHERE telegram_id = ?", (realtor_id,)).fetchone()
+            if not realtor:
+                return "not_registered", None
+            request = conn.execute("SELECT phone FROM requests WHERE id = ?", (request_id,)).fetchone()
+            if not request:
+                return "not_found", None
+            paid = conn.execute(
+                "SELECT 1 FROM transactions WHERE realtor_id = ? AND request_id = ? LIMIT 1", (realtor_id, request_id)
+            ).fetchone()
+            if paid:
+                return "duplicate", request["phone"]
+            if int(realtor["balance"] or 0) < price:
+                return "insufficient", None
+
+            balance = int(realtor["balance"]) - price
+            conn.execute("UPDATE realtors SET balance = ? WHERE telegram_id = ?", (balance, realtor_id))
+            self._insert_transaction(conn, exports, realtor_id, request_id, price)
+            exports.append(("update", "Realtors", realtor_id, BALANCE_COL, balance))
+            self.post(conn, "purchase", realtor_id, price, request_id)
+        return "ok", request["phone"]
+
+    def refund_purchase(self, realtor_id, request_id):
+        realtor_id, request_id = str(realtor_id), str(request_id)
+        with self.transaction() as (conn, exports):
+            paid = conn.execute(
+                "SELECT amount FROM transactions WHERE realtor_id = ? AND request_id = ? LIMIT 1", (realtor_id, request_id)
+            ).fetchone()
+            if not paid:
+                return "not_found"
+            refunded = conn.execute(
+                "SELECT 1 FROM ledger WHERE ref = ? AND kind = 'refund' AND account = ? LIMIT 1",
+                (request_id, realtor_account(realtor_id))
+            ).fetchone()
+            if refunded:
+                return "already_refunded"
+            cur = conn.execute("UPDATE realtors SET balance = balance + ? WHERE telegram_id = ?", (paid["amount"], realtor_id))
+            if cur.rowcount == 0:
+                return "not_found"
+            balance = conn.execute("SELECT balance FROM realtors WHERE telegram_id = ?", (realtor_id,)).fetchone()[0]
+            exports.append(("update", "Realtors", realtor_id, BALANCE_COL, balance))
+            self.post(conn, "refund", realtor_id, paid["amount"], request_id)
+        return "ok"
+
+    def post(self, conn, kind, telegram_id, amount, ref=""):
+        """Write a ledger entry inside the caller's transaction, snapshotting accounts whose tail got long."""
+        rows = ledger_entry(kind, telegram_id, amount, ref)
+        conn.executemany(f"INSERT INTO ledger ({', '.join(LEDGER_HEADERS)}) VALUES ({', '.join('?' * len(LEDGER_HEADERS))})",
+                         [[r[h] for h in LEDGER_HEADERS] for r in rows])
+        for row in rows:
+            balance, tail, last_seq = self.ledger_balance(conn, row["account"])
+            if tail >= LEDGER_SNAPSHOT_EVERY:
+                self.snapshot(conn, row["account"], last_seq, balance)
+
+    def ledger_balance(self, conn, account):
+        """(balance, rows after the snapshot, last seq) of an account."""
+        snap = conn.execute("SELECT seq, balance FROM balance_snapshots WHERE account = ?", (account,)).fetchone()
+        seq, balance = (snap["seq"], snap["balance"]) if snap else (0, 0)
+        tail = conn.execute(
+            "SELECT COALESCE(SUM(amount), 0), COUNT(*), MAX(seq) FROM ledger WHERE account = ? AND seq > ?", (account, seq)
+        ).fetchone()
+        return balance + tail[0], tail[1], tail[2] or seq
+
+    def snapshot(self, conn, account, seq, balance):
+        conn.execute(
+            "INSERT INTO balance_snapshots VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(account) DO UPDATE SET seq = excluded.seq, balance = excluded.balance, taken_at = excluded.taken_at",
+            (account, seq, balance, str(datetime.now()))
+        )
+
+    def open_ledger(self):
+        # First start with a ledger: book the balances realtors already have as opening entries
+        with self.transaction() as (conn, exports):
+            if conn.execute("SELECT 1 FROM ledger LIMIT 1").fetchone():
+                return
+            rows = conn.execute("SELECT telegram_id, CAST(balance AS INTEGER) AS balance FROM realtors WHERE CAST(balance AS INTEGER) != 0").fetchall()
+            for r in rows:
+                self.post(conn, "opening", r["telegram_id"], r["balance"])
+            if rows:
+                logger.info(f"Opened the ledger with the balances of {len(rows)} realtors")
+
+    def get_ledger(self, telegram_id):
+        conn = self.conn()
+        key = str(telegram_id)
+        realtor = conn.execute("SELECT balance FROM realtors WHERE telegram_id = ?", (key,)).fetchone()
+        if not realtor:
+            return None
+        account = realtor_account(key)
+        recent = conn.execute(
+            f"SELECT {', '.join(LEDGER_HEADERS)} FROM ledger WHERE account = ? ORDER BY seq DESC LIMIT 20", (account,)
+        ).fetchall()
+        return {"telegram_id": key, "balance": int(realtor["balance"] or 0),
+                "ledger_balance": self.ledger_balance(conn, account)[0], "recent": [dict(r) for r in recent]}
+
+    def reconcile_ledger(self):
+        with self.transaction() as (conn, exports):
+            # Fold every account's tail into its snapshot
+            tails = conn.execute(
+                "SELECT l.account, COALESCE(s.balance, 0) + SUM(l.amount) AS balance, MAX(l.seq) AS seq "
+                "FROM ledger l LEFT JOIN balance_snapshots s ON s.account = l.account "
+                "WHERE l.seq > COALESCE(s.seq, 0) GROUP BY l.account"
+            ).fetchall()
+            for t in tails:
+                self.snapshot(conn, t["account"], t["seq"], t["balance"])
+            balances = conn.execute(
+                "SELECT r.telegram_id, r.balance, COALESCE(s.balance, 0) AS ledger FROM realtors r "
+                "LEFT JOIN balance_snapshots s ON s.account = ? || r.telegram_id", (realtor_account(""),)
+            ).fetchall()
+            # Entries are written in one transaction, so only the rows since the last check need a look
+            last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ledger").fetchone()[0]
+            found = [r[0] for r in conn.execute(
+                "SELECT entry_id FROM ledger WHERE seq > ? GROUP BY entry_id HAVING SUM(amount) != 0", (self.ledger_checked,)
+            )]
+        # The ledger is append-only, so an entry found unbalanced stays that way
+        self.ledger_checked = last
+        self.ledger_unbalanced += found
+        return drift_report(((r["telegram_id"], int(r["balance"] or 0), r["ledger"]) for r in balances), self.ledger_unbalanced)
@@ -0,0 +1,127 @@
+from utils.config import CACHE_TTL, CACHE_MAX_ENTRIES
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CacheEntry:
+    def __init__(self, value, tags):
+        self.value = value
+        self.tags = tags
+        self.loaded_at = time.time()
+        self.stale = False
+        self.refreshing = False
+
+class TaggedCache:
+    """LRU cache whose entries depend on tags ("realtors", "requests", ...).
+
+    Writes call invalidate(tag), which marks dependent entries stale
+    rather than dropping them. A stale or expired entry is still served
+    at once while a single background refresh reloads it
+    (stale-while-revalidate). Only a cold miss blocks the caller, and
+    concurrent misses of one key share a single load (single-flight).
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tag_index = {}
+        # key -> Future of the load in progress
+        self.inflight = {}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0, "evictions": 0, "errors": 0,
+                         "coalesced": 0}
+
+    def get(self, key, loader, tags=()):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if not entry.stale and time.time() - entry.loaded_at < self.ttl:
+                    self.counters["hits"] += 1
+                    return entry.value
+                self.counters["stale_hits"] += 1
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    self.executor.submit(self.refresh, key, loader, tags)
+                return entry.value
+            self.counters["misses"] += 1
+        return self.load(key, loader, tags)
+
+    def load(self, key, loader, tags):
+        with self.lock:
+            pending = self.inflight.get(key)
+            joined = pending is not None
+            if joined:
+                self.counters["coalesced"] += 1
+            else:
+                pending = self.inflight[key] = Future()
+        if joined:
+            # Someone is already loading this key; wait for their result
+            return pending.result()
+        try:
+            value = loader()
+            self.put(key, value, tags)
+            pending.set_result(value)
+            return value
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def refresh(self, key, loader, tags):
+        try:
+            self.load(key, loader, tags)
+            with self.lock:
+                self.counters["refreshes"] += 1
+        except Exception as e:
+            logger.error(f"Error refreshing cache entry {key}: {e}")
+            with self.lock:
+                self.counters["errors"] += 1
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def warm(self, key, loader, tags=()):
+        """Load an entry in the background so the first reader does not wait."""
+        self.executor.submit(self.refresh, key, loader, tags)
+
+    def put(self, key, value, tags=()):
+        with self.lock:
+            self.drop(key)
+            self.entries[key] = CacheEntry(value, tuple(tags))
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.drop(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry.tags:
+                self.tag_index.get(tag, set()).discard(key)
+
+    def invalidate(self, *tags):
+        with self.lock:
+            self.counters["invalidations"] += 1
+            for tag in tags:
+                for key in self.tag_index.get(tag, ()):
+                    self.entries[key].stale = True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self.entries),
+                "hit_ratio": round((self.counters["hits"] + self.counters["stale_hits"]) / lookups, 3) if lookups else 0.0
+            }
@@ -1,12 +1,125 @@
+import hashlib
+import logging
 import os
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SHEET_URL = os.getenv("SHEET_URL")
 GOOGLE_KEY_FILE = os.getenv("GOOGLE_KEY_FILE")
 ADMIN_IDS = [int(x.strip()) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()]
+# Password for the locked admin web endpoints (HTTP Basic, user = one of ADMIN_IDS); unset keeps them closed
+ADMIN_SECRET = os.getenv("ADMIN_SECRET", "")
+
+# Log verbosity (DEBUG shows per-approval matching details) and "text" or "json" lines
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+
+# Distinguishes processes in generated ids; give every worker sharing a store its own value (0-1023)
+WORKER_ID = int(os.getenv("WORKER_ID", os.getpid() % 1024))
+
+# Storage engine: "sqlite" (primary, with the Google Sheet as an export mirror), "sheets" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data.db")
+# Seconds an empty SQLite database waits at startup for the sheet to seed it; past that it starts empty
+# and is seeded once the sheet is reached, if nothing was written meanwhile
+SQLITE_SEED_WAIT = float(os.getenv("SQLITE_SEED_WAIT", 30))
+MOCK_DB_PATH = os.getenv("MOCK_DB_PATH", "mock_db.json")
+SHEETS_MIRROR = os.getenv("SHEETS_MIRROR", "1") == "1"
+# Worker processes started by workers.py (they share the listening socket and the SQLite database)
+WORKERS = int(os.getenv("WORKERS", 1))
+# Listening socket inherited from workers.py; unset when main.py binds PORT itself
+LISTEN_FD = int(os.getenv("LISTEN_FD")) if os.getenv("LISTEN_FD") else None
+# Singleton jobs (polling, reconciliation, broadcast dispatch) run on one elected worker:
+# "file" holds an flock on LEADER_LOCK_PATH, "lease" renews a row in the SQLite database
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "file").strip().lower()
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", "leader.lock")
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", 15))
+
+# Bot FSM (registration flow) storage: "sqlite" survives restarts and is shared by workers, "memory" is per process
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_PATH = os.getenv("FSM_PATH", "fsm.db")
+# Seconds after which a half-finished flow is treated as abandoned
+FSM_TTL = int(os.getenv("FSM_TTL", 7 * 24 * 3600))
+# Dashboard read cache: seconds before a background refresh, and max cached entries
+CACHE_TTL = float(os.getenv("CACHE_TTL", 30))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 256))
+# Mock DB journal: fsync batching period (seconds) and entries between snapshot compactions
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", 0.2))
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", 5000))
+
+# Storage worker pool (blocking Sheets calls run off the event loop)
+DB_WORKERS = int(os.getenv("DB_WORKERS", 8))
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", 16))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", 15))
+# How often the in-memory realtor index is re-read from the sheet (seconds)
+REALTOR_SYNC_INTERVAL = int(os.getenv("REALTOR_SYNC_INTERVAL", 300))
+# Write-behind buffer: flush period (seconds), queued ops before writers block, and write calls per minute
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 2))
+WRITE_MAX_PENDING = int(os.getenv("WRITE_MAX_PENDING", 500))
+WRITE_QUOTA_PER_MIN = int(os.getenv("WRITE_QUOTA_PER_MIN", 55))
+# Writes still queued at shutdown (sheet down, circuit open) are saved here and sent after the next start;
+# {name} is the buffer ("sheets" or "mirror"), "" disables
+WRITE_SPILL_PATH = os.getenv("WRITE_SPILL_PATH", "unsent_writes_{name}.json")
+# Sheets API calls: retries of 429/5xx with jittered backoff (base and cap in seconds)
+SHEETS_RETRIES = int(os.getenv("SHEETS_RETRIES", 4))
+SHEETS_BACKOFF = float(os.getenv("SHEETS_BACKOFF", 0.5))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", 8))
+# Consecutive failed calls that open the circuit, and seconds before it lets a probe through
+SHEETS_BREAKER_THRESHOLD = int(os.getenv("SHEETS_BREAKER_THRESHOLD", 5))
+SHEETS_BREAKER_COOLDOWN = float(os.getenv("SHEETS_BREAKER_COOLDOWN", 30))
+# Sheets backend: copy of the resident indexes kept on disk, served at startup while the sheet is
+# re-read in the background ("" disables), and seconds a write needing the full data waits for that re-read
+WARM_SNAPSHOT_PATH = os.getenv("WARM_SNAPSHOT_PATH", "sheets_snapshot.json")
+WARM_WRITE_WAIT = float(os.getenv("WARM_WRITE_WAIT", 5))
+
+# Admin JSON API: rows per page by default and at most
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+ADMIN_PAGE_MAX = int(os.getenv("ADMIN_PAGE_MAX", 200))
+# Request ids or balance changes accepted by one bulk admin operation
+ADMIN_BULK_MAX = int(os.getenv("ADMIN_BULK_MAX", 1000))
+# Rows an export reads from storage at a time; the response holds one such batch in memory
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", 1000))
+
+# /api/request admission: submissions per minute and burst allowed per client IP and per phone number,
+# seconds in which an identical submission returns the first one's id, and storage writers with the
+# submissions allowed to wait for them before the endpoint answers 429
+API_IP_RATE = float(os.getenv("API_IP_RATE", 10))
+API_IP_BURST = int(os.getenv("API_IP_BURST", 5))
+API_PHONE_RATE = float(os.getenv("API_PHONE_RATE", 2))
+API_PHONE_BURST = int(os.getenv("API_PHONE_BURST", 3))
+API_DEDUPE_WINDOW = float(os.getenv("API_DEDUPE_WINDOW", 120))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 100))
+# Reverse proxies in front of the app (Render has one); the client IP is read from X-Forwarded-For past them
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", 1 if os.getenv("RENDER") else 0))
+
+# Ledger: rows posted to an account before its balance is snapshotted, and seconds between drift checks
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", 50))
+LEDGER_RECONCILE_INTERVAL = int(os.getenv("LEDGER_RECONCILE_INTERVAL", 3600))
+
+# Telegram allows ~30 messages/second overall and ~1 message/second per chat
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 28))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", 1.0))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 20))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", 5))
+
+# "polling", "webhook" or "off" (web app only); webhook mode receives updates on the FastAPI app at WEBHOOK_URL + WEBHOOK_PATH
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+# Public base URL; Render provides RENDER_EXTERNAL_URL
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", os.getenv("RENDER_EXTERNAL_URL", "")).rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token; derived from the token so every worker agrees on it
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+# Webhook updates handled at once, updates accepted but not yet handled, and seconds to wait for room before answering 503
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 16))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", 2))
+# Seconds a shutting-down worker keeps handling queued updates
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", 20))
 
 channel_id_str = os.getenv("CHANNEL_ID", "")
 # Should pick the first one if multiple are provided, or use as is
@@ -15,4 +128,4 @@ if "," in channel_id_str:
 else:
     CHANNEL_ID = channel_id_str.strip()
 
-print(f"DEBUG: Loaded CHANNEL_ID='{CHANNEL_ID}'")
+logger.debug(f"Loaded CHANNEL_ID='{CHANNEL_ID}'")
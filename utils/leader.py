@@ -0,0 +1,107 @@
+from utils.config import LEADER_ELECTION, LEADER_LOCK_PATH, LEADER_LEASE_SECONDS, SQLITE_PATH, WORKER_ID
+
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+class FileLockLeader:
+    """Leader is whoever holds an exclusive flock on `path`.
+
+    The kernel drops the lock when the holder exits or crashes, so a
+    standby worker takes over on its next attempt. Works for processes on
+    one host, which is what workers.py starts.
+    """
+
+    def __init__(self, path, retry_interval=2.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self.fd = None
+
+    def try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.fd = fd
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry_interval)
+
+    async def hold(self):
+        # An flock is only lost with the process
+        await asyncio.Event().wait()
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class LeaseLeader:
+    """Leader is whoever holds an unexpired row in the `leases` table.
+
+    The holder renews it every third of `ttl`; if it stalls past `ttl`
+    another worker takes the lease and hold() returns in the old leader,
+    which must then stop its singleton jobs.
+    """
+
+    def __init__(self, path, name="leader", ttl=15.0, holder=None):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{WORKER_ID}:{os.getpid()}"
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def try_acquire(self):
+        now = time.time()
+        # Take the lease if it is free, expired or already ours, in one statement
+        cursor = self.conn.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (self.name, self.holder, now + self.ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    async def acquire(self):
+        while not await asyncio.to_thread(self.try_acquire):
+            await asyncio.sleep(self.ttl / 3)
+
+    async def hold(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                renewed = await asyncio.to_thread(self.try_acquire)
+            except Exception as e:
+                logger.error(f"Error renewing leader lease: {e}")
+                renewed = False
+            if not renewed:
+                logger.warning(f"Lost leader lease {self.name}")
+                return
+
+    def release(self):
+        try:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+        except Exception as e:
+            logger.error(f"Error releasing leader lease: {e}")
+
+def create_leader(kind=LEADER_ELECTION):
+    if kind == "lease":
+        return LeaseLeader(SQLITE_PATH, ttl=LEADER_LEASE_SECONDS)
+    return FileLockLeader(LEADER_LOCK_PATH)
+
+leader = create_leader()
@@ -0,0 +1,181 @@
+from enum import Enum
+
+import re
+
+class Region(str, Enum):
+    """Tashkent districts; values are the canonical keys stored for realtors."""
+
+    BEKTEMIR = "bektemir"
+    CHILONZOR = "chilonzor"
+    MIROBOD = "mirobod"
+    MIRZO_ULUGBEK = "mirzo ulugbek"
+    OLMAZOR = "olmazor"
+    SERGELI = "sergeli"
+    SHAYXONTOHUR = "shayxontohur"
+    UCHTEPA = "uchtepa"
+    YAKKASAROY = "yakkasaroy"
+    YASHNOBOD = "yashnobod"
+    YUNUSOBOD = "yunusobod"
+    YANGIHAYOT = "yangihayot"
+
+class DealType(str, Enum):
+    BUY = "sotib olish"
+    RENT = "ijaraga olish"
+    BOTH = "ikkisi ham"
+
+# Spellings seen in forms and older rows, after clean()
+REGION_ALIASES = {
+    "chilanzar": Region.CHILONZOR,
+    "mirabad": Region.MIROBOD,
+    "mirzo ulugbek": Region.MIRZO_ULUGBEK,
+    "mirzo ulughbek": Region.MIRZO_ULUGBEK,
+    "almazar": Region.OLMAZOR,
+    "shayxontoxur": Region.SHAYXONTOHUR,
+    "shaykhantakhur": Region.SHAYXONTOHUR,
+    "yakkasaray": Region.YAKKASAROY,
+    "yashnabad": Region.YASHNOBOD,
+    "yunusabad": Region.YUNUSOBOD,
+}
+TYPE_ALIASES = {
+    "sotib": DealType.BUY,
+    "sotish": DealType.BUY,
+    "buy": DealType.BUY,
+    "sale": DealType.BUY,
+    "ijara": DealType.RENT,
+    "ijaraga": DealType.RENT,
+    "rent": DealType.RENT,
+    "ikkisi": DealType.BOTH,
+    "both": DealType.BOTH,
+}
+REGIONS = {r.value: r for r in Region}
+TYPES = {t.value: t for t in DealType}
+
+APOSTROPHES = re.compile(r"['`‘’ʻʼ]")
+SEPARATORS = re.compile(r"[\s_-]+")
+
+def clean(text):
+    text = APOSTROPHES.sub("", str(text or "").lower())
+    text = SEPARATORS.sub(" ", text).strip()
+    return text[:-7] if text.endswith(" tumani") else text
+
+def region_key(text):
+    """Canonical region for any spelling; unknown regions keep their cleaned text so they still match each other."""
+    text = clean(text)
+    region = REGIONS.get(text) or REGION_ALIASES.get(text)
+    return region.value if region else text
+
+def deal_type(text):
+    """DealType for a form value or keyboard label; None if it is neither."""
+    text = clean(text)
+    found = TYPES.get(text) or TYPE_ALIASES.get(text)
+    if found:
+        return found
+    # Older rows hold free text, matched by substring before
+    if "ikkisi" in text or "both" in text:
+        return DealType.BOTH
+    if "ijara" in text:
+        return DealType.RENT
+    if "sotib" in text:
+        return DealType.BUY
+    return None
+
+def type_key(text):
+    found = deal_type(text)
+    return found.value if found else clean(text)
+
+class RoutingTable:
+    """Inverted index region -> deal type -> realtor ids.
+
+    Realtors who take both deal types are filed under both, so matching
+    a request is one dict lookup per level. add() refiles a realtor
+    whose region or type changed.
+    """
+
+    SIDES = (DealType.BUY.value, DealType.RENT.value)
+
+    def __init__(self):
+        self.table = {}
+        self.filed = {}
+
+    def add(self, realtor_id, region, r_type):
+        key = str(realtor_id)
+        self.remove(key)
+        region = region_key(region)
+        r_type = type_key(r_type)
+        types = self.SIDES if r_type == DealType.BOTH.value else (r_type,)
+        by_type = self.table.setdefault(region, {})
+        for t in types:
+            by_type.setdefault(t, set()).add(key)
+        self.filed[key] = (region, types)
+
+    def remove(self, realtor_id):
+        filed = self.filed.pop(str(realtor_id), None)
+        if not filed:
+            return
+        region, types = filed
+        by_type = self.table.get(region, {})
+        for t in types:
+            by_type.get(t, set()).discard(str(realtor_id))
+
+    def match(self, region, r_type):
+        """Ids of realtors serving this region and deal type; a "both" request reaches everyone in the region."""
+        by_type = self.table.get(region_key(region))
+        if not by_type:
+            return set()
+        r_type = type_key(r_type)
+        if r_type == DealType.BOTH.value:
+            return set().union(*by_type.values())
+        return set(by_type.get(r_type, ()))
+
+# Ranking hooks: each scorer(realtor, features) returns a number, higher first.
+# `features` is parsed once per request by request_features().
+
+def rooms_of(text):
+    digits = re.match(r"\s*(\d+)", str(text or ""))
+    return int(digits.group(1)) if digits else None
+
+def price_band(text):
+    """(low, high) from "200-400" or "20000+"; high is None for open bands."""
+    numbers = [int(n) for n in re.findall(r"\d+", str(text or "").replace(",", ""))]
+    if not numbers:
+        return None
+    if len(numbers) == 1:
+        return (numbers[0], None) if "+" in str(text) else (numbers[0], numbers[0])
+    return (numbers[0], numbers[1])
+
+def request_features(request):
+    return {
+        "region": region_key(request.get("region")),
+        "type": type_key(request.get("type") or request.get("request_type")),
+        "rooms": rooms_of(request.get("rooms")),
+        "price": price_band(request.get("price")),
+    }
+
+def rooms_score(realtor, features):
+    # Realtors may list the room counts they work with, e.g. "1,2,3"
+    wanted = realtor.get("rooms")
+    if not wanted or features["rooms"] is None:
+        return 0
+    return 1 if features["rooms"] in {rooms_of(r) for r in str(wanted).split(",")} else -1
+
+def price_score(realtor, features):
+    # ...and a price band like "400-1000"
+    band = price_band(realtor.get("price_band"))
+    if not band or not features["price"]:
+        return 0
+    low, high = features["price"]
+    r_low, r_high = band
+    overlaps = (high is None or high >= r_low) and (r_high is None or low <= r_high)
+    return 1 if overlaps else -1
+
+scorers = [(rooms_score, 1.0), (price_score, 1.0)]
+
+def add_scorer(scorer, weight=1.0):
+    scorers.append((scorer, weight))
+
+def rank(realtors, request):
+    """Order matched realtors by score (stable, so ties keep their order); they are notified in this order."""
+    if not scorers or len(realtors) < 2:
+        return list(realtors)
+    features = request_features(request)
+    return sorted(realtors, key=lambda r: -sum(w * s(r, features) for s, w in scorers))
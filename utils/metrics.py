@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+from bisect import bisect_left
+
+import functools
+import threading
+import time
+
+# Upper bounds in seconds, from a cache hit to a slow Sheets round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts (last slot is +Inf), then sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            items = [(key, list(counts)) for key, counts in self.values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format.
+
+    Collectors are callables run at scrape time that return
+    (name, kind, help, {label tuple: value}, label names) tuples, for
+    numbers that already live elsewhere (cache counters, queue sizes).
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                samples = collect()
+            except Exception:
+                continue
+            for name, kind, help, values, labels in samples:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{format_labels(labels, key)} {value}" for key, value in values.items()]
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+STORAGE_SECONDS = registry.histogram("storage_call_seconds", "Time spent in storage backend methods", ("backend", "method"))
+STORAGE_ERRORS = registry.counter("storage_call_errors_total", "Storage backend methods that raised", ("backend", "method"))
+SHEETS_CALLS = registry.counter("sheets_api_calls_total", "Google Sheets API calls", ("op",))
+SHEETS_ERRORS = registry.counter("sheets_api_errors_total", "Google Sheets API calls that failed", ("op",))
+SHEETS_SECONDS = registry.histogram("sheets_api_call_seconds", "Google Sheets API call latency", ("op",))
+SHEETS_RETRIED = registry.counter("sheets_api_retries_total", "Google Sheets API calls retried after 429/5xx", ("op",))
+SHEETS_BREAKER = registry.gauge("sheets_circuit_open", "1 while the Google Sheets circuit breaker is open")
+SHEETS_QUOTA_USED = registry.gauge("sheets_write_quota_used", "Sheet write calls in the last 60 seconds", ("writer",))
+SHEETS_QUOTA_LIMIT = registry.gauge("sheets_write_quota_limit", "Sheet write calls allowed per 60 seconds", ("writer",))
+LEDGER_DRIFT = registry.gauge("ledger_drift_realtors", "Realtors whose stored balance differs from the ledger at the last check")
+LEDGER_UNBALANCED = registry.gauge("ledger_unbalanced_entries", "Ledger entries whose legs do not sum to zero at the last check")
+STORAGE_COALESCED = registry.counter("storage_coalesced_calls_total", "Storage reads that joined an identical call already in flight", ("method",))
+STORAGE_STARTUP = registry.gauge("storage_startup_seconds", "Seconds it took to build the storage backend on first use")
+HANDLER_SECONDS = registry.histogram("bot_handler_seconds", "Bot handler latency", ("handler",))
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "Bot handlers that raised", ("handler",))
+API_ADMISSIONS = registry.counter("api_request_admissions_total", "POST /api/request submissions by admission outcome", ("outcome",))
+HTTP_SECONDS = registry.histogram("http_request_seconds", "Web request latency", ("method", "route", "status"))
+
+def instrument(cls, histogram=STORAGE_SECONDS, errors=STORAGE_ERRORS):
+    """Class decorator: time the methods a storage backend implements from its interface.
+
+    Helpers that are not part of the interface (conn(), apply(), ...) stay
+    unwrapped, so the timings add up to what callers actually waited for.
+    """
+    backend = getattr(cls, "name", cls.__name__)
+    interface = {name for base in cls.__mro__[1:] for name in vars(base) if not name.startswith("_")}
+    for attr, fn in list(vars(cls).items()):
+        if attr not in interface or not callable(fn) or isinstance(fn, (staticmethod, classmethod, type)):
+            continue
+        setattr(cls, attr, timed(fn, histogram, errors, backend=backend, method=attr))
+    return cls
+
+def timed(fn, histogram, errors=None, **labels):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            if errors:
+                errors.inc(**labels)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, **labels)
+    return wrapper
@@ -0,0 +1,129 @@
+from datetime import date, datetime, timedelta
+
+import threading
+
+def day_of(timestamp):
+    # Stored timestamps are str(datetime.now()): "YYYY-MM-DD HH:MM:SS.ffffff"
+    return str(timestamp or "")[:10] or str(date.today())
+
+def empty_bucket():
+    return {"requests": 0, "sales": 0, "revenue": 0, "refunds": 0, "registrations": 0}
+
+class StatsEngine:
+    """Business counters kept up to date as events happen.
+
+    Totals plus buckets per day, per region and per realtor, so the
+    dashboard header is a handful of dict lookups instead of a scan of
+    every table. rebuild() recomputes everything from stored rows once
+    at startup.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.totals = empty_bucket()
+        self.days = {}
+        self.regions = {}
+        self.realtors = {}
+        # request id -> region, to attribute sales to a region
+        self.request_regions = {}
+
+    def bump(self, day, region, field, amount=1):
+        self.totals[field] += amount
+        self.days.setdefault(day, empty_bucket())[field] += amount
+        if region:
+            self.regions.setdefault(region, empty_bucket())[field] += amount
+
+    def record_registration(self, region, at=None):
+        with self.lock:
+            self.bump(day_of(at), str(region or "").strip().lower(), "registrations")
+
+    def record_request(self, req_id, region, at=None):
+        region = str(region or "").strip().lower()
+        with self.lock:
+            self.request_regions[str(req_id)] = region
+            self.bump(day_of(at), region, "requests")
+
+    def record_sale(self, realtor_id, request_id, amount, at=None):
+        amount = int(amount or 0)
+        with self.lock:
+            day = day_of(at)
+            region = self.request_regions.get(str(request_id), "")
+            self.bump(day, region, "sales")
+            self.bump(day, region, "revenue", amount)
+            realtor = self.realtors.setdefault(str(realtor_id), {"sales": 0, "revenue": 0})
+            realtor["sales"] += 1
+            realtor["revenue"] += amount
+
+    def record_refund(self, realtor_id, request_id, amount, at=None):
+        # Revenue given back on the day of the refund, as the ledger's revenue account sees it
+        amount = int(amount or 0)
+        with self.lock:
+            day = day_of(at)
+            region = self.request_regions.get(str(request_id), "")
+            self.bump(day, region, "refunds")
+            self.bump(day, region, "revenue", -amount)
+            realtor = self.realtors.setdefault(str(realtor_id), {"sales": 0, "revenue": 0})
+            realtor["revenue"] -= amount
+
+    def rebuild(self, realtors, requests, transactions, refunds=()):
+        """Recompute from dict rows (requests before transactions, so sales get a region).
+
+        `refunds` are (realtor_id, request_id, amount, created_at) tuples.
+        """
+        with self.lock:
+            self.reset()
+        for r in realtors:
+            self.record_registration(r.get("region"), r.get("registered_at"))
+        for r in requests:
+            self.record_request(r.get("id"), r.get("region"), r.get("created_at"))
+        for t in transactions:
+            self.record_sale(t.get("realtor_id"), t.get("request_id"), t.get("amount"), t.get("date"))
+        for refund in refunds:
+            self.record_refund(*refund)
+
+    def window(self, days):
+        today = date.today()
+        bucket = empty_bucket()
+        for offset in range(days):
+            day_bucket = self.days.get(str(today - timedelta(days=offset)))
+            if day_bucket:
+                for field, value in day_bucket.items():
+                    bucket[field] += value
+        return bucket
+
+    def summary(self):
+        """Numbers for the dashboard header."""
+        with self.lock:
+            today, week = self.window(1), self.window(7)
+            return {
+                "daily_requests": today["requests"],
+                "daily_sales": today["sales"],
+                "daily_revenue": today["revenue"],
+                "weekly_requests": week["requests"],
+                "weekly_sales": week["sales"],
+                "weekly_revenue": week["revenue"],
+                "total_requests": self.totals["requests"],
+                "total_sales": self.totals["sales"],
+                "total_revenue": self.totals["revenue"],
+                "total_refunds": self.totals["refunds"],
+                "total_realtors": self.totals["registrations"]
+            }
+
+    def report(self, days=30, top=10):
+        """Per-day series for the last `days` days, per-region totals and the top realtors by revenue."""
+        with self.lock:
+            today = date.today()
+            series = []
+            for offset in reversed(range(days)):
+                day = str(today - timedelta(days=offset))
+                series.append({"date": day, **self.days.get(day, empty_bucket())})
+            best = sorted(self.realtors.items(), key=lambda item: item[1]["revenue"], reverse=True)[:top]
+            return {
+                "days": series,
+                "regions": {region: dict(bucket) for region, bucket in self.regions.items()},
+                "top_realtors": [{"telegram_id": rid, **counts} for rid, counts in best],
+                "generated_at": str(datetime.now())
+            }
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+
+from utils.config import (
+    API_IP_RATE, API_IP_BURST, API_PHONE_RATE, API_PHONE_BURST, API_DEDUPE_WINDOW,
+    INGEST_WORKERS, INGEST_QUEUE_SIZE, PROXY_HOPS
+)
+from utils.metrics import API_ADMISSIONS
+
+logger = logging.getLogger(__name__)
+
+class Throttled(Exception):
+    """Not admitted; the client may try again after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBuckets:
+    """One token bucket per key: `rate` tokens a minute, holding at most `burst`.
+
+    Only the `max_keys` most recently seen keys are remembered; a key
+    that was dropped comes back with a full bucket, which is what it
+    would have refilled to anyway unless it was very recently active.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def take(self, key):
+        """Spend a token for `key`; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+class DedupeWindow:
+    """Identical submissions within `window` seconds share the first one's result.
+
+    The first submission leaves a future here; repeats (a double click,
+    a retrying client) await it instead of writing again. A submission
+    that fails is forgotten, so a retry goes through.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.entries = OrderedDict()
+
+    def purge(self, now):
+        while self.entries:
+            key, (expires, _) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            del self.entries[key]
+
+    def get(self, key):
+        now = time.monotonic()
+        self.purge(now)
+        entry = self.entries.get(key)
+        return entry[1] if entry else None
+
+    def put(self, key, future):
+        self.entries[key] = (time.monotonic() + self.window, future)
+        self.entries.move_to_end(key)
+
+        def forget(f):
+            if f.cancelled() or f.exception() is not None:
+                self.entries.pop(key, None)
+        future.add_done_callback(forget)
+
+class IngestQueue:
+    """Submissions waiting for a storage write, handled by a fixed pool of workers.
+
+    When `maxsize` are already waiting, new ones are rejected at once
+    with a Retry-After estimated from the recent write time, so a flood
+    gets fast 429s instead of slowing every client down.
+    """
+
+    def __init__(self, write, workers=INGEST_WORKERS, maxsize=INGEST_QUEUE_SIZE):
+        self.write = write
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize)
+        self.tasks = []
+        # Moving average of one write, for Retry-After
+        self.write_seconds = 0.1
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    def submit(self, item):
+        """A future of the write's result; raises Throttled when the queue is full.
+
+        The write happens even if whoever submitted it stops waiting.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise Throttled("overloaded", self.queue.qsize() * self.write_seconds / self.workers)
+        return future
+
+    async def worker(self):
+        while True:
+            item, future = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                result = await self.write(item)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.write_seconds = 0.8 * self.write_seconds + 0.2 * (time.perf_counter() - started)
+                self.queue.task_done()
+
+    async def drain(self, timeout):
+        """Finish the accepted submissions; called on shutdown."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.queue.qsize()} submissions still queued at shutdown")
+
+class Admission:
+    """Front door of /api/request: rate limits per IP and per phone, duplicate
+    folding, then the bounded ingest queue. Limits are per process."""
+
+    def __init__(self, write):
+        self.by_ip = TokenBuckets(API_IP_RATE, API_IP_BURST)
+        self.by_phone = TokenBuckets(API_PHONE_RATE, API_PHONE_BURST)
+        self.recent = DedupeWindow(API_DEDUPE_WINDOW)
+        self.ingest = IngestQueue(write)
+
+    async def submit(self, ip, record):
+        """(request id, whether it repeats an earlier submission); raises Throttled."""
+        wait = self.by_ip.take(ip)
+        if wait:
+            API_ADMISSIONS.inc(outcome="limited_ip")
+            raise Throttled("ip", wait)
+
+        key = fingerprint(record)
+        earlier = self.recent.get(key)
+        if earlier is not None:
+            try:
+                req_id = await asyncio.shield(earlier)
+            except Exception:
+                pass  # The first one failed; treat this as a new submission
+            else:
+                API_ADMISSIONS.inc(outcome="duplicate")
+                return req_id, True
+
+        wait = self.by_phone.take(key[0])
+        if wait:
+            API_ADMISSIONS.inc(outcome="limited_phone")
+            raise Throttled("phone", wait)
+
+        try:
+            future = self.ingest.submit(record)
+        except Throttled:
+            API_ADMISSIONS.inc(outcome="overloaded")
+            raise
+        self.recent.put(key, future)
+        API_ADMISSIONS.inc(outcome="accepted")
+        return await asyncio.shield(future), False
+
+def normalize_phone(phone):
+    digits = re.sub(r"\D", "", str(phone or ""))
+    # +998 90 123 45 67 and 90 123 45 67 are the same number
+    return digits[-9:] if len(digits) >= 9 else digits
+
+def fingerprint(record):
+    # Phone first: it is also the per-phone rate limit key
+    return (normalize_phone(record.get("phone")),) + tuple(
+        " ".join(str(record.get(k) or "").lower().split()) for k in ("type", "region", "rooms", "price")
+    )
+
+def client_ip(request):
+    """The caller's address; behind PROXY_HOPS proxies it is taken from X-Forwarded-For."""
+    if PROXY_HOPS:
+        hops = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        # Each proxy appends the address it got the request from; earlier entries can be forged
+        if len(hops) >= PROXY_HOPS:
+            return hops[-PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
@@ -1,13 +1,41 @@
-from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Request, HTTPException, Form, File, UploadFile, Depends
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from utils.db import db
+from utils.db import storage
+from utils.metrics import registry, HTTP_SECONDS
+from datetime import date, timedelta
+from typing import List, Optional
+import asyncio
+import base64
+import binascii
+import csv
+import hashlib
+import hmac
+import io
+import json
 import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, so ids do not explode the series count
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                             route=getattr(route, "path", "unmatched"), status=status)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="web/static"), name="static")
 
@@ -26,100 +54,435 @@ async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from bot.loader import bot
+from bot.broadcast import broadcaster
+from bot.webhook import updates
+from web.admission import Admission, Throttled, client_ip
+from utils.backends.base import (
+    REALTOR_HEADERS, REQUEST_HEADERS, TRANSACTION_HEADERS, realtor_sort_key, request_sort_key, transaction_sort_key
+)
+from utils.matching import Region, DealType, rank, region_key, type_key
+from utils.config import (
+    WEBHOOK_PATH, UPDATE_DRAIN_TIMEOUT, ADMIN_PAGE_SIZE, ADMIN_PAGE_MAX, ADMIN_BULK_MAX, EXPORT_BATCH, ADMIN_IDS, ADMIN_SECRET
+)
+
+def admin_only(request: Request):
+    """Dependency for admin endpoints: HTTP Basic login with an admin's Telegram id and ADMIN_SECRET."""
+    if not ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Set ADMIN_SECRET to use this endpoint")
+    scheme, _, encoded = request.headers.get("authorization", "").partition(" ")
+    try:
+        user, _, password = base64.b64decode(encoded).decode().partition(":")
+    except (binascii.Error, ValueError):
+        # Malformed base64, non-ASCII in the header or a password that is not UTF-8
+        user = password = ""
+    # Any user name will do when no ADMIN_IDS are configured
+    allowed = scheme.lower() == "basic" and hmac.compare_digest(password.encode(), ADMIN_SECRET.encode()) and (
+        not ADMIN_IDS or (user.isdigit() and int(user) in ADMIN_IDS))
+    if not allowed:
+        raise HTTPException(status_code=401, detail="Admin login required", headers={"WWW-Authenticate": 'Basic realm="admin"'})
+    return user
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    if not updates.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        raise HTTPException(status_code=403, detail="Bad secret token")
+    try:
+        accepted = await updates.submit(await request.json())
+    except ValueError as e:
+        # Empty, not JSON or not an Update: acknowledged, since Telegram would redeliver it forever
+        logger.warning(f"Dropping unreadable webhook update: {e}")
+        return {"ok": False}
+    if not accepted:
+        # Not acknowledged, so Telegram keeps the update and retries
+        return JSONResponse({"ok": False}, status_code=503, headers={"Retry-After": "1"})
+    return {"ok": True}
+
+@app.on_event("shutdown")
+async def drain_updates():
+    # Handle what was already acknowledged before the process exits
+    await updates.drain(UPDATE_DRAIN_TIMEOUT)
+    await admission.ingest.drain(UPDATE_DRAIN_TIMEOUT)
+
+# Rate limits, duplicate folding and a bounded write queue in front of add_request
+admission = Admission(storage.add_request)
 
 @app.post("/api/request")
-async def submit_request(data: ClientRequest):
+async def submit_request(data: ClientRequest, request: Request):
     try:
-        req_id = db.add_request({
-            "type": data.request_type.lower(),
+        req_id, _ = await admission.submit(client_ip(request), {
+            "type": type_key(data.request_type),
             "region": data.region,
             "rooms": data.rooms,
             "price": data.price,
             "phone": data.phone
         })
-        
-        if req_id:
-            # Broadcast logic removed - moved to Admin Approval
-            return {"status": "success", "id": req_id, "message": "Moderatsiyaga yuborildi"}
-        else:
-            raise HTTPException(status_code=500, detail="Database Error")
+    except Throttled as e:
+        raise HTTPException(status_code=429, headers={"Retry-After": str(e.retry_after)},
+                            detail=f"Juda ko'p so'rov. {e.retry_after} soniyadan keyin qayta urinib ko'ring.")
     except Exception as e:
-        logging.error(f"Error submitting request: {e}")
+        logger.error(f"Error submitting request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/admin/action")
+    if not req_id:
+        raise HTTPException(status_code=500, detail="Database Error")
+    # Broadcast logic removed - moved to Admin Approval
+    return {"status": "success", "id": req_id, "message": "Moderatsiyaga yuborildi"}
+
+async def announce(req_id, data, matched=None):
+    """Queue the channel post and the offers to matching realtors for an approved request."""
+    # Broadcast to Public Channel
+    from utils.config import CHANNEL_ID
+    public_msg = (
+        f"🆕 <b>Yangi E'lon!</b>\n\n"
+        f"📍 Tuman: {data['region']}\n"
+        f"🚪 Xonalar: {data['rooms']}\n"
+        f"💰 Narx: {data['price']}\n"
+        f"📝 Turi: {data['request_type']}\n\n"
+        f"📞 Aloqa uchun botga kiring: @sotuuzbot"
+    )
+    
+    messages = []
+    if CHANNEL_ID:
+        # Convert to int if it's a numeric string (common for IDs)
+        target_chat = int(CHANNEL_ID) if str(CHANNEL_ID).replace('-', '').isdigit() else CHANNEL_ID
+        messages.append((target_chat, public_msg, None))
+    
+    # Broadcast to Targeted Realtors, best matches first
+    if matched is None:
+        matched = await storage.get_realtors_by_filter(data['region'], data['request_type'])
+    realtors = rank(matched, data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Request {req_id} matched {len(realtors)} realtors: {[r.get('telegram_id') for r in realtors]}")
+    
+    private_msg = (
+        f"🎯 <b>Sizning tumaningizda yangi so'rov!</b>\n\n"
+        f"📍 Tuman: {data['region']}\n"
+        f"🚪 Xonalar: {data['rooms']}\n"
+        f"💰 Narx: {data['price']}\n"
+        f"📝 Turi: {data['request_type']}"
+    )
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📞 Kontaktni olish (5000 so'm)", callback_data=f"buy_contact:{req_id}")]
+    ])
+    
+    for r in realtors:
+        if r.get('telegram_id'):
+            messages.append((r['telegram_id'], private_msg, kb))
+
+    # Deliver in the background; progress at /admin/broadcast/{req_id}
+    await broadcaster.submit(req_id, messages)
+
+def announcement(record):
+    return {
+        "request_type": record["type"],
+        "region": record["region"],
+        "rooms": record["rooms"],
+        "price": record["price"]
+    }
+
+@app.post("/admin/action", dependencies=[Depends(admin_only)])
 async def admin_action(req_id: str = Form(...), action: str = Form(...)):
     if action == "approve":
-        # 1. Update DB Status
-        if db.update_request_status(req_id, "Approved"):
-            
-            # 2. Get Request Data for Broadcasting
-            req_data_list = db.get_request(req_id)
-            # req_data_list: [id, type, region, rooms, price, phone, status, created_at]
-            if req_data_list:
-                data = {
-                    "request_type": req_data_list[1],
-                    "region": req_data_list[2],
-                    "rooms": req_data_list[3],
-                    "price": req_data_list[4]
-                }
-                
-                # 3. Broadcast to Public Channel
-                from utils.config import CHANNEL_ID
-                public_msg = (
-                    f"🆕 <b>Yangi E'lon!</b>\n\n"
-                    f"📍 Tuman: {data['region']}\n"
-                    f"🚪 Xonalar: {data['rooms']}\n"
-                    f"💰 Narx: {data['price']}\n"
-                    f"📝 Turi: {data['request_type']}\n\n"
-                    f"📞 Aloqa uchun botga kiring: @sotuuzbot"
-                )
-                
-                if CHANNEL_ID:
-                    try:
-                        # Convert to int if it's a numeric string (common for IDs)
-                        target_chat = int(CHANNEL_ID) if str(CHANNEL_ID).replace('-', '').isdigit() else CHANNEL_ID
-                        await bot.send_message(chat_id=target_chat, text=public_msg)
-                    except Exception as e:
-                        logging.error(f"Failed to send to channel {CHANNEL_ID}: {e}. Check if bot is Admin!")
-                
-                # 4. Broadcast to Targeted Realtors
-                r_type_filter = data['request_type']
-                realtors = db.get_realtors_by_filter(data['region'], r_type_filter)
-                
-                private_msg = (
-                    f"🎯 <b>Sizning tumaningizda yangi so'rov!</b>\n\n"
-                    f"📍 Tuman: {data['region']}\n"
-                    f"🚪 Xonalar: {data['rooms']}\n"
-                    f"💰 Narx: {data['price']}\n"
-                    f"📝 Turi: {data['request_type']}"
-                )
-                
-                kb = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text=f"📞 Kontaktni olish (5000 so'm)", callback_data=f"buy_contact:{req_id}")]
-                ])
-                
-                for r in realtors:
-                    try:
-                        if r.get('telegram_id'):
-                            await bot.send_message(chat_id=r['telegram_id'], text=private_msg, reply_markup=kb)
-                    except Exception as e:
-                        logging.error(f"Failed to send to realtor {r.get('telegram_id')}: {e}")
+        # Only a New request moves to Approved, so a resubmitted form or a bulk approval
+        # of the same request does not announce it again
+        changed = await storage.set_request_statuses([req_id], "Approved", only_from="New")
+        if changed:
+            # Channel post and realtor offers
+            await announce(req_id, announcement(changed[0]))
 
     elif action == "reject":
-        db.update_request_status(req_id, "Rejected")
+        await storage.update_request_status(req_id, "Rejected")
         
     return RedirectResponse(url="/admin", status_code=303)
-@app.get("/admin")
+
+BULK_STATUSES = {"approve": "Approved", "reject": "Rejected"}
+# Bulk approvals still announcing; held so the tasks are not garbage collected mid-way
+announcing = set()
+
+class BulkAction(BaseModel):
+    ids: List[str]
+    action: str
+
+class BalanceChange(BaseModel):
+    telegram_id: str
+    amount: int
+
+class BroadcastIds(BaseModel):
+    ids: List[str]
+
+async def announce_all(records):
+    # Requests with the same region and type share one realtor lookup
+    matches = {}
+    for record in records:
+        data = announcement(record)
+        key = (region_key(data["region"]), type_key(data["request_type"]))
+        try:
+            if key not in matches:
+                matches[key] = await storage.get_realtors_by_filter(data["region"], data["request_type"])
+            await announce(record["id"], data, matches[key])
+        except Exception as e:
+            logger.error(f"Error announcing request {record['id']}: {e}")
+
+def check_bulk_size(count):
+    if count > ADMIN_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {ADMIN_BULK_MAX} items per bulk operation")
+
+@app.post("/admin/bulk/requests", dependencies=[Depends(admin_only)])
+async def bulk_requests(data: BulkAction):
+    """Approve or reject many requests with one storage batch; announcements are queued in the background."""
+    status = BULK_STATUSES.get(data.action)
+    if not status:
+        raise HTTPException(status_code=400, detail=f"Unknown action {data.action!r}")
+    check_bulk_size(len(data.ids))
+    # Approval only moves New requests, like the single approve; rejection moves any
+    changed = await storage.set_request_statuses(data.ids, status, only_from="New" if status == "Approved" else None)
+    updated = [str(r["id"]) for r in changed]
+    if status == "Approved" and changed:
+        task = asyncio.create_task(announce_all(changed))
+        announcing.add(task)
+        task.add_done_callback(announcing.discard)
+    return {
+        "action": data.action,
+        "updated": updated,
+        # Unknown ids, requests that already had this status and, for approval, ones no longer New
+        "skipped": sorted(set(data.ids) - set(updated)),
+        "broadcasts": updated if status == "Approved" else [],
+    }
+
+@app.post("/admin/broadcasts/progress", dependencies=[Depends(admin_only)])
+async def broadcasts_progress(data: BroadcastIds):
+    check_bulk_size(len(data.ids))
+    return await asyncio.to_thread(broadcaster.summary, data.ids)
+
+async def apply_balance_changes(changes):
+    check_bulk_size(len(changes))
+    balances = await storage.update_balances(changes)
+    requested = dict.fromkeys(str(telegram_id) for telegram_id, _ in changes)
+    return {"updated": len(balances), "missing": [k for k in requested if k not in balances], "balances": balances}
+
+@app.post("/admin/bulk/balance", dependencies=[Depends(admin_only)])
+async def bulk_balance(changes: List[BalanceChange]):
+    return await apply_balance_changes([(c.telegram_id, c.amount) for c in changes])
+
+def parse_balance_csv(text):
+    """(telegram_id, amount) pairs from "telegram_id,amount" lines; a header line is optional."""
+    changes, errors = [], []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not row or not "".join(row).strip():
+            continue
+        cells = [c.strip() for c in row]
+        if line_no == 1 and not cells[0].lstrip("-").isdigit():
+            continue
+        if len(cells) < 2 or not cells[0].isdigit():
+            errors.append(f"line {line_no}: expected telegram_id,amount")
+            continue
+        try:
+            changes.append((cells[0], int(cells[1])))
+        except ValueError:
+            errors.append(f"line {line_no}: amount {cells[1]!r} is not a whole number")
+    return changes, errors
+
+@app.post("/admin/bulk/balance/csv", dependencies=[Depends(admin_only)])
+async def bulk_balance_csv(file: UploadFile = File(...)):
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
+    changes, errors = parse_balance_csv(text)
+    # Nothing is applied from a file with bad lines, so it can be fixed and uploaded again
+    if errors:
+        raise HTTPException(status_code=400, detail={"errors": errors[:50]})
+    return await apply_balance_changes(changes)
+
+@app.get("/admin/broadcast/{job_id}", dependencies=[Depends(admin_only)])
+async def broadcast_status(job_id: str):
+    # Read from the shared outbox when several workers run
+    progress = await asyncio.to_thread(broadcaster.progress, job_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return progress
+
+@app.get("/admin/updates", dependencies=[Depends(admin_only)])
+async def update_queue_status():
+    return updates.status()
+
+@registry.collector
+def runtime_metrics():
+    # A scrape must not be the one to build the backend (on the event loop, at that)
+    backend = storage.instance
+    cache = backend.cache_stats() if backend else {}
+    samples = [
+        ("storage_cache_events_total", "counter", "Read cache lookups and maintenance by outcome",
+         {(k,): v for k, v in cache.items() if k not in ("entries", "hit_ratio")}, ("event",)),
+        ("storage_cache_entries", "gauge", "Entries in the read cache", {(): cache.get("entries", 0)}, ()),
+        ("bot_updates_total", "counter", "Webhook updates by outcome",
+         {(k,): v for k, v in updates.status().items() if k != "queued"}, ("outcome",)),
+        ("bot_update_queue_size", "gauge", "Webhook updates waiting for a handler", {(): updates.status()["queued"]}, ()),
+        ("broadcast_queue_size", "gauge", "Messages waiting to be sent", {(): broadcaster.queue.qsize()}, ()),
+        ("api_ingest_queue_size", "gauge", "Submitted requests waiting to be stored",
+         {(): admission.ingest.queue.qsize()}, ()),
+    ]
+    sheets = backend.sheets_health() if backend else None
+    if sheets:
+        samples += [
+            ("sheets_up", "gauge", "1 while the Google Sheet is connected with the circuit closed",
+             {(): int(sheets["state"] == "ok")}, ()),
+            ("sheets_queued_writes", "gauge", "Sheet writes waiting to be sent", {(): sheets["queued_writes"]}, ()),
+        ]
+    return samples
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/cache", dependencies=[Depends(admin_only)])
+async def cache_status():
+    return await storage.cache_stats()
+
+@app.get("/admin/sheets", dependencies=[Depends(admin_only)])
+async def sheets_health():
+    health = await storage.sheets_health()
+    if health is None:
+        raise HTTPException(status_code=404, detail="No Google Sheet configured")
+    return health
+
+@app.get("/admin/stats", dependencies=[Depends(admin_only)])
+async def stats_report(days: int = 30):
+    return await storage.get_stats_report(max(1, min(days, 366)))
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=") if key else None
+
+def decode_cursor(cursor):
+    # Opaque to clients: the sort key of the last row they saw
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Bad cursor")
+    if not isinstance(key, list) or not all(isinstance(k, str) for k in key):
+        raise HTTPException(status_code=400, detail="Bad cursor")
+    return key
+
+def page_response(request, items, next_key):
+    body = json.dumps({"items": items, "next": encode_cursor(next_key)}, ensure_ascii=False, default=str).encode()
+    # Validator over the page itself, so it changes exactly when the rows shown do
+    etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def page_size(limit):
+    return max(1, min(limit, ADMIN_PAGE_MAX))
+
+@app.get("/admin/api/realtors", dependencies=[Depends(admin_only)])
+async def list_realtors(request: Request, region: Optional[str] = None, type: Optional[str] = None,
+                        min_balance: Optional[int] = None, max_balance: Optional[int] = None,
+                        cursor: Optional[str] = None, limit: int = ADMIN_PAGE_SIZE):
+    items, next_key = await storage.list_realtors(
+        region, type, min_balance, max_balance, decode_cursor(cursor), page_size(limit)
+    )
+    return page_response(request, items, next_key)
+
+@app.get("/admin/api/requests", dependencies=[Depends(admin_only)])
+async def list_requests(request: Request, status: Optional[str] = None, since: Optional[date] = None,
+                        until: Optional[date] = None, cursor: Optional[str] = None, limit: int = ADMIN_PAGE_SIZE):
+    # created_at is "YYYY-MM-DD HH:MM:SS..." text; `until` is inclusive, so bound by the next day
+    items, next_key = await storage.list_requests(
+        status,
+        since.isoformat() if since else None,
+        (until + timedelta(days=1)).isoformat() if until else None,
+        decode_cursor(cursor),
+        page_size(limit)
+    )
+    return page_response(request, items, next_key)
+
+# Exported tables: columns and the sort key their cursors hold
+EXPORTS = {
+    "realtors": (REALTOR_HEADERS, realtor_sort_key),
+    "requests": (REQUEST_HEADERS, request_sort_key),
+    "transactions": (TRANSACTION_HEADERS, transaction_sort_key),
+}
+EXPORT_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson; charset=utf-8"}
+
+async def export_rows(fetch, headers, sort_key, format, after, limit, header):
+    """Encoded rows, one storage batch at a time, so memory stays flat however big the table is.
+
+    Every row ends with the cursor of its own sort key: a download cut
+    short resumes with ?cursor= set to the last complete row's.
+    """
+    if format == "csv" and header:
+        out = io.StringIO()
+        csv.writer(out).writerow(headers + ["cursor"])
+        yield out.getvalue().encode()
+    sent = 0
+    while limit is None or sent < limit:
+        items, after = await fetch(after, EXPORT_BATCH if limit is None else min(EXPORT_BATCH, limit - sent))
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for item in items:
+            values = [item.get(h, "") for h in headers]
+            cursor = encode_cursor(list(sort_key(item)))
+            if format == "csv":
+                writer.writerow(values + [cursor])
+            else:
+                row = {**dict(zip(headers, values)), "cursor": cursor}
+                out.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        sent += len(items)
+        yield out.getvalue().encode()
+        if after is None:
+            break
+
+@app.get("/admin/export/{table}", dependencies=[Depends(admin_only)])
+async def export(table: str, format: str = "csv", region: Optional[str] = None, type: Optional[str] = None,
+                 status: Optional[str] = None, realtor_id: Optional[str] = None, since: Optional[date] = None,
+                 until: Optional[date] = None, cursor: Optional[str] = None, limit: Optional[int] = None,
+                 header: bool = True):
+    """Stream a whole table as CSV or JSON lines, oldest first (realtors by telegram_id).
+
+    Filters apply where the table has the column: region and type for
+    realtors, region, status and the since/until date range for requests,
+    realtor_id and the date range for transactions. Needs an admin login
+    (see admin_only).
+    """
+    if table not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown table")
+    if format not in EXPORT_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+    headers, sort_key = EXPORTS[table]
+    after = decode_cursor(cursor)
+    if after is not None and len(after) != len(sort_key({})):
+        raise HTTPException(status_code=400, detail="Bad cursor")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    since = since.isoformat() if since else None
+    until = (until + timedelta(days=1)).isoformat() if until else None
+
+    if table == "realtors":
+        async def fetch(after, size):
+            return await storage.list_realtors(region, type, after=after, limit=size)
+    elif table == "requests":
+        async def fetch(after, size):
+            return await storage.list_requests(status, since, until, after, size, region=region, newest_first=False)
+    else:
+        async def fetch(after, size):
+            return await storage.list_transactions(realtor_id, since, until, after, size)
+
+    filename = f"{table}-{date.today().isoformat()}.{format}"
+    return StreamingResponse(
+        export_rows(fetch, headers, sort_key, format, after, limit, header),
+        media_type=EXPORT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
+
+@app.get("/admin", dependencies=[Depends(admin_only)])
 async def admin_dashboard(request: Request):
-    stats = db.get_stats()
-    raw_realtors = db.get_all_realtors()
-    # Filter out empty or invalid realtor records if necessary
-    realtors = [r for r in raw_realtors if r.get('telegram_id')]
-    
-    pending_requests = db.get_pending_requests()
-    
+    # Only the counters are rendered here; the tables page through /admin/api/* as they scroll
+    stats = await storage.get_stats()
+
     from utils.config import CHANNEL_ID
     channel_valid = False
     if CHANNEL_ID and str(CHANNEL_ID).startswith("-100") and len(str(CHANNEL_ID)) > 9:
@@ -129,14 +492,37 @@ async def admin_dashboard(request: Request):
         "request": request,
         "daily_requests": stats.get("daily_requests", 0),
         "daily_sales": stats.get("daily_sales", 0),
+        "daily_revenue": stats.get("daily_revenue", 0),
+        "weekly_requests": stats.get("weekly_requests", 0),
         "total_realtors": stats.get("total_realtors", 0),
-        "realtors": realtors,
-        "pending_requests": pending_requests,
+        "regions": [r.value for r in Region],
+        "deal_types": [t.value for t in DealType],
+        "page_size": ADMIN_PAGE_SIZE,
         "channel_id": CHANNEL_ID,
         "channel_id_valid": channel_valid
     })
 
-@app.post("/admin/balance")
+@app.get("/admin/ledger/reconcile", dependencies=[Depends(admin_only)])
+async def reconcile_ledger():
+    return await storage.reconcile_ledger()
+
+@app.get("/admin/ledger/{telegram_id}", dependencies=[Depends(admin_only)])
+async def realtor_ledger(telegram_id: str):
+    ledger = await storage.get_ledger(telegram_id)
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="Realtor not found")
+    return ledger
+
+REFUND_ERRORS = {"not_found": 404, "already_refunded": 409, "error": 503}
+
+@app.post("/admin/refund", dependencies=[Depends(admin_only)])
+async def refund(telegram_id: str = Form(...), req_id: str = Form(...)):
+    status = await storage.refund_purchase(telegram_id, req_id)
+    if status in REFUND_ERRORS:
+        raise HTTPException(status_code=REFUND_ERRORS[status], detail=status)
+    return {"status": status}
+
+@app.post("/admin/balance", dependencies=[Depends(admin_only)])
 async def update_balance(telegram_id: str = Form(...), amount: int = Form(...)):
-    db.update_balance(telegram_id, amount)
+    await storage.update_balance(telegram_id, amount)
     return RedirectResponse(url="/admin", status_code=303)
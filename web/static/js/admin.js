@@ -0,0 +1,211 @@
+// Admin tables load a page at a time from /admin/api/* as they scroll into view.
+// Responses carry an ETag, so the browser revalidates unchanged pages with a 304.
+
+function cell(text) {
+    const td = document.createElement('td');
+    td.textContent = text == null ? '' : text;
+    return td;
+}
+
+function postForm(action, fields, button) {
+    const form = document.createElement('form');
+    form.action = action;
+    form.method = 'post';
+    for (const [name, value] of Object.entries(fields)) {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = value;
+        form.appendChild(input);
+    }
+    form.appendChild(button);
+    return form;
+}
+
+function button(text, color) {
+    const btn = document.createElement('button');
+    btn.type = 'submit';
+    btn.className = 'action-btn';
+    btn.textContent = text;
+    if (color) btn.style.backgroundColor = color;
+    return btn;
+}
+
+function requestRow(req) {
+    const tr = document.createElement('tr');
+    const pick = document.createElement('td');
+    if (req.status === 'New') {
+        const box = document.createElement('input');
+        box.type = 'checkbox';
+        box.className = 'pick';
+        box.value = req.id;
+        pick.appendChild(box);
+    }
+    tr.appendChild(pick);
+    for (const key of ['id', 'type', 'region', 'rooms', 'price', 'status']) {
+        tr.appendChild(cell(req[key]));
+    }
+    const actions = document.createElement('td');
+    if (req.status === 'New') {
+        const wrap = document.createElement('div');
+        wrap.className = 'form-inline';
+        wrap.appendChild(postForm('/admin/action', { req_id: req.id, action: 'approve' }, button('Tasdiqlash', '#28a745')));
+        wrap.appendChild(postForm('/admin/action', { req_id: req.id, action: 'reject' }, button('Rad etish', '#dc3545')));
+        actions.appendChild(wrap);
+    }
+    tr.appendChild(actions);
+    return tr;
+}
+
+function realtorRow(r) {
+    const tr = document.createElement('tr');
+    for (const key of ['telegram_id', 'full_name', 'phone', 'region']) {
+        tr.appendChild(cell(r[key]));
+    }
+    tr.appendChild(cell(`${r.balance} so'm`));
+
+    const amount = document.createElement('input');
+    amount.type = 'number';
+    amount.name = 'amount';
+    amount.placeholder = '+/-';
+    amount.required = true;
+    const form = postForm('/admin/balance', { telegram_id: r.telegram_id }, amount);
+    form.className = 'form-inline';
+    form.appendChild(button('Yangilash'));
+    const actions = document.createElement('td');
+    actions.appendChild(form);
+    tr.appendChild(actions);
+    return tr;
+}
+
+class PagedTable {
+    constructor(url, filters, rows, more, empty, render) {
+        this.url = url;
+        this.filters = filters;
+        this.rows = rows;
+        this.more = more;
+        this.empty = empty;
+        this.render = render;
+        this.generation = 0;
+        this.loading = null;
+
+        filters.addEventListener('submit', (e) => {
+            e.preventDefault();
+            this.reset();
+        });
+        more.addEventListener('click', () => this.load());
+        // Fetch the next page once the "more" button scrolls into view
+        new IntersectionObserver((entries) => {
+            if (entries.some((e) => e.isIntersecting)) this.load();
+        }).observe(more);
+    }
+
+    reset() {
+        this.rows.replaceChildren();
+        this.cursor = null;
+        this.done = false;
+        this.generation += 1;
+        this.load();
+    }
+
+    async load() {
+        // A reset starts a new generation, so a page still loading for old filters does not block it
+        const generation = this.generation;
+        if (this.loading === generation || this.done) return;
+        this.loading = generation;
+        const params = new URLSearchParams();
+        for (const [name, value] of new FormData(this.filters)) {
+            if (value !== '') params.set(name, value);
+        }
+        params.set('limit', window.ADMIN_PAGE_SIZE || 50);
+        if (this.cursor) params.set('cursor', this.cursor);
+
+        try {
+            const response = await fetch(`${this.url}?${params}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const page = await response.json();
+            if (generation !== this.generation) return;
+            for (const item of page.items) this.rows.appendChild(this.render(item));
+            this.cursor = page.next;
+            this.done = !page.next;
+        } catch (error) {
+            console.error(`Loading ${this.url} failed:`, error);
+        } finally {
+            if (generation === this.generation) {
+                this.loading = null;
+                this.more.hidden = this.done;
+                this.empty.hidden = this.rows.children.length > 0 || !this.done;
+            }
+        }
+    }
+}
+
+const $ = (id) => document.getElementById(id);
+
+const requests = new PagedTable('/admin/api/requests', $('requestFilters'), $('requestRows'), $('requestMore'), $('requestEmpty'), requestRow);
+const realtors = new PagedTable('/admin/api/realtors', $('realtorFilters'), $('realtorRows'), $('realtorMore'), $('realtorEmpty'), realtorRow);
+requests.reset();
+realtors.reset();
+
+async function postJson(url, body) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    const result = await response.json();
+    if (!response.ok) throw new Error(JSON.stringify(result.detail));
+    return result;
+}
+
+// Bulk moderation: one request for all ticked rows, then poll the announcements until they are sent
+$('selectAll').addEventListener('change', (e) => {
+    for (const box of document.querySelectorAll('#requestRows .pick')) box.checked = e.target.checked;
+});
+
+async function followBroadcasts(ids, status) {
+    while (true) {
+        const p = await postJson('/admin/broadcasts/progress', { ids });
+        status.textContent = `Xabarlar: ${p.sent} yuborildi, ${p.failed} xato, ${p.queued + p.retrying} navbatda`;
+        if (p.done) return;
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+}
+
+for (const btn of document.querySelectorAll('.bulk-action')) {
+    btn.addEventListener('click', async () => {
+        const ids = [...document.querySelectorAll('#requestRows .pick:checked')].map((box) => box.value);
+        const status = $('bulkStatus');
+        if (!ids.length) {
+            status.textContent = "Hech narsa tanlanmagan";
+            return;
+        }
+        status.textContent = 'Bajarilmoqda...';
+        try {
+            const result = await postJson('/admin/bulk/requests', { ids, action: btn.dataset.action });
+            status.textContent = `${result.updated.length} ta yangilandi, ${result.skipped.length} ta o'tkazib yuborildi`;
+            $('selectAll').checked = false;
+            requests.reset();
+            if (result.broadcasts.length) await followBroadcasts(result.broadcasts, status);
+        } catch (error) {
+            status.textContent = `Xato: ${error.message}`;
+        }
+    });
+}
+
+$('balanceUpload').addEventListener('submit', async (e) => {
+    e.preventDefault();
+    const status = $('balanceStatus');
+    status.textContent = 'Yuklanmoqda...';
+    try {
+        const response = await fetch('/admin/bulk/balance/csv', { method: 'POST', body: new FormData(e.target) });
+        const result = await response.json();
+        if (!response.ok) throw new Error(JSON.stringify(result.detail));
+        status.textContent = `${result.updated} ta balans yangilandi` +
+            (result.missing.length ? `, topilmadi: ${result.missing.join(', ')}` : '');
+        e.target.reset();
+        realtors.reset();
+    } catch (error) {
+        status.textContent = `Xato: ${error.message}`;
+    }
+});
@@ -0,0 +1,72 @@
+"""Run several main.py workers behind one port.
+
+    WORKERS=4 python workers.py
+
+The listening socket is bound here once and inherited by every worker,
+so the kernel spreads connections across them. Workers share the SQLite
+database (and FSM file); one of them is elected leader and runs the
+singleton jobs. Crashed workers are restarted; SIGTERM/SIGINT are passed
+on and the workers get time to drain.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from utils.config import WORKERS, STORAGE_BACKEND, WRITE_QUOTA_PER_MIN
+
+def bind(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def spawn(index, count, sock):
+    env = dict(os.environ)
+    env.update({
+        "WORKERS": str(count),
+        # Distinct WORKER_IDs keep generated ids unique across processes
+        "WORKER_ID": str(index),
+        "LISTEN_FD": str(sock.fileno()),
+        # Every worker exports its own writes to the sheet mirror; split the quota between them
+        "WRITE_QUOTA_PER_MIN": str(max(1, WRITE_QUOTA_PER_MIN // count)),
+    })
+    return subprocess.Popen([sys.executable, "main.py"], env=env, pass_fds=[sock.fileno()])
+
+def main(count=WORKERS):
+    if count > 1 and STORAGE_BACKEND != "sqlite":
+        sys.exit(f"WORKERS={count} needs STORAGE_BACKEND=sqlite; '{STORAGE_BACKEND}' keeps its state in one process")
+    sock = bind(int(os.getenv("PORT", 8002)))
+    procs = {i: spawn(i, count, sock) for i in range(count)}
+    print(f"Started {count} workers on port {os.getenv('PORT', 8002)}")
+
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        time.sleep(1)
+        for i, proc in list(procs.items()):
+            code = proc.poll()
+            if code is not None and not stopping:
+                print(f"Worker {i} exited with {code}, restarting")
+                procs[i] = spawn(i, count, sock)
+
+    for proc in procs.values():
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    sock.close()
+
+if __name__ == "__main__":
+    main()